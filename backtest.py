@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import log_loss
+
+from dataset_schema import DATASET_FILE, read_dataset
+from feature_cache import entry_path, load_entry
+from feature_store import event_numbers
+from incremental import TRAIN_PARAMS, booster_params
+from preprocessing import PREPROCESSOR_FILE, TRAIN_DATA_FILE, encode_winner
+
+
+# Walk-forward backtest: for every cutoff event, train on all earlier events
+# and predict the card of that event, as the model would have been used then.
+#
+#   python backtest.py                         retrain from scratch at every cutoff
+#   python backtest.py --warm-start            add rounds for the newest card to the previous model
+#   python backtest.py --params best_params.json
+#
+# Every worker maps the cached feature matrix read-only (see feature_cache.py),
+# so all cutoffs share one copy of it, and takes the rows of each event through
+# the event order. Cutoffs run in parallel in a process pool. Per-event results
+# go to backtest_results.csv.
+
+RESULTS_FILE = 'backtest_results.csv'
+
+# The configuration train.py uses, as xgboost.train parameters
+TRAIN_BOOSTER_PARAMS = booster_params(TRAIN_PARAMS)
+TRAIN_ROUNDS = TRAIN_PARAMS['n_estimators']
+
+# Rounds added for each new card when warm-starting
+WARM_ROUNDS = 10
+
+# Events needed before the first cutoff
+MIN_TRAIN_EVENTS = 20
+
+# Events in the rolling accuracy and log loss
+ROLLING_EVENTS = 10
+
+
+def load_event_numbers(dataset_path=DATASET_FILE):
+    # (event number, event name) of every training row, 0 being the oldest event.
+    # The dataset lists the newest events first, and the training rows are its
+    # rows with a known winner, in the same order.
+    df = read_dataset(dataset_path, columns=['event_name', 'winner'])
+    names = df.loc[encode_winner(df['winner']).notna(), 'event_name'].to_numpy()
+    return event_numbers(names), names
+
+
+def load_params(path):
+    # Parameters saved by tune.py, or train.py's configuration
+    if path is None:
+        return dict(TRAIN_BOOSTER_PARAMS), TRAIN_ROUNDS
+    with open(path) as f:
+        params = json.load(f)['params']
+    rounds = params.pop('num_boost_round')
+    params.pop('nthread', None)
+    return params, rounds
+
+
+# Mapped once in every worker process
+_x = None
+_y = None
+_order = None
+_event_starts = None
+_params = None
+
+
+def _init_worker(entry, order, event_starts, params):
+    global _x, _y, _order, _event_starts, _params
+    _x, _y, _ = load_entry(entry)
+    _order = order
+    _event_starts = event_starts
+    _params = params
+
+
+def _rows(first_event, end_event):
+    # Row numbers of events first_event .. end_event - 1
+    return _order[_event_starts[first_event]:_event_starts[end_event]]
+
+
+def _predict_card(booster, event):
+    rows = _rows(event, event + 1)
+    probabilities = booster.inplace_predict(_x[rows], validate_features=False)
+    return {'event': event, 'probabilities': probabilities, 'labels': _y[rows]}
+
+
+def _run_cutoffs(events, rounds, warm_rounds):
+    # Predict the card of every event in events. Without warm_rounds each model
+    # is trained from scratch on all earlier events; with it the first one is,
+    # and every later one adds warm_rounds rounds fitted on the cards since.
+    results = []
+    booster = None
+    trained_until = None
+    for event in events:
+        if booster is None or not warm_rounds:
+            rows = _rows(0, event)
+            dtrain = xgb.DMatrix(_x[rows], label=_y[rows])
+            booster = xgb.train(_params, dtrain, num_boost_round=rounds)
+        else:
+            rows = _rows(trained_until, event)
+            dtrain = xgb.DMatrix(_x[rows], label=_y[rows])
+            booster = xgb.train(_params, dtrain, num_boost_round=warm_rounds, xgb_model=booster)
+        trained_until = event
+        results.append(_predict_card(booster, event))
+    return results
+
+
+def _split(items, parts):
+    # parts contiguous, nearly equal slices of items
+    bounds = np.linspace(0, len(items), parts + 1).astype(int)
+    return [items[bounds[i]:bounds[i + 1]] for i in range(parts) if bounds[i] < bounds[i + 1]]
+
+
+def backtest(min_train_events=MIN_TRAIN_EVENTS, warm_start=False, warm_rounds=WARM_ROUNDS, params_path=None,
+             workers=None, rolling_events=ROLLING_EVENTS):
+    workers = workers or os.cpu_count() or 1
+    params, rounds = load_params(params_path)
+    params['nthread'] = max(1, (os.cpu_count() or 1) // workers)
+
+    entry = entry_path(TRAIN_DATA_FILE, PREPROCESSOR_FILE)
+    x, _, _ = load_entry(entry)
+    numbers, event_names = load_event_numbers()
+    if len(numbers) != len(x):
+        raise ValueError(f"{TRAIN_DATA_FILE} has {len(x)} rows but {DATASET_FILE} has {len(numbers)} "
+                         f"fights with a known winner; run prepare_ufc_data.py again")
+
+    # Oldest event first, fights of an event next to each other
+    order = np.argsort(numbers, kind='stable')
+    numbers = numbers[order]
+    event_count = int(numbers[-1]) + 1
+    event_starts = np.searchsorted(numbers, np.arange(event_count + 1))
+    names = event_names[order][event_starts[:-1]]
+
+    cutoffs = list(range(min_train_events, event_count))
+    if not cutoffs:
+        raise ValueError(f"Only {event_count} events; the backtest needs more than {min_train_events}")
+
+    # Warm-started cutoffs depend on the previous one, so each worker takes a
+    # contiguous run of them; otherwise every cutoff is a task of its own
+    if warm_start:
+        tasks = _split(cutoffs, workers)
+    else:
+        tasks = _split(cutoffs, len(cutoffs))
+
+    print(f" Backtesting {len(cutoffs)} events from {names[cutoffs[0]]} on, "
+          f"{'warm-starting' if warm_start else 'retraining'} in {workers} workers")
+    start = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(entry, order, event_starts, params)) as executor:
+        futures = [executor.submit(_run_cutoffs, events, rounds, warm_rounds if warm_start else 0)
+                   for events in tasks]
+        cards = [card for future in futures for card in future.result()]
+    elapsed = time.monotonic() - start
+
+    rows = []
+    for card in cards:
+        labels, probabilities = card['labels'], card['probabilities']
+        rows.append({
+            'event_number': card['event'],
+            'event_name': names[card['event']],
+            'fights': len(labels),
+            'correct': int(((probabilities >= 0.5) == labels).sum()),
+            'log_loss_sum': float(log_loss(labels, probabilities, labels=[0, 1], normalize=False)),
+        })
+    results = pd.DataFrame(rows)
+    results['accuracy'] = results['correct'] / results['fights']
+    results['log_loss'] = results['log_loss_sum'] / results['fights']
+
+    # Rolling over the last rolling_events cards, weighted by their number of fights
+    window = results[['fights', 'correct', 'log_loss_sum']].rolling(rolling_events, min_periods=1).sum()
+    results['rolling_accuracy'] = window['correct'] / window['fights']
+    results['rolling_log_loss'] = window['log_loss_sum'] / window['fights']
+
+    fights = results['fights'].sum()
+    print(f" {len(results)} cards, {fights} fights in {elapsed:.1f}s")
+    print(f" Accuracy {results['correct'].sum() / fights:.4f}, log loss {results['log_loss_sum'].sum() / fights:.4f}")
+    return results.drop(columns=['log_loss_sum'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Walk-forward backtest over events in date order')
+    parser.add_argument('--min-train-events', type=int, default=MIN_TRAIN_EVENTS)
+    parser.add_argument('--warm-start', action='store_true',
+                        help='add rounds for each new card to the previous model instead of retraining')
+    parser.add_argument('--warm-rounds', type=int, default=WARM_ROUNDS)
+    parser.add_argument('--params', default=None, help='best_params.json from tune.py (default: train.py settings)')
+    parser.add_argument('--workers', type=int, default=None, help='parallel processes (default: one per core)')
+    parser.add_argument('--rolling', type=int, default=ROLLING_EVENTS, help='events in the rolling metrics')
+    parser.add_argument('--out', default=RESULTS_FILE)
+    args = parser.parse_args()
+
+    results = backtest(args.min_train_events, args.warm_start, args.warm_rounds, args.params,
+                       args.workers, args.rolling)
+    results.to_csv(args.out, index=False)
+    print(results.tail(args.rolling).to_string(index=False))
+    print(f" Saved {args.out}")
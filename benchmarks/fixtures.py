@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import random
+
+from data_scraping import parse_event_page, parse_events_listing, parse_fighter_links
+from fetcher import DEFAULT_ARCHIVE
+from page_archive import PageArchive
+from reparse import EVENTS_LISTING_URL
+
+
+# A small, fixed corpus of ufcstats.com pages for the benchmarks, so they never
+# touch the network. The pages are in a page archive of their own under
+# benchmarks/fixtures, and fixtures.json lists the event, fight and fighter urls
+# in crawl order.
+#
+# A sample of 3 events is committed there and is what the benchmarks run on by
+# default. It has the whole pages, with the site's layout, whitespace and odd
+# cases: a title fight, split and unanimous decisions with judge lines, a fight
+# without statistics, a draw and a no contest (left out of the fights, as the
+# parser does), profiles without a reach or a date of birth. To benchmark on the
+# pages of your own crawl instead, copy them out of its archive over the sample:
+#
+#   python -m benchmarks.fixtures --events 20
+#
+# generate_fixtures makes any number of pages in the same markup, for timings on
+# a corpus bigger than the sample (python -m benchmarks.run --generate 200).
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURES_ARCHIVE = os.path.join(FIXTURES_DIR, 'pages')
+FIXTURES_INDEX = os.path.join(FIXTURES_DIR, 'fixtures.json')
+
+DEFAULT_EVENTS = 20
+
+# Size of the generated corpus
+GENERATED_FIGHTS_PER_EVENT = 12
+GENERATED_FIGHTERS = 300
+GENERATED_SEED = 0
+
+SITE_URL = 'http://ufcstats.com'
+STANCES = ['Orthodox', 'Southpaw', 'Switch', '']
+WEIGHT_CLASSES = ['Lightweight Bout', 'Welterweight Bout', 'Middleweight Bout', "UFC Women's Strawweight Title Bout"]
+METHODS = ['KO/TKO', 'Submission', 'Decision - Unanimous', 'Decision - Split']
+
+
+def record_fixtures(archive_path=DEFAULT_ARCHIVE, events=DEFAULT_EVENTS, out_path=FIXTURES_ARCHIVE):
+    # Copy the newest events with pages in the archive, their fights and their fighters
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    for extension in ('.pack', '.idx'):
+        if os.path.exists(out_path + extension):
+            os.remove(out_path + extension)
+
+    with PageArchive(archive_path, readonly=True) as archive, PageArchive(out_path) as fixtures:
+        listing = archive.get(EVENTS_LISTING_URL)
+        if listing is not None:
+            event_urls = [url for url in parse_events_listing(listing) if url in archive]
+        else:
+            # Archives of other hosts (e.g. a local mirror) lack the ufcstats.com listing
+            event_urls = [url for url in archive.urls() if '/event-details/' in url]
+        event_urls = event_urls[:events]
+
+        urls = {'events': [], 'fights': [], 'fighters': []}
+
+        def copy(kind, url):
+            html = archive.get(url)
+            if html is None:
+                return None
+            fixtures.put(url, html)
+            urls[kind].append(url)
+            return html
+
+        for event_url in event_urls:
+            html = copy('events', event_url)
+            for fight_url in parse_event_page(html):
+                fight_html = copy('fights', fight_url)
+                if fight_html is None:
+                    continue
+                for fighter_url in parse_fighter_links(fight_html):
+                    if fighter_url not in fixtures:
+                        copy('fighters', fighter_url)
+
+    with open(FIXTURES_INDEX if out_path == FIXTURES_ARCHIVE else out_path + '.json', 'w') as f:
+        json.dump(urls, f, indent=1)
+    return urls
+
+
+def _fighter_page(rng, i):
+    stat = ('<li class="b-list__box-list-item b-list__box-list-item_type_block">'
+            '<i class="b-list__box-item-title">{}</i> {}</li>')
+    reach = '--' if rng.random() < 0.1 else f'{rng.randint(60, 84)}"'
+    month = rng.choice(['Jan', 'Mar', 'Jun', 'Sep', 'Dec'])
+    dob = '--' if rng.random() < 0.05 else f'{month} {rng.randint(1, 28):02d}, {rng.randint(1975, 2002)}'
+    record = f'{rng.randint(0, 30)}-{rng.randint(0, 15)}-{rng.randint(0, 2)}'
+    profile = [
+        ('Height:', f"{rng.randint(5, 6)}' {rng.randint(0, 11)}\""),
+        ('Weight:', f'{rng.randint(115, 265)} lbs.'),
+        ('Reach:', reach),
+        ('STANCE:', rng.choice(STANCES)),
+        ('DOB:', dob),
+    ]
+    career = [
+        ('SLpM:', f'{rng.uniform(0, 8):.2f}'),
+        ('Str. Acc.:', f'{rng.randint(20, 70)}%'),
+        ('SApM:', f'{rng.uniform(0, 8):.2f}'),
+        ('Str. Def:', f'{rng.randint(30, 75)}%'),
+        ('', '&nbsp;'),
+        ('TD Avg.:', f'{rng.uniform(0, 5):.2f}'),
+        ('TD Acc.:', f'{rng.randint(0, 80)}%'),
+        ('TD Def.:', f'{rng.randint(0, 100)}%'),
+        ('Sub. Avg.:', f'{rng.uniform(0, 3):.1f}'),
+    ]
+    return (
+        '<html><body><h2 class="b-content__title">'
+        f'<span class="b-content__title-highlight"> Fighter {i} </span>'
+        f'<span class="b-content__title-record">Record: {record} </span></h2>'
+        '<ul class="b-list__box-list">' + ''.join(stat.format(*item) for item in profile) + '</ul>'
+        '<ul class="b-list__box-list">' + ''.join(stat.format(*item) for item in career) + '</ul>'
+        '</body></html>'
+    )
+
+
+def _fight_page(rng, event_name, red, blue, red_url, blue_url):
+    red_status, blue_status = rng.choice([('W', 'L'), ('L', 'W'), ('W', 'L'), ('D', 'D')])
+    rounds = rng.choice([3, 5])
+    if rng.random() < 0.1:
+        # Old fights have no round by round statistics
+        cells = []
+    else:
+        def landed_of(most):
+            attempted = rng.randint(0, most)
+            return f'{rng.randint(0, attempted)} of {attempted}'
+
+        # Totals table: names, then red and blue knockdowns, significant strikes
+        # and accuracy, total strikes, takedowns and accuracy, submission
+        # attempts, reversals and control time
+        cells = [f'Fighter {red}', f'Fighter {blue}', str(rng.randint(0, 2)), str(rng.randint(0, 2)),
+                 landed_of(200), landed_of(200), f'{rng.randint(0, 100)}%', f'{rng.randint(0, 100)}%',
+                 landed_of(250), landed_of(250), landed_of(10), landed_of(10),
+                 f'{rng.randint(0, 100)}%', f'{rng.randint(0, 100)}%',
+                 str(rng.randint(0, 3)), str(rng.randint(0, 3)), str(rng.randint(0, 2)), str(rng.randint(0, 2)),
+                 f'{rng.randint(0, 15)}:{rng.randint(0, 59):02d}', f'{rng.randint(0, 15)}:{rng.randint(0, 59):02d}']
+    person = ('<div class="b-fight-details__person"><i class="b-fight-details__person-status"> {} </i>'
+              '<h3 class="b-fight-details__person-name"><a class="b-link b-fight-details__person-link" href="{}">'
+              'Fighter {} </a></h3></div>')
+    item = '<i class="b-fight-details__text-item"><i class="b-fight-details__label">{}</i> {} </i>'
+    return (
+        f'<html><body><h2 class="b-content__title"> <a href="#">{event_name}</a> </h2>'
+        + person.format(red_status, red_url, red) + person.format(blue_status, blue_url, blue)
+        + f'<i class="b-fight-details__fight-title"> {rng.choice(WEIGHT_CLASSES)} </i>'
+        '<p class="b-fight-details__text"><i class="b-fight-details__text-item_first">'
+        f'<i class="b-fight-details__label">Method:</i><i style="font-style: normal"> {rng.choice(METHODS)} </i></i>'
+        + item.format('Round:', rng.randint(1, rounds))
+        + item.format('Time:', f'{rng.randint(0, 4)}:{rng.randint(0, 59):02d}')
+        + item.format('Time format:', f'{rounds} Rnd ({"-".join(["5"] * rounds)})')
+        + item.format('Referee:', '<span> Herb Dean</span>') + '</p>'
+        '<table><tbody><tr>' + ''.join(f'<p class="b-fight-details__table-text">{cell}</p>' for cell in cells)
+        + '</tr></tbody></table></body></html>'
+    )
+
+
+def generate_fixtures(events=DEFAULT_EVENTS, fights_per_event=GENERATED_FIGHTS_PER_EVENT,
+                      fighters=GENERATED_FIGHTERS, seed=GENERATED_SEED):
+    # Pages in the markup of ufcstats.com, in the layout load_fixtures returns.
+    # The same arguments always give the same pages.
+    rng = random.Random(seed)
+    fighter_urls = [f'{SITE_URL}/fighter-details/{rng.getrandbits(64):016x}' for _ in range(fighters)]
+    pages = {'events': [], 'fights': [], 'fighters': []}
+
+    # Newest event first, like the events listing
+    for e in reversed(range(events)):
+        event_url = f'{SITE_URL}/event-details/{rng.getrandbits(64):016x}'
+        rows = []
+        for _ in range(fights_per_event):
+            fight_url = f'{SITE_URL}/fight-details/{rng.getrandbits(64):016x}'
+            red, blue = rng.sample(range(fighters), 2)
+            rows.append('<tr class="b-fight-details__table-row b-fight-details__table-row__hover"><td><p>'
+                        f'<a class="b-flag b-flag_style_green" href="{fight_url}">win</a></p></td></tr>')
+            pages['fights'].append((fight_url, _fight_page(rng, f'UFC {e + 1}: Fight Night', red, blue,
+                                                           fighter_urls[red], fighter_urls[blue])))
+        pages['events'].append((event_url, '<html><body><table>' + ''.join(rows) + '</table></body></html>'))
+
+    pages['fighters'] = [(url, _fighter_page(rng, i)) for i, url in enumerate(fighter_urls)]
+    return pages
+
+
+def load_fixtures(path=FIXTURES_ARCHIVE):
+    # {'events': [(url, html)], 'fights': [...], 'fighters': [...]}, all pages read into memory
+    index_path = FIXTURES_INDEX if path == FIXTURES_ARCHIVE else path + '.json'
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"No benchmark fixtures at {path}; record them with python -m benchmarks.fixtures")
+    with open(index_path) as f:
+        urls = json.load(f)
+    with PageArchive(path, readonly=True) as archive:
+        return {kind: [(url, archive.get(url)) for url in kind_urls] for kind, kind_urls in urls.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Copy benchmark fixtures out of the page archive')
+    parser.add_argument('--archive', default=DEFAULT_ARCHIVE, help='page archive path, without extension')
+    parser.add_argument('--events', type=int, default=DEFAULT_EVENTS, help='newest events to copy')
+    args = parser.parse_args()
+
+    urls = record_fixtures(args.archive, args.events)
+    print(f" Recorded {len(urls['events'])} events, {len(urls['fights'])} fights and "
+          f"{len(urls['fighters'])} fighters to {FIXTURES_DIR}")
@@ -0,0 +1,322 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import html_backend
+from benchmarks.fixtures import FIXTURES_ARCHIVE, generate_fixtures, load_fixtures
+from data_scraping import (
+    FIGHT_DATA_FILE, FIGHTERS_STATS_FILE, build_large_dataset, calculate_diff,
+    parse_event_page, parse_fight_page, parse_fighter_links, parse_fighter_page
+)
+from feature_store import FEATURE_STORE_FILE
+from incremental import TRAIN_PARAMS
+from preprocessing import TARGET_COLUMN, FightPreprocessor, encode_winner
+from record_store import rewrite_records
+
+
+# Offline benchmarks of every stage, from parsing pages to scoring matchups,
+# run against the recorded fixtures (see benchmarks/fixtures.py).
+#
+#   python -m benchmarks.run                          every benchmark -> benchmarks/results/<time>.json
+#   python -m benchmarks.run --only parse build
+#   python -m benchmarks.run --scale 50               preprocess and train on 50 copies of the fixture fights
+#   python -m benchmarks.run --generate 200           200 events of generated pages instead of the fixtures
+#   python -m benchmarks.run --compare before.json after.json
+#
+# Times are the best of --repeat runs, in seconds unless the name says otherwise.
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+BENCHMARKS = ['parse', 'build', 'preprocessing', 'training', 'prediction']
+
+
+def best_time(function, repeat):
+    # (best wall time, result of the last run)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def percentiles(latencies):
+    latencies = np.sort(np.asarray(latencies))
+    return {
+        'p50_us': float(latencies[len(latencies) // 2] * 1e6),
+        'p99_us': float(latencies[int(len(latencies) * 0.99)] * 1e6),
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    # The parsers print while they work; that is not what is being measured
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def bench_parse(fixtures, repeat):
+    parsers = [
+        ('event_page', 'events', parse_event_page),
+        ('fight_page', 'fights', parse_fight_page),
+        ('fighter_links', 'fights', parse_fighter_links),
+        ('fighter_page', 'fighters', parse_fighter_page),
+    ]
+    results = {}
+    for name, kind, parse in parsers:
+        pages = [html for _, html in fixtures[kind]]
+        if not pages:
+            continue
+        with quiet():
+            seconds, _ = best_time(lambda: [parse(html) for html in pages], repeat)
+        results[name] = {
+            'pages': len(pages),
+            'seconds': seconds,
+            'pages_per_second': len(pages) / seconds,
+            'bytes_per_second': sum(len(html) for html in pages) / seconds,
+        }
+    return results
+
+
+def parse_records(fixtures):
+    # The fight and fighter records a crawl of the fixture pages would save
+    with quiet():
+        fight_urls, fighter_urls, fights = [], [], []
+        for url, html in fixtures['fights']:
+            fight = parse_fight_page(html)
+            fight['fight_url'] = url
+            fights.append(fight)
+            fight_urls.append(url)
+            fighter_urls.extend(parse_fighter_links(html))
+        fighters = {}
+        for url, html in fixtures['fighters']:
+            fighter = parse_fighter_page(html)
+            fighter['url'] = url
+            fighters[url] = fighter
+    return fight_urls, fighter_urls, fights, fighters
+
+
+def bench_build(fixtures, workdir, repeat):
+    # End to end, from the fixture pages to the saved dataset
+    def build():
+        fight_urls, fighter_urls, fights, fighters = parse_records(fixtures)
+        rewrite_records(FIGHT_DATA_FILE, fights)
+        rewrite_records(FIGHTERS_STATS_FILE, fighters.values())
+        with quiet():
+            return build_large_dataset(fight_urls, fighters, fighter_urls)
+
+    with working_directory(workdir):
+        seconds, dataset = best_time(build, repeat)
+        diff_seconds, _ = best_time(lambda: calculate_diff(dataset.copy()), repeat)
+    return {
+        'fights': len(dataset),
+        'seconds': seconds,
+        'fights_per_second': len(dataset) / seconds,
+        'calculate_diff_seconds': diff_seconds,
+    }, dataset
+
+
+def scaled(dataset, scale):
+    # scale copies of the dataset, for timings that mean something on a small fixture
+    return pd.concat([dataset] * scale, ignore_index=True) if scale > 1 else dataset
+
+
+def bench_preprocessing(dataset, repeat):
+    df = dataset.copy()
+    df[TARGET_COLUMN] = encode_winner(df['winner'])
+
+    def preprocess():
+        preprocessor = FightPreprocessor.fit(df)
+        return preprocessor, preprocessor.transform_array(df[df[TARGET_COLUMN].notna()])
+
+    seconds, (preprocessor, x) = best_time(preprocess, repeat)
+
+    tracemalloc.start()
+    preprocess()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'rows': len(df),
+        'features': x.shape[1],
+        'seconds': seconds,
+        'rows_per_second': len(df) / seconds,
+        'peak_traced_mb': peak / 2 ** 20,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }, preprocessor, x, df.loc[df[TARGET_COLUMN].notna(), TARGET_COLUMN].to_numpy()
+
+
+def bench_training(x, y, repeat):
+    import xgboost as xgb
+
+    def train():
+        return xgb.XGBClassifier(**TRAIN_PARAMS).fit(x, y)
+
+    seconds, model = best_time(train, repeat)
+    return {'rows': len(x), 'trees': TRAIN_PARAMS['n_estimators'], 'seconds': seconds}, model
+
+
+def bench_prediction(model, preprocessor, workdir, single=2000, batch=10000):
+    from predictor import FightPredictor
+
+    model_path = os.path.join(workdir, 'model.ubj')
+    preprocessor_path = os.path.join(workdir, 'preprocessor.json')
+    model.get_booster().save_model(model_path)
+    preprocessor.save(preprocessor_path)
+    predictor = FightPredictor(model_path, preprocessor_path, os.path.join(workdir, FIGHTERS_STATS_FILE),
+                               os.path.join(workdir, FEATURE_STORE_FILE))
+
+    names = [record['name'] for record in predictor.profiles.values()]
+    rng = np.random.default_rng(0)
+    pairs = [(names[i], names[j]) for i, j in rng.integers(len(names), size=(max(single, batch), 2))]
+
+    latencies = []
+    for red, blue in pairs[:single]:
+        start = time.perf_counter()
+        predictor.predict(red, blue)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    predictor.predict_pairs(pairs[:batch])
+    batch_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictor.matchup_matrix(names)
+    matrix_seconds = time.perf_counter() - start
+
+    return {
+        'single': {'calls': single, **percentiles(latencies)},
+        'batch': {'pairs': batch, 'seconds': batch_seconds, 'pairs_per_second': batch / batch_seconds},
+        'matrix': {'fighters': len(names), 'seconds': matrix_seconds},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(only=None, fixtures_path=FIXTURES_ARCHIVE, scale=1, repeat=3, generate=0):
+    # generate: number of events of generated pages to run on instead of the fixtures
+    only = set(only or BENCHMARKS)
+    if generate:
+        fixtures, fixtures_source = generate_fixtures(events=generate), f'generated, {generate} events'
+    else:
+        fixtures, fixtures_source = load_fixtures(fixtures_path), fixtures_path
+    import xgboost
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'xgboost': xgboost.__version__,
+            'html_parser': html_backend.PARSER_BACKEND,
+            'cpus': os.cpu_count(),
+            'fixtures': fixtures_source,
+            'pages': {kind: len(pages) for kind, pages in fixtures.items()},
+            'scale': scale,
+            'repeat': repeat,
+        },
+        'results': {},
+    }
+    results = report['results']
+
+    if 'parse' in only:
+        results['parse'] = bench_parse(fixtures, repeat)
+
+    needs_dataset = only & {'build', 'preprocessing', 'training', 'prediction'}
+    if not needs_dataset:
+        return report
+
+    with tempfile.TemporaryDirectory(prefix='benchmarks-') as workdir:
+        build_results, dataset = bench_build(fixtures, workdir, repeat if 'build' in only else 1)
+        if 'build' in only:
+            results['build'] = build_results
+
+        preprocessing_results, preprocessor, x, y = bench_preprocessing(scaled(dataset, scale), repeat)
+        if 'preprocessing' in only:
+            results['preprocessing'] = preprocessing_results
+
+        if only & {'training', 'prediction'}:
+            training_results, model = bench_training(x, y, repeat if 'training' in only else 1)
+            if 'training' in only:
+                results['training'] = training_results
+            if 'prediction' in only:
+                results['prediction'] = bench_prediction(model, preprocessor, workdir)
+
+    return report
+
+
+def flatten(results, prefix=''):
+    # {'parse': {'fight_page': {'seconds': 1}}} -> {'parse.fight_page.seconds': 1}
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{name}.'))
+        elif isinstance(value, (int, float)):
+            flat[prefix + name] = value
+    return flat
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = flatten(json.load(f)['results'])
+    with open(after_path) as f:
+        after = flatten(json.load(f)['results'])
+    for name in sorted(before.keys() & after.keys()):
+        ratio = after[name] / before[name] if before[name] else float('nan')
+        print(f" {name:<45} {before[name]:>14.6g} {after[name]:>14.6g} {ratio:>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmark parsing, dataset build, preprocessing, training and prediction')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=None)
+    parser.add_argument('--fixtures', default=FIXTURES_ARCHIVE, help='fixture archive path, without extension')
+    parser.add_argument('--generate', type=int, default=0, metavar='EVENTS',
+                        help='run on this many events of generated pages instead of the fixtures')
+    parser.add_argument('--scale', type=int, default=1, help='copies of the fixture fights to preprocess and train on')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--parser', default=None, help='HTML parser backend to benchmark')
+    parser.add_argument('--out', default=None, help='results file (default: benchmarks/results/<time>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two results files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        if args.parser:
+            html_backend.set_parser_backend(args.parser)
+        report = run(args.only, args.fixtures, args.scale, args.repeat, args.generate)
+        out = args.out or os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out, 'w') as f:
+            json.dump(report, f, indent=1)
+        for name, value in flatten(report['results']).items():
+            print(f" {name:<45} {value:.6g}")
+        print(f" Saved {out}")
@@ -0,0 +1,215 @@
+import json
+import sqlite3
+import time
+
+
+# Persistent crawl work queue in a SQLite file. Every url is one task that goes
+# pending -> leased -> done, or back to pending (with a retry delay) when it
+# fails, and to failed once it has used up its attempts. A lease expires on its
+# own, so the tasks of a worker that crashed are picked up again by the others.
+#
+# Any number of worker processes can share the file. Every state change is a
+# short IMMEDIATE transaction, so two workers never lease the same task. The
+# default rollback journal is used instead of WAL so the file can also be
+# shared between hosts over a network file system that supports locking.
+
+CRAWL_QUEUE_FILE = 'crawl_queue.db'
+
+# Stages are leased in this order, so events are expanded into fights and
+# fights into fighters as early as possible
+STAGES = ('event', 'fight', 'fighter')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    url TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    result TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, priority, position);
+"""
+
+
+class CrawlQueue:
+    def __init__(self, path=CRAWL_QUEUE_FILE, lease_seconds=300, max_attempts=5, retry_delay=5.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        # isolation_level=None: transactions are opened explicitly below
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.executescript(SCHEMA)
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+    def enqueue(self, stage, urls, start_position=0):
+        # Urls already in the queue are left as they are. start_position orders the
+        # new tasks relative to the ones already queued for the stage.
+        now = time.time()
+        rows = [
+            (url, stage, STAGES.index(stage), start_position + i, now)
+            for i, url in enumerate(urls)
+        ]
+        with self._transaction():
+            self._db.executemany(
+                "INSERT OR IGNORE INTO tasks (url, stage, priority, position, updated_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def lease(self, worker_id, limit, stages=STAGES):
+        # Take up to limit tasks that are pending, or leased by a worker whose lease ran out
+        now = time.time()
+        stage_marks = ','.join('?' * len(stages))
+
+        with self._transaction():
+            # Expired leases that already used up their attempts are not retried again
+            self._db.execute(
+                f"UPDATE tasks SET status = 'failed', last_error = 'lease expired', updated_at = ? "
+                f"WHERE status = 'leased' AND lease_expires < ? AND attempts >= ? AND stage IN ({stage_marks})",
+                (now, now, self.max_attempts, *stages)
+            )
+            rows = self._db.execute(
+                f"SELECT url, stage FROM tasks "
+                f"WHERE stage IN ({stage_marks}) AND ("
+                f"  (status = 'pending' AND not_before <= ?) OR (status = 'leased' AND lease_expires < ?)"
+                f") ORDER BY priority, position LIMIT ?",
+                (*stages, now, now, limit)
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE url = ?",
+                [(worker_id, now + self.lease_seconds, now, url) for url, _ in rows]
+            )
+
+        return rows
+
+    def complete(self, worker_id, results):
+        # Store the results of a batch of tasks and enqueue the tasks discovered on
+        # their pages, in one transaction. results is a list of (url, result, children)
+        # where children is a list of (stage, urls); they are queued behind the tasks
+        # already there. A task no longer leased by this worker (its lease expired and
+        # another worker took it) is left alone, and so are its children.
+        now = time.time()
+        with self._transaction():
+            for url, result, children in results:
+                updated = self._db.execute(
+                    "UPDATE tasks SET status = 'done', result = ?, lease_owner = NULL, lease_expires = NULL, "
+                    "last_error = NULL, updated_at = ? WHERE url = ? AND status = 'leased' AND lease_owner = ?",
+                    (json.dumps(result), now, url, worker_id)
+                ).rowcount
+                if not updated:
+                    continue
+
+                for stage, urls in children:
+                    start_position = self._db.execute(
+                        "SELECT COALESCE(MAX(position) + 1, 0) FROM tasks WHERE stage = ?", (stage,)
+                    ).fetchone()[0]
+                    self._db.executemany(
+                        "INSERT OR IGNORE INTO tasks (url, stage, priority, position, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(child, stage, STAGES.index(stage), start_position + i, now) for i, child in enumerate(urls)]
+                    )
+
+    def fail(self, worker_id, failures):
+        # Put a batch of (url, error) tasks back with an exponentially growing delay,
+        # or give up on them. Tasks no longer leased by this worker are left alone.
+        now = time.time()
+        with self._transaction():
+            for url, error in failures:
+                row = self._db.execute(
+                    "SELECT attempts FROM tasks WHERE url = ? AND status = 'leased' AND lease_owner = ?",
+                    (url, worker_id)
+                ).fetchone()
+                if row is None:
+                    continue
+
+                attempts = row[0]
+                if attempts >= self.max_attempts:
+                    status, not_before = 'failed', 0
+                else:
+                    status, not_before = 'pending', now + self.retry_delay * 2 ** (attempts - 1)
+
+                self._db.execute(
+                    "UPDATE tasks SET status = ?, not_before = ?, last_error = ?, lease_owner = NULL, "
+                    "lease_expires = NULL, updated_at = ? WHERE url = ?",
+                    (status, not_before, str(error), now, url)
+                )
+
+    def remove(self, urls):
+        # Drop tasks with their results, so enqueueing the urls again fetches them anew
+        with self._transaction():
+            self._db.executemany("DELETE FROM tasks WHERE url = ?", [(url,) for url in urls])
+
+    def retry_failed(self, stages=STAGES):
+        stage_marks = ','.join('?' * len(stages))
+        with self._transaction():
+            self._db.execute(
+                f"UPDATE tasks SET status = 'pending', attempts = 0, not_before = 0 "
+                f"WHERE status = 'failed' AND stage IN ({stage_marks})",
+                stages
+            )
+
+    def seconds_until_ready(self, stages=STAGES):
+        # 0 if a task can be leased now, the wait until the next retry or lease
+        # expiry otherwise, and None when every task is done or failed
+        stage_marks = ','.join('?' * len(stages))
+        row = self._db.execute(
+            f"SELECT MIN(CASE status WHEN 'pending' THEN not_before ELSE lease_expires END) FROM tasks "
+            f"WHERE status IN ('pending', 'leased') AND stage IN ({stage_marks})",
+            stages
+        ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def counts(self):
+        rows = self._db.execute("SELECT stage, status, COUNT(*) FROM tasks GROUP BY stage, status").fetchall()
+        counts = {}
+        for stage, status, count in rows:
+            counts.setdefault(stage, {})[status] = count
+        return counts
+
+    def results(self, stage):
+        # url -> parsed result of every finished task of a stage, in queue order
+        rows = self._db.execute(
+            "SELECT url, result FROM tasks WHERE stage = ? AND status = 'done' ORDER BY position", (stage,)
+        )
+        return {url: json.loads(result) for url, result in rows}
+
+    def failures(self, stage):
+        # url -> last error of every task of a stage that gave up
+        rows = self._db.execute(
+            "SELECT url, last_error FROM tasks WHERE stage = ? AND status = 'failed'", (stage,)
+        )
+        return dict(rows.fetchall())
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        # IMMEDIATE takes the write lock up front, so concurrent leases cannot overlap
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("COMMIT" if exc_type is None else "ROLLBACK")
@@ -0,0 +1,78 @@
+import argparse
+import os
+import socket
+
+from crawl_queue import CrawlQueue, CRAWL_QUEUE_FILE
+from data_scraping import get_completed_event_urls, run_crawl_worker, export_crawl_queue, worker_archive_path
+from fetcher import DEFAULT_CONCURRENCY
+from metrics import METRICS, set_verbose
+
+
+# Crawl ufcstats.com through the shared SQLite work queue. Start any number of
+# `work` processes, on this host or on others that share the queue file, then
+# `export` once they are done:
+#
+#   python crawl_worker.py seed
+#   python crawl_worker.py work          (as many times as you like)
+#   python crawl_worker.py status
+#   python crawl_worker.py export
+#
+# A page archive has a single writer, so every worker archives the pages it
+# fetches in its own pages-<worker id> archive, and export merges those into
+# pages.pack before the fights are parsed from it. Pass the archive of a worker
+# started with --archive to export as well:
+#
+#   python crawl_worker.py work --archive /scratch/pages-a
+#   python crawl_worker.py export --archive /scratch/pages-a
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed crawl through a shared work queue')
+    parser.add_argument('command', choices=['seed', 'work', 'status', 'retry-failed', 'export'])
+    parser.add_argument('--queue', default=CRAWL_QUEUE_FILE, help='queue database file')
+    parser.add_argument('--worker-id', default=f'{socket.gethostname()}-{os.getpid()}')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--batch-size', type=int, default=None, help='tasks leased at a time')
+    parser.add_argument('--lease-seconds', type=int, default=300, help='lease length before a task is handed out again')
+    parser.add_argument('--archive', action='append', default=[],
+                        help='work: private page archive for this worker (default: pages-<worker id>); '
+                             'export: archive of a worker started with --archive, merged along with the '
+                             'pages-<worker id> ones (can be given more than once)')
+    parser.add_argument('--verbose', action='store_true', help='print every record as it is parsed')
+    parser.add_argument('--metrics-json', default=None, help='write the run metrics to this JSON file')
+    parser.add_argument('--metrics-prom', default=None, help='write the run metrics to this Prometheus textfile')
+    args = parser.parse_args()
+    if args.verbose:
+        set_verbose(True)
+    if args.command == 'work' and len(args.archive) > 1:
+        parser.error('a worker writes to a single --archive')
+
+    with CrawlQueue(args.queue, lease_seconds=args.lease_seconds) as queue:
+        if args.command == 'seed':
+            event_urls = get_completed_event_urls()
+            queue.enqueue('event', event_urls)
+            print(f" Queued {len(event_urls)} events.")
+
+        elif args.command == 'work':
+            archive_path = args.archive[0] if args.archive else worker_archive_path(args.worker_id)
+            run_crawl_worker(queue, args.worker_id, batch_size=args.batch_size,
+                             concurrency=args.concurrency, archive_path=archive_path)
+            print(f" Worker {args.worker_id} finished, nothing left to lease.")
+
+        elif args.command == 'status':
+            for stage, counts in queue.counts().items():
+                print(f" {stage}: " + ', '.join(f'{status} {count}' for status, count in sorted(counts.items())))
+
+        elif args.command == 'retry-failed':
+            queue.retry_failed()
+            print(" Failed tasks queued again.")
+
+        elif args.command == 'export':
+            dataset = export_crawl_queue(queue, worker_archives=args.archive)
+            print(" Dataset creation complete!")
+
+    METRICS.export(args.metrics_json, args.metrics_prom)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,99 @@
-from tqdm import tqdm
-import requests
-from bs4 import BeautifulSoup
 from datetime import datetime
+import glob
 import math
 import re
 from math import nan
 import pandas as pd
 import os
 import json
+import argparse
+import time
+
+from crawl_queue import CrawlQueue, CRAWL_QUEUE_FILE, STAGES
+from dataset_schema import DATASET_FILE, DIFF_FIELDS, PROFILE_COLUMNS, read_dataset, write_dataset
+from feature_store import FEATURE_STORE_FILE, ages_at, point_in_time_features
+from fetcher import fetch_pages, DEFAULT_CONCURRENCY, DEFAULT_ARCHIVE
+from metrics import METRICS, log, set_verbose
+from page_archive import PageArchive
+from html_backend import (
+    make_soup, EVENTS_LISTING_ONLY, EVENT_PAGE_ONLY, EVENT_DETAILS_ONLY, FIGHTER_LINKS_ONLY, FIGHT_PAGE_ONLY,
+    FIGHTER_PAGE_ONLY
+)
+from record_store import RecordWriter, iter_records, iter_records_by_key, load_records_by_key, rewrite_records
+
+
+# Append-only record streams, one JSON record per line
+FIGHTERS_STATS_FILE = 'fighters_stats.jsonl'
+FIGHT_DATA_FILE = 'fight_data.jsonl'
+
+# Events already crawled, the fight urls found on each of them and their dates
+CRAWL_MANIFEST_FILE = 'crawl_manifest.json'
+
+
+def load_crawl_manifest():
+    if not os.path.exists(CRAWL_MANIFEST_FILE):
+        return {'events': {}, 'event_dates': {}}
+
+    with open(CRAWL_MANIFEST_FILE, 'r') as f:
+        manifest = json.load(f)
+    # Manifests saved before the event dates were kept
+    manifest.setdefault('event_dates', {})
+    return manifest
+
+
+def load_fight_dates():
+    # Fight url -> date of its event (YYYY-MM-DD, None when the event page showed none)
+    manifest = load_crawl_manifest()
+    return {
+        fight_url: manifest['event_dates'].get(event_url)
+        for event_url, fight_urls in manifest['events'].items() for fight_url in fight_urls
+    }
 
 
+def save_crawl_manifest(manifest):
+    # Write to a temporary file first so a crash never leaves a half-written manifest
+    manifest['updated_at'] = datetime.now().isoformat(timespec='seconds')
+    tmp_path = CRAWL_MANIFEST_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, CRAWL_MANIFEST_FILE)
 
-def get_completed_event_urls():
-    base_url = "http://ufcstats.com/statistics/events/completed?page=all"
-    response = requests.get(base_url)
 
-    if response.status_code != 200:
-        raise Exception(f"Failed to load page, status code: {response.status_code}")
-    
-    soup = BeautifulSoup(response.text, 'html.parser')
+def read_url_file(path):
+    with open(path, 'r') as f:
+        return [line.strip() for line in f.readlines()]
+
+
+def write_url_file(path, urls):
+    with open(path, 'w') as f:
+        for url in urls:
+            f.write(url + '\n')
+
+
+
+def parse_events_listing(html):
+    soup = make_soup(html, EVENTS_LISTING_ONLY)
     event_links = []
 
     for a_tag in soup.select("a.b-link.b-link_style_black"):
         href = a_tag.get('href')
         if href and '/event-details/' in href:
-            print(href)
             event_links.append(href)
-    
+
+    return event_links
+
+
+def get_completed_event_urls():
+    base_url = "http://ufcstats.com/statistics/events/completed?page=all"
+
+    def parse(url, status, html):
+        if status != 200:
+            raise Exception(f"Failed to load page, status code: {status}")
+        return parse_events_listing(html)
+
+    # The listing changes after every event, so it is always downloaded again
+    event_links = fetch_pages([base_url], parse, refresh=True)[0]
+
     # Save to file
     with open('event_urls.txt', 'w') as f:
         for url in event_links:
@@ -36,261 +103,257 @@ def get_completed_event_urls():
     return event_links
 
 
-def get_fight_urls(event_urls):
+def parse_event_page(html):
+    soup = make_soup(html, EVENT_PAGE_ONLY)
     fight_urls = []
 
-    for i, event_url in enumerate(event_urls, 1):
-        try:
-            response = requests.get(event_url)
-            if response.status_code != 200:
-                print(f" Failed to load event {event_url}")
-                continue
+    # Each fight is in a row that links to fight details
+    rows = soup.select('tr.b-fight-details__table-row__hover')
+    for row in rows:
+        link_tag = row.find('a', class_='b-flag b-flag_style_green')
+        if link_tag:
+            href = link_tag.get('href')
+            if href and '/fight-details/' in href:
+                fight_urls.append(href)
 
-            soup = BeautifulSoup(response.text, 'html.parser')
+    return fight_urls
 
-            # Each fight is in a row that links to fight details
-            rows = soup.select('tr.b-fight-details__table-row__hover')
-            for row in rows:
-                link_tag = row.find('a', class_='b-flag b-flag_style_green')
-                if link_tag:
-                    href = link_tag.get('href')
-                    if href and '/fight-details/' in href:
-                        fight_urls.append(href)
-                        print(href)
 
-            print(f" Collected fights from event {i}/{len(event_urls)}")
+def parse_event_date(html):
+    # Date of the event as YYYY-MM-DD, None when the page does not show one
+    soup = make_soup(html, EVENT_DETAILS_ONLY)
+    for item in soup.find_all('li', class_='b-list__box-list-item'):
+        text = item.get_text(' ', strip=True)
+        if text.startswith('Date:'):
+            try:
+                return datetime.strptime(text.replace('Date:', '').strip(), '%B %d, %Y').date().isoformat()
+            except ValueError:
+                return None
+    return None
+
+
+def collect_event_fight_urls(event_urls, concurrency=DEFAULT_CONCURRENCY):
+    # (fight urls, event date) of every event. None for events that failed to load.
+    def parse(event_url, status, html):
+        if status != 200:
+            log(f" Failed to load event {event_url}")
+            return None
 
+        try:
+            return parse_event_page(html), parse_event_date(html)
         except Exception as e:
-            print(f" Error scraping {event_url}: {e}")
+            METRICS.inc('parse_failures_total', stage="Collecting Fight URLs", error=type(e).__name__)
+            log(f" Error scraping {event_url}: {e}")
+            return None
+
+    return fetch_pages(event_urls, parse, concurrency, desc="Collecting Fight URLs")
+
+
+def get_fight_urls(event_urls, concurrency=DEFAULT_CONCURRENCY):
+    events = collect_event_fight_urls(event_urls, concurrency)
+
+    # Skipping an event would silently drop its fights from the dataset. The
+    # events that did load are in the page archive, so running again is cheap.
+    failed_events = [url for url, event in zip(event_urls, events) if event is None]
+    if failed_events:
+        raise Exception(f"Failed to load {len(failed_events)} events after retrying, e.g. {failed_events[0]}")
+
+    fight_urls = [url for urls, _ in events for url in urls]
 
     # Save fight URLs to file
     with open('fight_urls.txt', 'w') as f:
         for url in fight_urls:
             f.write(url + '\n')
 
+    # Remember which events have been crawled for --since-last-run
+    manifest = load_crawl_manifest()
+    for event_url, (urls, date) in zip(event_urls, events):
+        manifest['events'][event_url] = urls
+        manifest['event_dates'][event_url] = date
+    save_crawl_manifest(manifest)
+
     print(f"\nTotal fight URLs collected: {len(fight_urls)} (saved to fight_urls.txt)")
     return fight_urls
 
 
-def get_fighter_urls(fight_urls):
-    fighter_urls = []  # List to store the scraped data with the fighter stat pages
+def parse_fighter_links(html):
+    soup = make_soup(html, FIGHTER_LINKS_ONLY)
 
-    num_of_urls = len(fight_urls) * 2
-    i = 0
+    # Access all elements that contain links to the fighter's page (red first, then blue)
+    fighters_urls_element = soup.find_all('a', class_='b-link b-fight-details__person-link')
+    return [element.get('href') for element in fighters_urls_element]
 
-    # Iterating through each fight
-    for url in fight_urls:
-        # Access the page
-        response = requests.get(url)
 
-        # Check if the request was successful (status code 200)
-        if response.status_code == 200:
-            # Parse the HTML content of the page
-            soup = BeautifulSoup(response.text, 'html.parser')
+def collect_fight_fighter_urls(fight_urls, concurrency=DEFAULT_CONCURRENCY):
+    # Red and blue fighter urls of every fight, one list per fight. None for fights that failed to load.
+    def parse(url, status, html):
+        if status != 200:
+            log(f"Failed to retrieve data. Status code: {status}")
+            return None
+        return parse_fighter_links(html)
 
-            # Access all elements that contain links to the fighter's page
-            fighters_urls_element = soup.find_all('a', class_='b-link b-fight-details__person-link')
+    return fetch_pages(fight_urls, parse, concurrency, desc="Collecting Fighter URLs")
 
-            # Iterate through red and blue fighter
-            for element in fighters_urls_element:
-                fighter_url = element.get('href')
-                fighter_urls.append(fighter_url)
 
-                i += 1
-                print(f'{i} out of {num_of_urls} fighter urls collected')
+def get_fighter_urls(fight_urls, concurrency=DEFAULT_CONCURRENCY, refresh=False):
+    # The fight pages go through the crawl queue, so a page that fails is retried
+    # with a growing delay instead of ending the whole stage. With refresh=True
+    # results the queue kept from an earlier run are dropped and fetched again.
+    with CrawlQueue(CRAWL_QUEUE_FILE) as queue:
+        if refresh:
+            queue.remove(fight_urls)
+        queue.enqueue('fight', fight_urls)
+        queue.retry_failed(stages=('fight',))
+        run_crawl_worker(queue, 'get_fighter_urls', stages=('fight',), follow=False, concurrency=concurrency)
+        fight_results = queue.results('fight')
+        failures = queue.failures('fight')
+        max_attempts = queue.max_attempts
 
-        else:
-            print(f"Failed to retrieve data. Status code: {response.status_code}")
-            return None
+    failed_urls = [url for url in fight_urls if url not in fight_results]
+    if failed_urls:
+        print(f"{len(failed_urls)} fight pages failed after {max_attempts} attempts, "
+              f"e.g. {failed_urls[0]}: {failures.get(failed_urls[0])}")
+        return None
+
+    fighter_urls = [url for fight_url in fight_urls for url in fight_results[fight_url]['fighter_urls']]
 
     print('Successfully collected urls for all fighters')
     print('The urls are saved in the fighter_urls.txt')
 
-    with open('fighter_urls.txt', 'w') as file:
-        for url in fighter_urls:
-            file.write(url + "\n")
+    write_url_file('fighter_urls.txt', fighter_urls)
 
     return fighter_urls
 
 
 
-def get_fighters_stats(fighter_urls):
-    fighters_stats = []
-    i = 0
+def parse_fighter_page(html):
+    soup = make_soup(html, FIGHTER_PAGE_ONLY)
 
-    for fighter_url in fighter_urls:
-        response = requests.get(fighter_url)
+    fighter_name = soup.find('span', class_='b-content__title-highlight').text.strip()
+    fighter_record = soup.find('span', class_='b-content__title-record').text.replace('Record:', '').strip()
+    fighter_record_values = fighter_record.split('-')
+    fighter_wins = fighter_record_values[0]
+    fighter_losses = fighter_record_values[1]
+    fighter_draws = fighter_record_values[2] if len(fighter_record_values) > 2 else None
 
-        if response.status_code == 200:
-            print(fighter_url)
+    fighter_stats_elements = soup.find_all('li', class_='b-list__box-list-item b-list__box-list-item_type_block')
+    fighter_stats = [stat.get_text(strip=True) for stat in fighter_stats_elements]
 
-            soup = BeautifulSoup(response.text, 'html.parser')
+    fighter_height = fighter_stats[0]
+    if fighter_height != '--':
+        height_match = re.match(r'Height:(\d+)\' (\d+)"', fighter_height)
+        if height_match is not None:
+            feet, inches = map(int, height_match.groups())
+            height_in_cm = (feet * 30.48) + (inches * 2.54)
+        else:
+            height_in_cm = nan
+    else:
+        height_in_cm = nan
+
+    fighter_weight = fighter_stats[1]
+    if fighter_weight != '--':
+        weight_match = re.match(r'Weight:(\d+) lbs\.', fighter_weight)
+        if weight_match:
+            weight_in_lbs = int(weight_match.group(1))
+            weight_in_kg = weight_in_lbs * 0.453592
+        else:
+            weight_in_kg = nan
+    else:
+        weight_in_kg = nan
 
-            fighter_name = soup.find('span', class_='b-content__title-highlight').text.strip()
-            fighter_record = soup.find('span', class_='b-content__title-record').text.replace('Record:', '').strip()
-            fighter_record_values = fighter_record.split('-')
-            fighter_wins = fighter_record_values[0]
-            fighter_losses = fighter_record_values[1]
-            fighter_draws = fighter_record_values[2] if len(fighter_record_values) > 2 else None
+    fighter_reach = fighter_stats[2].replace('Reach:', '').strip()
+    if fighter_reach != '--':
+        reach_in_inch = fighter_reach.replace('"', '').strip()
+        reach_in_cm = int(reach_in_inch) * 2.54
+    else:
+        reach_in_cm = nan
 
-            fighter_stats_elements = soup.find_all('li', class_='b-list__box-list-item b-list__box-list-item_type_block')
-            fighter_stats = [stat.get_text(strip=True) for stat in fighter_stats_elements]
+    # The age is worked out from the date of birth at the date it is needed
+    # for: the event for a past fight (combine_large_dataset), today in predictor.py
+    fighter_dob = fighter_stats[4].replace('DOB:', '').strip()
+    if fighter_dob != '--':
+        dob = datetime.strptime(fighter_dob, '%b %d, %Y').date().isoformat()
+    else:
+        dob = None
+
+    fighter_stance = fighter_stats[3].replace('STANCE:', '').strip()
+    fighter_SLpM = fighter_stats[5].replace('SLpM:', '').strip()
+    fighter_Str_Acc = fighter_stats[6].replace('Str. Acc.:', '').rstrip('%')
+    fighter_SApM = fighter_stats[7].replace('SApM:', '').strip()
+    fighter_Str_Def = fighter_stats[8].replace('Str. Def:', '').rstrip('%')
+    fighter_TD_Avg = fighter_stats[10].replace('TD Avg.:', '').strip()
+    fighter_TD_acc = fighter_stats[11].replace('TD Acc.:', '').rstrip('%')
+    fighter_TD_def = fighter_stats[12].replace('TD Def.:', '').rstrip('%')
+    fighter_Sub_Avg = fighter_stats[13].replace('Sub. Avg.:', '').strip()
+
+    fighter_stats_dict = {
+        'name': fighter_name,
+        'wins': int(fighter_wins),
+        'losses': int(fighter_losses),
+        'height_cm': round(height_in_cm, 2) if not math.isnan(height_in_cm) else None,
+        'weight_kg': round(weight_in_kg, 2) if not math.isnan(weight_in_kg) else None,
+        'reach_cm': round(reach_in_cm, 2) if not math.isnan(reach_in_cm) else None,
+        'stance': fighter_stance,
+        'dob': dob,
+        'significant_strikes_landed_per_minute': float(fighter_SLpM),
+        'significant_strike_accuracy': float(fighter_Str_Acc) / 100,
+        'significant_strikes_absorbed_per_minute': float(fighter_SApM),
+        'significant_strike_defense': float(fighter_Str_Def) / 100,
+        'takedown_average': float(fighter_TD_Avg),
+        'takedown_accuracy': float(fighter_TD_acc) / 100,
+        'takedown_defense': float(fighter_TD_def) / 100,
+        'submission_average': float(fighter_Sub_Avg),
+    }
 
-            fighter_height = fighter_stats[0]
-            if fighter_height != '--':
-                height_match = re.match(r'Height:(\d+)\' (\d+)"', fighter_height)
-                if height_match is not None:
-                    feet, inches = map(int, height_match.groups())
-                    height_in_cm = (feet * 30.48) + (inches * 2.54)
-                else:
-                    height_in_cm = nan
-            else:
-                height_in_cm = nan
-
-            fighter_weight = fighter_stats[1]
-            if fighter_weight != '--':
-                weight_match = re.match(r'Weight:(\d+) lbs\.', fighter_weight)
-                if weight_match:
-                    weight_in_lbs = int(weight_match.group(1))
-                    weight_in_kg = weight_in_lbs * 0.453592
-                else:
-                    weight_in_kg = nan
-            else:
-                weight_in_kg = nan
-
-            fighter_reach = fighter_stats[2].replace('Reach:', '').strip()
-            if fighter_reach != '--':
-                reach_in_inch = fighter_reach.replace('"', '').strip()
-                reach_in_cm = int(reach_in_inch) * 2.54
-            else:
-                reach_in_cm = nan
-
-            fighter_dob = fighter_stats[4].replace('DOB:', '').strip()
-            if fighter_dob != '--':
-                dob = datetime.strptime(fighter_dob, '%b %d, %Y')
-                current_date = datetime.now()
-                fighter_age = current_date.year - dob.year - ((current_date.month, current_date.day) < (dob.month, dob.day))
-            else:
-                fighter_age = nan
-
-            fighter_stance = fighter_stats[3].replace('STANCE:', '').strip()
-            fighter_SLpM = fighter_stats[5].replace('SLpM:', '').strip()
-            fighter_Str_Acc = fighter_stats[6].replace('Str. Acc.:', '').rstrip('%')
-            fighter_SApM = fighter_stats[7].replace('SApM:', '').strip()
-            fighter_Str_Def = fighter_stats[8].replace('Str. Def:', '').rstrip('%')
-            fighter_TD_Avg = fighter_stats[10].replace('TD Avg.:', '').strip()
-            fighter_TD_acc = fighter_stats[11].replace('TD Acc.:', '').rstrip('%')
-            fighter_TD_def = fighter_stats[12].replace('TD Def.:', '').rstrip('%')
-            fighter_Sub_Avg = fighter_stats[13].replace('Sub. Avg.:', '').strip()
-
-            fighter_stats_dict = {
-                'name': fighter_name,
-                'wins': int(fighter_wins),
-                'losses': int(fighter_losses),
-                'height_cm': round(height_in_cm, 2) if not math.isnan(height_in_cm) else None,
-                'weight_kg': round(weight_in_kg, 2) if not math.isnan(weight_in_kg) else None,
-                'reach_cm': round(reach_in_cm, 2) if not math.isnan(reach_in_cm) else None,
-                'stance': fighter_stance,
-                'age': round(float(fighter_age)) if not math.isnan(float(fighter_age)) else None,
-                'significant_strikes_landed_per_minute': float(fighter_SLpM),
-                'significant_strike_accuracy': float(fighter_Str_Acc) / 100,
-                'significant_strikes_absorbed_per_minute': float(fighter_SApM),
-                'significant_strike_defense': float(fighter_Str_Def) / 100,
-                'takedown_average': float(fighter_TD_Avg),
-                'takedown_accuracy': float(fighter_TD_acc) / 100,
-                'takedown_defense': float(fighter_TD_def) / 100,
-                'submission_average': float(fighter_Sub_Avg),
-            }
-
-            fighters_stats.append(fighter_stats_dict)
-            i += 1
-            print(i, "out of", len(fighter_urls))
-
-            # with open('fighters_stats.txt', 'a') as file:
-            #     for key, value in fighter_stats_dict.items():
-            #         file.write(f"{key}: {value}\n")
-            #     file.write("\n")
-
-            # Save to JSON at the end
-            with open("fighters_stats.json", "w") as f:
-                json.dump(fighters_stats, f, indent=2)
-
-            print('Data has been saved to the file\n')
-            print(fighter_stats_dict)
+    return fighter_stats_dict
 
-    return fighters_stats
 
+def get_fighters_stats(fighter_urls, fighters_stats=None, refresh=False, concurrency=DEFAULT_CONCURRENCY):
+    # Fighter profiles keyed by fighter url. Most fighters appear in many fights,
+    # so each profile is only fetched and parsed once, and profiles already in
+    # fighters_stats (or saved by an earlier, possibly interrupted run) are not
+    # fetched again unless refresh is set.
+    if fighters_stats is None:
+        fighters_stats = load_records_by_key(FIGHTERS_STATS_FILE, 'url')
+        print(f" Loaded {len(fighters_stats)} fighter profiles from {FIGHTERS_STATS_FILE}.")
+    fighters_stats = dict(fighters_stats)
+    missing_urls = list(dict.fromkeys(url for url in fighter_urls if refresh or url not in fighters_stats))
+
+    # Each profile is appended to the file as soon as it is parsed. A refreshed
+    # profile is appended again and replaces the older line when loaded.
+    with RecordWriter(FIGHTERS_STATS_FILE) as writer:
+        def parse(fighter_url, status, html):
+            if status != 200:
+                return None
+
+            fighter = parse_fighter_page(html)
+            fighter['url'] = fighter_url
+            writer.write(fighter)
+            return fighter
+
+        # Refreshed profiles are downloaded again instead of being served from the page archive
+        fighter_pages = fetch_pages(missing_urls, parse, concurrency, desc="Collecting Fighter Stats", refresh=refresh)
+
+    for fighter_url, fighter in zip(missing_urls, fighter_pages):
+        if fighter is not None:
+            fighters_stats[fighter_url] = fighter
+
+    print(f'{len(fighters_stats)} unique fighters saved to {FIGHTERS_STATS_FILE}')
+
+    return fighters_stats
 
-def get_red_fighters_stats(fighters_stats):
-    red_fighters_stats = []
-    for index, fighter in enumerate(fighters_stats):
-        if index % 2 == 0:  # Even index, red fighter
-            red_fighters_stats.append(fighter)
-    return red_fighters_stats
-
-def get_blue_fighters_stats(fighters_stats):
-    blue_fighters_stats = []
-    for index, fighter in enumerate(fighters_stats):
-        if index % 2 != 0:  # Odd index, blue fighter
-            blue_fighters_stats.append(fighter)
-    return blue_fighters_stats
-
-
-
-def create_r_fighter_dicts(red_fighters_stats):
-    red_fighter_dicts = []
-    for red_fighter_stat in red_fighters_stats:
-        red_fighter_dict = {
-            'red_total_wins': red_fighter_stat['wins'],
-            'red_total_losses': red_fighter_stat['losses'],
-            'red_age': red_fighter_stat['age'],
-            'red_height_cm': red_fighter_stat['height_cm'],
-            'red_weight_kg': red_fighter_stat['weight_kg'],
-            'red_reach_cm': red_fighter_stat['reach_cm'],
-            'red_stance': red_fighter_stat['stance'],
-            'red_significant_strikes_landed_per_minute': red_fighter_stat['significant_strikes_landed_per_minute'],
-            'red_significant_strikes_absorbed_per_minute': red_fighter_stat['significant_strikes_absorbed_per_minute'],
-            'red_significant_strike_accuracy': red_fighter_stat['significant_strike_accuracy'],
-            'red_takedown_accuracy': red_fighter_stat['takedown_accuracy'],
-            'red_significant_strike_defense': red_fighter_stat['significant_strike_defense'],
-            'red_takedown_defense': red_fighter_stat['takedown_defense'],
-            'red_submission_average': red_fighter_stat['submission_average'],
-            'red_takedown_average': red_fighter_stat['takedown_average']
-        }
-        red_fighter_dicts.append(red_fighter_dict)
-    return red_fighter_dicts
-
-
-def create_b_fighter_dicts(blue_fighters_stats):
-    blue_fighter_dicts = []
-    for blue_fighter_stat in blue_fighters_stats:
-        blue_fighter_dict = {
-            'blue_total_wins': blue_fighter_stat['wins'],
-            'blue_total_losses': blue_fighter_stat['losses'],
-            'blue_age': blue_fighter_stat['age'],
-            'blue_height_cm': blue_fighter_stat['height_cm'],
-            'blue_weight_kg': blue_fighter_stat['weight_kg'],
-            'blue_reach_cm': blue_fighter_stat['reach_cm'],
-            'blue_stance': blue_fighter_stat['stance'],
-            'blue_significant_strikes_landed_per_minute': blue_fighter_stat['significant_strikes_landed_per_minute'],
-            'blue_significant_strikes_absorbed_per_minute': blue_fighter_stat['significant_strikes_absorbed_per_minute'],
-            'blue_significant_strike_accuracy': blue_fighter_stat['significant_strike_accuracy'],
-            'blue_takedown_accuracy': blue_fighter_stat['takedown_accuracy'],
-            'blue_significant_strike_defense': blue_fighter_stat['significant_strike_defense'],
-            'blue_takedown_defense': blue_fighter_stat['takedown_defense'],
-            'blue_submission_average': blue_fighter_stat['submission_average'],
-            'blue_takedown_average': blue_fighter_stat['takedown_average']
-        }
-        blue_fighter_dicts.append(blue_fighter_dict)
-    return blue_fighter_dicts
 
+# Join keys, dropped from the final dataset
+KEY_COLUMNS = ['fight_url', 'red_fighter_url', 'blue_fighter_url']
 
+# Only in fight records saved before the fight stats got their red_fight_ and blue_fight_ prefix
+LEGACY_FIGHT_KEY = 'red_knockdowns'
 
 
 
 def create_stats_dict(current_fight_stats):
-    print("Length of current_fight_dict:", len(current_fight_stats))
-    print("current_fight_dict:", current_fight_stats)
+    log("Length of current_fight_dict:", len(current_fight_stats))
+    log("current_fight_dict:", current_fight_stats)
 
     if len(current_fight_stats) >= 11:
         # Red
@@ -459,103 +522,99 @@ def create_common_dict(soup):
 
 
 
-def get_fight_data(fight_urls):
-    all_fight_data = []  # List to store the full scraped fight data
+def parse_fight_page(html):
+    soup = make_soup(html, FIGHT_PAGE_ONLY)
 
-    for index, fight_url in enumerate(fight_urls):
-        print(f'Processing {index+1}/{len(fight_urls)}: {fight_url}')
+    # Extract shared/common fight details (event, fighters, outcome, etc.)
+    common_dict = create_common_dict(soup)
 
-        response = requests.get(fight_url)
-        if response.status_code != 200:
-            print(f"Failed to retrieve data. Status code: {response.status_code}")
-            continue
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Extract shared/common fight details (event, fighters, outcome, etc.)
-        common_dict = create_common_dict(soup)
+    # Extract statistical data from "Totals" section of the fight
+    stats_data = []
+    stats_tags = soup.find_all('p', class_='b-fight-details__table-text')
+    for s in stats_tags:
+        stat = s.text.strip()
+        stats_data.append(stat)
 
-        # Extract statistical data from "Totals" section of the fight
-        stats_data = []
-        stats_tags = soup.find_all('p', class_='b-fight-details__table-text')
-        for s in stats_tags:
-            stat = s.text.strip()
-            stats_data.append(stat)
-
-        # Get the 'totals' stats (first 20 elements)
-        if stats_data:
-            current_fight_stats = stats_data[0:20]
-        else:
-            current_fight_stats = []
+    # Get the 'totals' stats (first 20 elements)
+    if stats_data:
+        current_fight_stats = stats_data[0:20]
+    else:
+        current_fight_stats = []
 
-        # Build totals_dict based on available data
-        totals_dict = create_stats_dict(current_fight_stats)
+    # Build totals_dict based on available data
+    totals_dict = create_stats_dict(current_fight_stats)
 
-        # Combine and store result
-        full_fight_dict = {**common_dict, **totals_dict}
-        all_fight_data.append(full_fight_dict)
+    # Fighter profile urls, used to join the profiles onto the fight (red first, then blue)
+    fighter_links = soup.find_all('a', class_='b-link b-fight-details__person-link')
+    fighter_urls = [link.get('href') for link in fighter_links] + [None, None]
+    keys_dict = {'red_fighter_url': fighter_urls[0], 'blue_fighter_url': fighter_urls[1]}
 
+    # Combine common and totals into the full fight record
+    return {**common_dict, **totals_dict, **keys_dict}
 
-    # Save data to JSON file
-    with open("fight_data.json", "w") as f:
-        json.dump(all_fight_data, f, indent=2)
 
-    print(f" Saved {len(all_fight_data)} fights to fight_data.json")
+def get_fight_data(fight_urls, concurrency=DEFAULT_CONCURRENCY):
+    # Fights already saved by an earlier, possibly interrupted run are skipped.
+    # Records of the old layout, without the red_fight_/blue_fight_ prefix, are
+    # collected again; the new line replaces the old one when they are read.
+    saved_fights = {record['fight_url'] for record in iter_records(FIGHT_DATA_FILE)
+                    if LEGACY_FIGHT_KEY not in record}
+    missing_urls = [url for url in dict.fromkeys(fight_urls) if url not in saved_fights]
+    print(f" {len(saved_fights)} fights already saved, {len(missing_urls)} left to collect.")
 
+    # Each fight is appended to the file as soon as it is parsed
+    with RecordWriter(FIGHT_DATA_FILE) as writer:
+        def parse(fight_url, status, html):
+            if status != 200:
+                log(f"Failed to retrieve data. Status code: {status}")
+                return False
 
-    return all_fight_data
+            fight = parse_fight_page(html)
+            fight['fight_url'] = fight_url
+            writer.write(fight)
+            return True
 
+        fight_pages = fetch_pages(missing_urls, parse, concurrency, desc="Collecting Fight Data")
 
+    print(f" Saved {sum(fight_pages)} fights to {FIGHT_DATA_FILE}")
 
+    return load_fight_data(fight_urls)
 
 
-def combine_fight_and_personal_stats(total_page_dicts, red_fighters_dicts, blue_fighters_dicts):
-    # Convert dictionaries to DataFrames
-    total_fight_stats_df = pd.DataFrame(total_page_dicts)
-    red_fighters_df = pd.DataFrame(red_fighters_dicts)
-    blue_fighters_df = pd.DataFrame(blue_fighters_dicts)
+def load_fight_data(fight_urls):
+    # Records are read lazily from the file, in the same order as fight_urls.
+    # get_fight_data collects old-layout records again, and the pipeline's
+    # extract stage rebuilds the file when the parser changes (see pipeline.py).
+    return iter_records_by_key(FIGHT_DATA_FILE, fight_urls, key='fight_url')
 
-    # Define index columns for splitting
-    red_split_column = 'r_ctrl_sec'  # Previously 'r_ctrl'
-    blue_split_column = 'b_ctrl_sec'  # Previously 'b_ctrl'
-    red_split_index = 24
-    blue_split_index = 14
 
-    # Split total fight stats into red-related, blue-related, and diff portions
-    red_stats_df = total_fight_stats_df.iloc[:, :red_split_index + 1]
-    blue_and_diff_df = total_fight_stats_df.iloc[:, red_split_index + 1:]
+def combine_fight_and_personal_stats(fights_df, fighters_stats):
+    # One row per fighter profile, keyed by url, with the dataset column names
+    profiles_df = pd.DataFrame.from_records(
+        list(fighters_stats.values()), columns=['url', *PROFILE_COLUMNS]
+    ).drop_duplicates('url', keep='last').set_index('url').rename(columns=PROFILE_COLUMNS)
 
-    blue_stats_df = blue_and_diff_df.iloc[:, :blue_split_index + 1]
-    diff_stats_df = blue_and_diff_df.iloc[:, blue_split_index + 1:]
+    # Left joins, so a fight whose profile is missing keeps its row with empty profile columns
+    red_profiles_df = profiles_df.add_prefix('red_')
+    blue_profiles_df = profiles_df.add_prefix('blue_')
+    combined_df = fights_df.join(red_profiles_df, on='red_fighter_url').join(blue_profiles_df, on='blue_fighter_url')
 
-    # Combine all parts horizontally
-    red_combined_df = pd.concat([red_stats_df, red_fighters_df], axis=1)
-    blue_combined_df = pd.concat([blue_stats_df, blue_fighters_df], axis=1)
-    final_combined_df = pd.concat([red_combined_df, blue_combined_df, diff_stats_df], axis=1)
+    # Column order: common and red fight stats, red profile, blue fight stats, blue profile
+    fight_columns = [column for column in fights_df.columns if column not in KEY_COLUMNS]
+    red_end = max((i + 1 for i, column in enumerate(fight_columns) if column.startswith('red_fight_')), default=0)
+    ordered_columns = (
+        fight_columns[:red_end] + list(red_profiles_df.columns)
+        + fight_columns[red_end:] + list(blue_profiles_df.columns)
+    )
 
-    return final_combined_df
+    return combined_df[ordered_columns].reset_index(drop=True)
 
 
 
 
 def calculate_diff(df):
-    # Columns where taking the difference makes logical sense
-    columns_to_calculate_diff = [
-        'fight_knockdowns',
-        'fight_significant_strikes_landed', 'fight_significant_strikes_attempted', 'fight_significant_strike_accuracy',
-        'fight_total_strikes_landed', 'fight_total_strikes_attempted', 'fight_total_strike_accuracy',
-        'fight_takedowns_landed', 'fight_takedown_attempts', 'fight_takedown_accuracy',
-        'fight_submission_attempts', 'fight_reversals', 'fight_control_time_seconds',
-
-        'total_wins', 'total_losses',
-        'age', 'height_cm', 'weight_kg', 'reach_cm',
-        'significant_strikes_landed_per_minute', 'significant_strikes_absorbed_per_minute',
-        'significant_strike_accuracy', 'takedown_accuracy',
-        'significant_strike_defense', 'takedown_defense',
-        'submission_average', 'takedown_average'
-    ]
-
-    for column in columns_to_calculate_diff:
+    # Columns where taking the difference makes logical sense are listed in dataset_schema
+    for column in DIFF_FIELDS:
         red_col = f'red_{column}'
         blue_col = f'blue_{column}'
         diff_col = f'{column}_difference'
@@ -568,111 +627,265 @@ def calculate_diff(df):
 
 
 
-def create_large_dataset(url_range=None):
-     # Step 1: Get all URLs and stats
-    # fight_urls = list(tqdm(get_fight_urls(url_range), desc="Collecting Fight URLs"))
-    # fighter_urls = list(tqdm(get_fighter_urls(fight_urls), desc="Collecting Fighter URLs"))
-
-     # === FIGHT URLS ===
-    if os.path.exists("fight_urls.txt"):
-        with open("fight_urls.txt", "r") as f:
-            fight_urls = [line.strip() for line in f.readlines()]
-        print(f" Loaded {len(fight_urls)} fight URLs from file.")
-    else:
-        fight_urls = list(tqdm(get_fight_urls(url_range), desc="Collecting Fight URLs"))
-        with open("fight_urls.txt", "w") as f:
-            for url in fight_urls:
-                f.write(url + "\n")
-
-    # === FIGHTER URLS ===
-    if os.path.exists("fighter_urls.txt"):
-        with open("fighter_urls.txt", "r") as f:
-            fighter_urls = [line.strip() for line in f.readlines()]
-        print(f" Loaded {len(fighter_urls)} fighter URLs from file.")
-    else:
-        fighter_urls = list(tqdm(get_fighter_urls(fight_urls), desc="Collecting Fighter URLs"))
-        with open("fighter_urls.txt", "w") as f:
-            for url in fighter_urls:
-                f.write(url + "\n")
+def run_crawl_worker(queue, worker_id, stages=STAGES, follow=True, batch_size=None,
+                     concurrency=DEFAULT_CONCURRENCY, archive_path=DEFAULT_ARCHIVE):
+    # Lease batches of tasks from the crawl queue until every task of the given
+    # stages is done or failed. With follow=True the fight urls found on an event
+    # page and the fighter urls found on a fight page are queued as new tasks.
+    batch_size = batch_size or concurrency * 4
 
+    while True:
+        tasks = queue.lease(worker_id, batch_size, stages)
+        if not tasks:
+            wait = queue.seconds_until_ready(stages)
+            if wait is None:
+                break
+            # Everything left is waiting for a retry or leased by another worker
+            time.sleep(min(wait, 5.0) + 0.1)
+            continue
 
-    if os.path.exists("fighters_stats.json"):
-        with open("fighters_stats.json", "r") as f:
-            fighters_stats = json.load(f)
-        print(f" Loaded {len(fighters_stats)} fighter stats from JSON.")
-    else:
-        fighters_stats = list(tqdm(get_fighters_stats(fighter_urls), desc="Collecting Fighter Stats"))
-        with open("fighters_stats.json", "w") as f:
-            json.dump(fighters_stats, f, indent=2)
-        print(f" Fighter stats collected and saved to JSON.")
-
-    # Step 2: Split fighter stats into red and blue
-    red_fighters_stats = get_red_fighters_stats(fighters_stats)
-    blue_fighters_stats = get_blue_fighters_stats(fighters_stats)
-
-    # Step 3: Create fighter dictionaries
-    red_fighters_dicts = create_r_fighter_dicts(red_fighters_stats)
-    blue_fighters_dicts = create_b_fighter_dicts(blue_fighters_stats)
-
-    # Step 4: Scrape fight-specific stats
-    if os.path.exists("fight_data.json"):
-        with open('fight_data.json', 'r') as f:
-            fight_data = json.load(f)
-
-        # Define keys to rename (without prefix)
-        fight_keys_to_rename = [
-            'knockdowns',
-            'significant_strikes_landed', 'significant_strikes_attempted', 'significant_strike_accuracy',
-            'total_strikes_landed', 'total_strikes_attempted', 'total_strike_accuracy',
-            'takedowns_landed', 'takedown_attempts', 'takedown_accuracy',
-            'submission_attempts', 'reversals', 'control_time_seconds'
-        ]
-
-        # Rename the keys in each record
-        for record in fight_data:
-            for key in fight_keys_to_rename:
-                red_old = f'red_{key}'
-                red_new = f'red_fight_{key}'
-                if red_old in record:
-                    record[red_new] = record.pop(red_old)
-
-                blue_old = f'blue_{key}'
-                blue_new = f'blue_fight_{key}'
-                if blue_old in record:
-                    record[blue_new] = record.pop(blue_old)
-        
-        total_page_dicts = fight_data 
-
-        print(" Loaded total_page_dicts from fight_data.json")
-    else:
-        total_page_dicts = list(tqdm(get_fight_data(fight_urls), desc="Collecting Fight Data"))
-        with open("fight_data.json", "w") as f:
-            json.dump(total_page_dicts, f, indent=2)
-        print(" Saved total_page_dicts to fight_data.json")
+        task_stages = dict(tasks)
+        # The parse callback runs on the event loop, so the results are only
+        # collected there and written to the queue once the batch is fetched
+        completed = []
+        failed = []
+
+        def parse(url, status, html):
+            if status != 200:
+                failed.append((url, f"status code {status}"))
+                return
+
+            try:
+                stage = task_stages[url]
+                if stage == 'event':
+                    fight_urls = parse_event_page(html)
+                    completed.append((url, fight_urls, [('fight', fight_urls)] if follow else []))
+                elif stage == 'fight':
+                    # Only the links; the fight itself is parsed from the archived page on export
+                    fighter_urls = parse_fighter_links(html)
+                    children = [('fighter', fighter_urls)] if follow else []
+                    completed.append((url, {'fighter_urls': fighter_urls}, children))
+                else:
+                    completed.append((url, parse_fighter_page(html), []))
+            except Exception as e:
+                METRICS.inc('parse_failures_total', stage=f"Crawling {worker_id}", error=type(e).__name__)
+                failed.append((url, repr(e)))
+
+        fetch_pages([url for url, _ in tasks], parse, concurrency, desc=f"Crawling {worker_id}",
+                    archive_path=archive_path)
+
+        queue.complete(worker_id, completed)
+        # Tasks whose fetch failed never reached the parse callback
+        reported = {url for url, _, _ in completed} | {url for url, _ in failed}
+        failed.extend((url, 'fetch failed') for url in task_stages if url not in reported)
+        queue.fail(worker_id, failed)
+
+
+def worker_archive_path(worker_id):
+    # Page archive of one crawl worker. An archive has a single writer, so
+    # workers never share one; export_crawl_queue merges them into the main one.
+    return f'{DEFAULT_ARCHIVE}-{worker_id}'
+
+
+def merge_worker_archives(archive_path=DEFAULT_ARCHIVE, extra_paths=()):
+    # Called once the workers are done, so this process is the only writer.
+    # extra_paths are the archives of workers started with a custom --archive;
+    # they are merged too but, unlike the pages-<worker id> ones, kept afterwards.
+    worker_paths = sorted(path[:-len('.pack')] for path in glob.glob(worker_archive_path('*') + '.pack'))
+    extra_paths = [path for path in extra_paths if path != archive_path and path not in worker_paths]
+    if not worker_paths and not extra_paths:
+        return
+
+    with PageArchive(archive_path) as archive:
+        for worker_path in worker_paths + extra_paths:
+            with PageArchive(worker_path, readonly=True) as worker_archive:
+                copied = archive.merge(worker_archive)
+            print(f" Merged {copied} pages from {worker_path}.pack into {archive_path}.pack")
+    for worker_path in worker_paths:
+        os.remove(worker_path + '.pack')
+        os.remove(worker_path + '.idx')
+
+
+def export_crawl_queue(queue, worker_archives=()):
+    # Write the url lists and fighter records from a finished queue crawl, then
+    # build the dataset. The fight records are parsed by the pipeline's extract
+    # stage, from the pages the workers archived. worker_archives lists the
+    # archives of workers that did not use the default pages-<worker id> one.
+    event_results = queue.results('event')
+    fight_results = queue.results('fight')
+    fighter_results = queue.results('fighter')
+
+    fight_urls = [url for urls in event_results.values() for url in urls]
+    missing_fights = [url for url in fight_urls if url not in fight_results]
+    if missing_fights:
+        print(f" {len(missing_fights)} fights have not been crawled and are left out.")
+    fight_urls = [url for url in fight_urls if url in fight_results]
+    fighter_urls = [url for fight_url in fight_urls for url in fight_results[fight_url]['fighter_urls']]
+
+    merge_worker_archives(extra_paths=worker_archives)
+
+    # The event results only hold the fight urls; the dates come from the archived event pages
+    with PageArchive(DEFAULT_ARCHIVE, readonly=True) as archive:
+        event_dates = {url: parse_event_date(archive.get(url)) for url in event_results if url in archive}
+
+    write_url_file('fight_urls.txt', fight_urls)
+    write_url_file('fighter_urls.txt', fighter_urls)
+    rewrite_records(FIGHTERS_STATS_FILE, ({**fighter, 'url': url} for url, fighter in fighter_results.items()))
+
+    manifest = load_crawl_manifest()
+    manifest['events'].update(event_results)
+    manifest['event_dates'].update(event_dates)
+    save_crawl_manifest(manifest)
+
+    return finish_large_dataset(list(event_results), done_stages=('scrape',))
 
-    # Step 5: Combine fight and personal stats
-    full_fight_data = combine_fight_and_personal_stats(total_page_dicts, red_fighters_dicts, blue_fighters_dicts)
 
-    # Step 6: Add difference columns
+def create_large_dataset(url_range=None):
+    # Runs the scrape, extract, combine and diff stages of the pipeline. Each
+    # one is skipped when its inputs, parameters and code are unchanged since
+    # it last ran, instead of whenever its output file exists.
+    # Imported here, because the pipeline stages are built from this module
+    from pipeline import run_pipeline
+
+    run_pipeline(url_range, until='diff')
+    return read_dataset(DATASET_FILE)
+
+
+def finish_large_dataset(event_urls, done_stages=('scrape', 'extract')):
+    # For url lists and record files written outside the pipeline: done_stages
+    # are recorded as done for event_urls, so that it runs the stages after
+    # them up to the diff now and does not redo any of them next time
+    from pipeline import mark_done, run_pipeline
+
+    mark_done(done_stages, event_urls)
+    run_pipeline(event_urls, until='diff')
+    return read_dataset(DATASET_FILE)
+
+
+def combine_large_dataset(fight_urls, fighters_stats, fighter_urls=None):
+    # (fights joined with both fighters' profiles, feature store after the last fight)
+    # Step 2: Stream the fight-specific stats back from fight_data.jsonl, in fight_urls order
+    fights_df = pd.DataFrame(load_fight_data(fight_urls))
+    for column in KEY_COLUMNS:
+        if column not in fights_df.columns:
+            fights_df[column] = None
+
+    # Step 3: Fights saved before the fighter urls were part of the record get
+    # them from fighter_urls.txt, which lists the red and blue fighter of every fight
+    if fighter_urls is not None and fights_df['red_fighter_url'].isna().any():
+        pair_count = min(len(fight_urls), len(fighter_urls) // 2)
+        red_urls = dict(zip(fight_urls[:pair_count], fighter_urls[0:2 * pair_count:2]))
+        blue_urls = dict(zip(fight_urls[:pair_count], fighter_urls[1:2 * pair_count:2]))
+        fights_df['red_fighter_url'] = fights_df['red_fighter_url'].fillna(fights_df['fight_url'].map(red_urls))
+        fights_df['blue_fighter_url'] = fights_df['blue_fighter_url'].fillna(fights_df['fight_url'].map(blue_urls))
+
+    # Step 4: Join the red and blue fighter profiles onto the fights
+    full_fight_data = combine_fight_and_personal_stats(fights_df, fighters_stats)
+
+    # The profile page shows today's record and averages; each fight gets them
+    # as they stood before it instead, and the store keeps them for new fights
+    as_of, feature_store = point_in_time_features(fights_df)
+    for column in as_of.columns:
+        side, field = column.split('_', 1)
+        full_fight_data[f'{side}_{PROFILE_COLUMNS[field]}'] = as_of[column].to_numpy()
+
+    # Likewise the age is the one on the day of the event, from the date of birth
+    fight_dates = fights_df['fight_url'].map(load_fight_dates())
+    dobs = {url: profile.get('dob') for url, profile in fighters_stats.items()}
+    for side in ('red', 'blue'):
+        side_dobs = fights_df[f'{side}_fighter_url'].map(dobs)
+        full_fight_data[f'{side}_{PROFILE_COLUMNS["age"]}'] = ages_at(side_dobs, fight_dates)
+    return full_fight_data, feature_store
+
+
+def build_large_dataset(fight_urls, fighters_stats, fighter_urls=None):
+    full_fight_data, feature_store = combine_large_dataset(fight_urls, fighters_stats, fighter_urls)
+    feature_store.save(FEATURE_STORE_FILE)
+
+    # Step 5: Add difference columns
     full_fight_data = calculate_diff(full_fight_data)
 
-    # Step 7: Save dataset to CSV
+    # Step 6: Save dataset as typed, compressed parquet
     completed_events_large_df = pd.DataFrame(full_fight_data)
-    completed_events_large_df.to_csv('completed_events_large.csv', index=False)
+    write_dataset(completed_events_large_df, DATASET_FILE)
 
    
 
-    print('Large dataset has been collected and saved to "completed_events_large.csv".')
+    print(f'Large dataset has been collected and saved to "{DATASET_FILE}".')
    
     return completed_events_large_df
 
 
+def update_large_dataset(event_urls, concurrency=DEFAULT_CONCURRENCY):
+    # Incremental crawl: only events missing from the crawl manifest are scraped,
+    # only the fighters who appeared in them are refreshed, and the new fights are
+    # merged into the existing url lists and record files.
+    manifest = load_crawl_manifest()
+    if not manifest['events'] or not os.path.exists('fight_urls.txt') or not os.path.exists('fighter_urls.txt'):
+        print(" No previous run found, collecting the full dataset instead.")
+        return create_large_dataset(event_urls)
+
+    new_event_urls = [url for url in event_urls if url not in manifest['events']]
+    print(f" {len(new_event_urls)} new events since the last run.")
+
+    fight_urls = read_url_file('fight_urls.txt')
+    fighter_urls = read_url_file('fighter_urls.txt')
+
+    # === NEW FIGHT URLS ===
+    events = collect_event_fight_urls(new_event_urls, concurrency)
+    new_events = {url: event for url, event in zip(new_event_urls, events) if event is not None}
+    known_fight_urls = set(fight_urls)
+    new_fight_urls = [
+        url for urls, _ in new_events.values() for url in urls if url not in known_fight_urls
+    ]
+
+    # === NEW FIGHTER URLS ===
+    fight_fighter_urls = collect_fight_fighter_urls(new_fight_urls, concurrency)
+    if any(urls is None for urls in fight_fighter_urls):
+        print(" Some new fights failed to load, nothing was merged. Run again to retry.")
+        return None
+    new_fighter_urls = [url for urls in fight_fighter_urls for url in urls]
+
+    # Refresh the profiles of the fighters who fought, and collect the new fights
+    get_fighters_stats(new_fighter_urls, refresh=True, concurrency=concurrency)
+    get_fight_data(new_fight_urls, concurrency)
+
+    # Events are listed newest first, so the new fights go in front of the old ones
+    fight_urls = new_fight_urls + fight_urls
+    fighter_urls = new_fighter_urls + fighter_urls
+    write_url_file('fight_urls.txt', fight_urls)
+    write_url_file('fighter_urls.txt', fighter_urls)
+
+    for event_url, (urls, date) in new_events.items():
+        manifest['events'][event_url] = urls
+        manifest['event_dates'][event_url] = date
+    save_crawl_manifest(manifest)
+
+    print(f" Merged {len(new_fight_urls)} new fights into the dataset.")
+
+    return finish_large_dataset(event_urls)
+
+
 def main():
     event_urls = get_completed_event_urls()
     dataset = create_large_dataset(event_urls)
     print(" Dataset creation complete!")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scrape ufcstats.com into completed_events_large.parquet')
+    parser.add_argument('--since-last-run', action='store_true',
+                        help='only crawl events that are not in crawl_manifest.json yet and merge them in')
+    parser.add_argument('--verbose', action='store_true', help='print every record as it is parsed')
+    parser.add_argument('--metrics-json', default=None, help='write the run metrics to this JSON file')
+    parser.add_argument('--metrics-prom', default=None, help='write the run metrics to this Prometheus textfile')
+    args = parser.parse_args()
+    if args.verbose:
+        set_verbose(True)
+
     event_urls = get_completed_event_urls()
-    dataset = create_large_dataset(event_urls)
+    if args.since_last_run:
+        dataset = update_large_dataset(event_urls)
+    else:
+        dataset = create_large_dataset(event_urls)
+    METRICS.export(args.metrics_json, args.metrics_prom)
     print(" Dataset creation complete!")
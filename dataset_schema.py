@@ -0,0 +1,167 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+# Typed, compressed columnar storage for completed_events_large. Every column
+# has a fixed type, so nothing is re-inferred from text when a stage loads the
+# dataset, and stages only read the columns they use.
+
+DATASET_FILE = 'completed_events_large.parquet'
+COMPRESSION = 'zstd'
+
+# Fight-level fields, in dataset order
+COMMON_FIELDS = [
+    ('event_name', pa.string()),
+    ('red_fighter_name', pa.string()),
+    ('blue_fighter_name', pa.string()),
+    ('winner', pa.string()),
+    ('weight_class', pa.string()),
+    ('is_title_bout', pa.int8()),
+    ('gender', pa.string()),
+    ('method', pa.string()),
+    ('finish_round', pa.int8()),
+    ('total_rounds', pa.int8()),
+    ('fight_duration_seconds', pa.int32()),
+    ('referee_name', pa.string()),
+]
+
+# Totals of one fighter in the fight, stored as red_fight_<field> and blue_fight_<field>
+FIGHT_STAT_FIELDS = [
+    ('knockdowns', pa.int16()),
+    ('significant_strikes_landed', pa.int16()),
+    ('significant_strikes_attempted', pa.int16()),
+    ('significant_strike_accuracy', pa.float64()),
+    ('total_strikes_landed', pa.int16()),
+    ('total_strikes_attempted', pa.int16()),
+    ('total_strike_accuracy', pa.float64()),
+    ('takedowns_landed', pa.int16()),
+    ('takedowns_attempted', pa.int16()),
+    ('takedown_accuracy', pa.float64()),
+    ('submission_attempts', pa.int16()),
+    ('reversals', pa.int16()),
+    ('control_time_seconds', pa.int32()),
+]
+
+# Profile fields joined onto every fight, and their dataset column names (without the red_/blue_ prefix)
+PROFILE_COLUMNS = {
+    'wins': 'total_wins',
+    'losses': 'total_losses',
+    'age': 'age',
+    'height_cm': 'height_cm',
+    'weight_kg': 'weight_kg',
+    'reach_cm': 'reach_cm',
+    'stance': 'stance',
+    'significant_strikes_landed_per_minute': 'significant_strikes_landed_per_minute',
+    'significant_strikes_absorbed_per_minute': 'significant_strikes_absorbed_per_minute',
+    'significant_strike_accuracy': 'significant_strike_accuracy',
+    'takedown_accuracy': 'takedown_accuracy',
+    'significant_strike_defense': 'significant_strike_defense',
+    'takedown_defense': 'takedown_defense',
+    'submission_average': 'submission_average',
+    'takedown_average': 'takedown_average',
+}
+
+PROFILE_FIELDS = [
+    ('total_wins', pa.int16()),
+    ('total_losses', pa.int16()),
+    ('age', pa.int8()),
+    ('height_cm', pa.float64()),
+    ('weight_kg', pa.float64()),
+    ('reach_cm', pa.float64()),
+    ('stance', pa.string()),
+    ('significant_strikes_landed_per_minute', pa.float64()),
+    ('significant_strikes_absorbed_per_minute', pa.float64()),
+    ('significant_strike_accuracy', pa.float64()),
+    ('takedown_accuracy', pa.float64()),
+    ('significant_strike_defense', pa.float64()),
+    ('takedown_defense', pa.float64()),
+    ('submission_average', pa.float64()),
+    ('takedown_average', pa.float64()),
+]
+
+# Columns where taking the difference makes logical sense, stored as <field>_difference
+DIFF_FIELDS = [
+    'fight_knockdowns',
+    'fight_significant_strikes_landed', 'fight_significant_strikes_attempted', 'fight_significant_strike_accuracy',
+    'fight_total_strikes_landed', 'fight_total_strikes_attempted', 'fight_total_strike_accuracy',
+    'fight_takedowns_landed', 'fight_takedown_attempts', 'fight_takedown_accuracy',
+    'fight_submission_attempts', 'fight_reversals', 'fight_control_time_seconds',
+
+    'total_wins', 'total_losses',
+    'age', 'height_cm', 'weight_kg', 'reach_cm',
+    'significant_strikes_landed_per_minute', 'significant_strikes_absorbed_per_minute',
+    'significant_strike_accuracy', 'takedown_accuracy',
+    'significant_strike_defense', 'takedown_defense',
+    'submission_average', 'takedown_average'
+]
+
+
+def _side_fields(side):
+    return (
+        [(f'{side}_fight_{name}', type) for name, type in FIGHT_STAT_FIELDS]
+        + [(f'{side}_{name}', type) for name, type in PROFILE_FIELDS]
+    )
+
+
+def _diff_fields(fields):
+    names = {name for name, _ in fields}
+    return [
+        (f'{column}_difference', pa.float64())
+        for column in DIFF_FIELDS
+        if f'red_{column}' in names and f'blue_{column}' in names
+    ]
+
+
+_SIDE_FIELDS = _side_fields('red') + _side_fields('blue')
+DATASET_SCHEMA = pa.schema(COMMON_FIELDS + _SIDE_FIELDS + _diff_fields(_SIDE_FIELDS))
+
+
+def write_dataset(df, path=DATASET_FILE):
+    # Columns in DATASET_SCHEMA are stored with their declared type. Anything
+    # else (fields from older record files) keeps the type pandas gave it.
+    inferred = pa.Schema.from_pandas(df, preserve_index=False)
+    schema = pa.schema([
+        DATASET_SCHEMA.field(field.name) if field.name in DATASET_SCHEMA.names else field
+        for field in inferred
+    ])
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+    # An empty string is a missing value, the same as it was in the CSV
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type):
+            column = table.column(i)
+            table = table.set_column(i, field, pc.if_else(pc.equal(column, ''), pa.scalar(None, pa.string()), column))
+
+    pq.write_table(table, path, compression=COMPRESSION)
+
+
+def read_dataset(path=DATASET_FILE, columns=None):
+    # Only the requested columns are read from disk; ones the file lacks are skipped
+    if columns is not None:
+        available = set(pq.read_schema(path).names)
+        columns = [column for column in columns if column in available]
+    return pd.read_parquet(path, columns=columns)
+
+
+def iter_dataset(path=DATASET_FILE, columns=None, batch_rows=65536, categories=None):
+    # The dataset as DataFrames of at most batch_rows rows, so a stage can go
+    # through it without holding every row. Columns in categories are read as
+    # pandas categoricals.
+    dataset = pq.ParquetFile(path)
+    if columns is not None:
+        available = set(dataset.schema_arrow.names)
+        columns = [column for column in columns if column in available]
+    for batch in dataset.iter_batches(batch_size=batch_rows, columns=columns):
+        yield batch.to_pandas(categories=categories)
+
+
+def numeric_columns(path=DATASET_FILE):
+    # Names of the stored integer and float columns, in dataset order
+    return [field.name for field in pq.read_schema(path)
+            if pa.types.is_integer(field.type) or pa.types.is_floating(field.type)]
+
+
+def dataset_columns(path=DATASET_FILE):
+    return pq.read_schema(path).names
@@ -0,0 +1,82 @@
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fetcher import fetch_pages
+
+
+# Local stand-in for ufcstats.com that injects the failures the fetcher has to
+# survive: 429s with Retry-After, 5xx errors, slow responses and dropped
+# connections. Running this file crawls it through fetch_pages and checks that
+# every page arrives.
+#
+#   python fault_server.py --pages 500 --error-rate 0.2
+
+
+class FaultyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        config = self.server.config
+        roll = random.random()
+
+        if roll < config['error_rate'] / 4:
+            self._reply(429, 'slow down', {'Retry-After': '0.2'})
+        elif roll < config['error_rate'] / 2:
+            self._reply(random.choice([500, 502, 503]), 'server error')
+        elif roll < config['error_rate'] * 3 / 4:
+            time.sleep(config['slow_seconds'])
+            self._reply(200, self._page())
+        elif roll < config['error_rate']:
+            # Drop the connection without answering
+            self.close_connection = True
+            self.connection.close()
+        else:
+            time.sleep(config['latency'])
+            self._reply(200, self._page())
+
+    def _page(self):
+        return f'<html><body><p class="page">{self.path}</p></body></html>'
+
+    def _reply(self, status, body, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fault_server(error_rate=0.2, latency=0.01, slow_seconds=0.5, port=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), FaultyHandler)
+    server.daemon_threads = True
+    server.config = {'error_rate': error_rate, 'latency': latency, 'slow_seconds': slow_seconds}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Crawl a local server that injects errors')
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--error-rate', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    server = start_fault_server(args.error_rate)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    urls = [f'{base_url}/page/{i}' for i in range(args.pages)]
+
+    start = time.monotonic()
+    statuses = fetch_pages(urls, lambda url, status, html: status, args.concurrency, archive_path=None)
+    elapsed = time.monotonic() - start
+    server.shutdown()
+
+    missing = sum(status != 200 for status in statuses)
+    print(f" {args.pages - missing}/{args.pages} pages fetched in {elapsed:.1f}s, {missing} lost")
@@ -0,0 +1,141 @@
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+import preprocessing
+from model_registry import file_fingerprint
+from preprocessing import PREPROCESSOR_FILE, TRAIN_DATA_FILE, load_training_data
+
+
+# The training matrix, labels and column list as .npy files that are memory
+# mapped, instead of decoding ufc_preprocessed_train_data.parquet on every
+# training, tuning or backtest run:
+#
+#   feature_cache/<key>/x.npy           float32 features, one C-ordered row per fight
+#   feature_cache/<key>/y.npy           float32 labels
+#   feature_cache/<key>/columns.json
+#
+# The key is a hash of the contents of the training rows, the preprocessor and
+# the code that reads them, so any change to those gets an entry of its own. Every process mapping
+# the same entry shares its pages through the OS page cache.
+#
+#   python feature_cache.py             build the entry for the current training rows
+#   python feature_cache.py --clear
+
+CACHE_DIR = 'feature_cache'
+
+# Bump when the layout of an entry changes
+CACHE_FORMAT = 1
+
+# Entries kept; older ones are removed when a new one is built
+MAX_ENTRIES = 3
+
+# An entry used this recently is never removed, since a tuning or backtest
+# worker may be about to map it
+PRUNE_AFTER_SECONDS = 24 * 3600
+
+LOCK_NAME = '.lock'
+
+
+def cache_key(path=TRAIN_DATA_FILE, preprocessor_path=PREPROCESSOR_FILE):
+    digest = hashlib.sha256(f'format {CACHE_FORMAT}\n'.encode())
+    for file_path in (path, preprocessor_path, preprocessing.__file__, __file__):
+        digest.update(file_fingerprint(file_path).encode())
+    return digest.hexdigest()[:16]
+
+
+@contextlib.contextmanager
+def _locked(cache_dir, exclusive):
+    # Entries are opened under a shared lock, built and removed under an exclusive one
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, LOCK_NAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _build_entry(entry, path, preprocessor_path):
+    x, y = load_training_data(path, preprocessor_path)
+
+    # Built next to the entry and renamed, so a reader never maps a half-written file
+    tmp_entry = f'{entry}.tmp-{os.getpid()}'
+    os.makedirs(tmp_entry)
+    try:
+        np.save(os.path.join(tmp_entry, 'x.npy'), np.ascontiguousarray(x.to_numpy(dtype=np.float32)))
+        np.save(os.path.join(tmp_entry, 'y.npy'), y.to_numpy(dtype=np.float32))
+        with open(os.path.join(tmp_entry, 'columns.json'), 'w') as f:
+            json.dump(list(x.columns), f)
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another process built the same entry first
+        if not os.path.isdir(entry):
+            raise
+    finally:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+
+def _prune(cache_dir, keep):
+    # Keeps the entry just built and the MAX_ENTRIES - 1 most recently used
+    # others, and anything used in the last PRUNE_AFTER_SECONDS. Called with the
+    # exclusive lock held, so no process is opening an entry meanwhile.
+    others = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+              if name not in (keep, LOCK_NAME) and '.tmp-' not in name]
+    others.sort(key=os.path.getmtime, reverse=True)
+    cutoff = time.time() - PRUNE_AFTER_SECONDS
+    for entry in others[MAX_ENTRIES - 1:]:
+        if os.path.getmtime(entry) < cutoff:
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def entry_path(path=TRAIN_DATA_FILE, preprocessor_path=PREPROCESSOR_FILE, cache_dir=CACHE_DIR):
+    # Directory of the cache entry for the training rows, built first if it is missing
+    key = cache_key(path, preprocessor_path)
+    entry = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry):
+        with _locked(cache_dir, exclusive=True):
+            if not os.path.isdir(entry):
+                start = time.monotonic()
+                _build_entry(entry, path, preprocessor_path)
+                _prune(cache_dir, key)
+                print(f" Cached the feature matrix of {path} in {entry} ({time.monotonic() - start:.1f}s)")
+    # The modification time of an entry is when it was last used
+    os.utime(entry)
+    return entry
+
+
+def load_entry(entry):
+    # Once mapped, the arrays stay readable even if the entry is removed later
+    with _locked(os.path.dirname(entry) or '.', exclusive=False):
+        x = np.load(os.path.join(entry, 'x.npy'), mmap_mode='r')
+        y = np.load(os.path.join(entry, 'y.npy'), mmap_mode='r')
+        with open(os.path.join(entry, 'columns.json')) as f:
+            columns = json.load(f)
+    return x, y, columns
+
+
+def load_features(path=TRAIN_DATA_FILE, preprocessor_path=PREPROCESSOR_FILE, cache_dir=CACHE_DIR):
+    # (x, y, columns) of the training rows, x and y as read-only memory maps
+    return load_entry(entry_path(path, preprocessor_path, cache_dir))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cache the training feature matrix as memory-mapped arrays')
+    parser.add_argument('--clear', action='store_true', help='remove every cache entry')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+
+    if args.clear:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
+        print(f" Removed {args.cache_dir}")
+    else:
+        x, y, columns = load_features(cache_dir=args.cache_dir)
+        print(f" {x.shape[0]} rows x {len(columns)} features in {entry_path(cache_dir=args.cache_dir)}")
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Career stats of every fighter as they stood before each fight, computed from
+# the per-fight records instead of the profile page, which only shows today's
+# averages. Fights have no date in the records, so time is the event order:
+# fight_urls.txt lists the newest events first, and the fights of one event are
+# treated as simultaneous.
+#
+#   python feature_store.py             rebuild fighter_features.json from fight_data.jsonl
+#   python feature_store.py --update    only add the fights it has not seen yet
+#
+# The store keeps each fighter's running totals, so a new fight updates the two
+# fighters involved without going through their history again.
+
+FEATURE_STORE_FILE = 'fighter_features.json'
+
+# A finished fight lasted the earlier rounds in full plus the time shown for the last one
+ROUND_SECONDS = 300
+
+# Running totals kept per fighter
+TOTALS = [
+    'wins', 'losses', 'seconds',
+    'strikes_landed', 'strikes_attempted', 'strikes_absorbed', 'opponent_strikes_attempted',
+    'takedowns_landed', 'takedowns_attempted', 'opponent_takedowns_landed', 'opponent_takedowns_attempted',
+    'submission_attempts',
+]
+
+# Profile fields that are replaced by their value at the time of the fight.
+# Height, weight, reach and stance still come from the profile; the age is
+# computed from the date of birth on the profile and the date of the event.
+FEATURES = [
+    'wins', 'losses',
+    'significant_strikes_landed_per_minute', 'significant_strikes_absorbed_per_minute',
+    'significant_strike_accuracy', 'significant_strike_defense',
+    'takedown_average', 'takedown_accuracy', 'takedown_defense',
+    'submission_average',
+]
+
+
+def event_numbers(event_names):
+    # Event number of every fight, 0 for the oldest event. event_names is in
+    # fight_urls.txt order, newest event first.
+    newest_first = pd.unique(np.asarray(event_names, dtype=object))
+    position = {name: i for i, name in enumerate(newest_first)}
+    return np.array([len(newest_first) - 1 - position[name] for name in event_names], dtype=np.int32)
+
+
+def ages_at(dobs, dates):
+    # Age in whole years on each date, from YYYY-MM-DD dates of birth. NaN where
+    # either date is missing.
+    dob = pd.to_datetime(pd.Series(list(dobs), dtype=object), errors='coerce')
+    on = pd.to_datetime(pd.Series(list(dates), dtype=object), errors='coerce')
+    before_birthday = (on.dt.month < dob.dt.month) | ((on.dt.month == dob.dt.month) & (on.dt.day < dob.dt.day))
+    return (on.dt.year - dob.dt.year - before_birthday).to_numpy(dtype=float)
+
+
+def fighter_key(fight, side):
+    # Fighters are keyed by profile url, or by name in fights saved without urls
+    return fight.get(f'{side}_fighter_url') or fight.get(f'{side}_fighter_name')
+
+
+def _fight_totals(fights):
+    # Two rows per fight, red fighter first: what the fight adds to each fighter's totals
+    def column(name):
+        if name in fights.columns:
+            return pd.to_numeric(fights[name], errors='coerce').to_numpy(dtype=float)
+        return np.full(len(fights), np.nan)
+
+    seconds = (np.nan_to_num(column('finish_round'), nan=1.0) - 1) * ROUND_SECONDS
+    seconds += np.nan_to_num(column('fight_duration_seconds'))
+    winner = fights['winner'].to_numpy(dtype=object) if 'winner' in fights.columns else np.full(len(fights), None)
+
+    sides = []
+    for side, other, won, lost in (('red', 'blue', 'Red', 'Blue'), ('blue', 'red', 'Blue', 'Red')):
+        landed = column(f'{side}_fight_significant_strikes_landed')
+        # Time only counts towards the rates of fights whose stats are known
+        totals = np.column_stack([
+            winner == won,
+            winner == lost,
+            np.where(np.isnan(landed), 0.0, seconds),
+            landed,
+            column(f'{side}_fight_significant_strikes_attempted'),
+            column(f'{other}_fight_significant_strikes_landed'),
+            column(f'{other}_fight_significant_strikes_attempted'),
+            column(f'{side}_fight_takedowns_landed'),
+            column(f'{side}_fight_takedowns_attempted'),
+            column(f'{other}_fight_takedowns_landed'),
+            column(f'{other}_fight_takedowns_attempted'),
+            column(f'{side}_fight_submission_attempts'),
+        ]).astype(float)
+        sides.append(np.nan_to_num(totals))
+    return np.vstack(sides)
+
+
+def _ratio(numerator, denominator):
+    safe = np.where(denominator > 0, denominator, 1.0)
+    return np.where(denominator > 0, numerator / safe, np.nan)
+
+
+def derive_features(totals):
+    # Running totals (one row per fighter) -> profile fields. Rates of a fighter
+    # with no recorded fight time are missing, like a profile showing "--".
+    t = {name: totals[:, i] for i, name in enumerate(TOTALS)}
+    minutes = t['seconds'] / 60
+    return {
+        'wins': t['wins'],
+        'losses': t['losses'],
+        'significant_strikes_landed_per_minute': _ratio(t['strikes_landed'], minutes),
+        'significant_strikes_absorbed_per_minute': _ratio(t['strikes_absorbed'], minutes),
+        'significant_strike_accuracy': _ratio(t['strikes_landed'], t['strikes_attempted']),
+        'significant_strike_defense': 1 - _ratio(t['strikes_absorbed'], t['opponent_strikes_attempted']),
+        'takedown_average': _ratio(t['takedowns_landed'], minutes / 15),
+        'takedown_accuracy': _ratio(t['takedowns_landed'], t['takedowns_attempted']),
+        'takedown_defense': 1 - _ratio(t['opponent_takedowns_landed'], t['opponent_takedowns_attempted']),
+        'submission_average': _ratio(t['submission_attempts'], minutes / 15),
+    }
+
+
+def point_in_time_features(fights):
+    # fights: fight records as a DataFrame, newest event first. Returns the
+    # profile fields of both fighters before every fight, as red_<field> and
+    # blue_<field> columns in the order of fights, and the store after the last event.
+    count = len(fights)
+    records = fights.reindex(columns=['red_fighter_url', 'red_fighter_name', 'blue_fighter_url', 'blue_fighter_name'])
+    records = records.astype(object).where(records.notna(), None).to_dict('records')
+    rows = pd.DataFrame(_fight_totals(fights), columns=TOTALS)
+    rows['fighter'] = [fighter_key(record, 'red') for record in records] + \
+                      [fighter_key(record, 'blue') for record in records]
+    rows['event'] = np.tile(event_numbers(fights['event_name'].fillna('').tolist()), 2) if count else []
+    rows = rows[rows['fighter'].notna()]
+
+    # Totals per fighter and event, summed over the events up to and including it;
+    # taking that event's own fights off again leaves the totals going into it
+    per_event = rows.groupby(['fighter', 'event'], sort=True)[TOTALS].sum()
+    through_event = per_event.groupby(level='fighter').cumsum()
+    before_event = through_event - per_event
+
+    totals = np.full((2 * count, len(TOTALS)), np.nan)
+    index = pd.MultiIndex.from_arrays([rows['fighter'], rows['event']])
+    totals[rows.index.to_numpy()] = before_event.loc[index].to_numpy()
+    features = derive_features(totals)
+
+    as_of = pd.DataFrame(index=fights.index)
+    for side, part in (('red', slice(0, count)), ('blue', slice(count, 2 * count))):
+        for name in FEATURES:
+            as_of[f'{side}_{name}'] = features[name][part]
+
+    latest = through_event.groupby(level='fighter').last()
+    store = FeatureStore(
+        dict(zip(latest.index, latest.to_numpy())),
+        fights['fight_url'].dropna().tolist() if 'fight_url' in fights.columns else [],
+    )
+    return as_of, store
+
+
+class FeatureStore:
+    def __init__(self, totals=None, fights=None):
+        # fighter -> running totals in TOTALS order, and the urls of the fights counted
+        self.totals = {fighter: np.asarray(values, dtype=float) for fighter, values in (totals or {}).items()}
+        self.fights = set(fights or [])
+
+    def update(self, fight):
+        # Add one finished fight record. Returns False for a fight already counted.
+        fight_url = fight.get('fight_url')
+        if fight_url is not None and fight_url in self.fights:
+            return False
+        red_totals, blue_totals = _fight_totals(pd.DataFrame([fight]))
+        for side, totals in (('red', red_totals), ('blue', blue_totals)):
+            fighter = fighter_key(fight, side)
+            if fighter is None:
+                continue
+            if fighter in self.totals:
+                self.totals[fighter] = self.totals[fighter] + totals
+            else:
+                self.totals[fighter] = totals
+        if fight_url is not None:
+            self.fights.add(fight_url)
+        return True
+
+    def features(self, fighter):
+        # Current profile fields of a fighter; a debutant has no wins, no losses and no rates
+        totals = self.totals.get(fighter, np.zeros(len(TOTALS)))
+        return {name: (None if np.isnan(value[0]) else float(value[0]))
+                for name, value in derive_features(totals[None, :]).items()}
+
+    def __contains__(self, fighter):
+        return fighter in self.totals
+
+    def save(self, path=FEATURE_STORE_FILE):
+        state = {
+            'totals': TOTALS,
+            'fighters': {fighter: values.tolist() for fighter, values in self.totals.items()},
+            'fights': sorted(self.fights),
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=FEATURE_STORE_FILE):
+        with open(path) as f:
+            state = json.load(f)
+        if state['totals'] != TOTALS:
+            raise ValueError(f"{path} was saved with different totals; rebuild it with feature_store.py")
+        return cls(state['fighters'], state['fights'])
+
+
+if __name__ == "__main__":
+    # Imported here, because data_scraping uses this module to build the dataset
+    from data_scraping import load_fight_data, read_url_file
+
+    parser = argparse.ArgumentParser(description='Build the point-in-time fighter feature store')
+    parser.add_argument('--update', action='store_true', help='only add fights missing from the store')
+    args = parser.parse_args()
+
+    fight_urls = read_url_file('fight_urls.txt')
+    if args.update and os.path.exists(FEATURE_STORE_FILE):
+        store = FeatureStore.load(FEATURE_STORE_FILE)
+        # Oldest first, so running totals grow in the order the fights happened
+        new_urls = [url for url in reversed(fight_urls) if url not in store.fights]
+        added = sum(store.update(fight) for fight in load_fight_data(new_urls))
+        print(f" Added {added} fights to {FEATURE_STORE_FILE}")
+    else:
+        _, store = point_in_time_features(pd.DataFrame(load_fight_data(fight_urls)))
+        print(f" Built {FEATURE_STORE_FILE} from {len(store.fights)} fights")
+    store.save(FEATURE_STORE_FILE)
+    print(f" {len(store.totals)} fighters")
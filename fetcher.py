@@ -0,0 +1,223 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+from tqdm import tqdm
+
+from metrics import METRICS, PARSE_BUCKETS
+from page_archive import PageArchive
+
+
+# Most requests kept in flight at once. The real number starts lower and is
+# tuned while crawling by AdaptiveLimiter, up to this ceiling.
+DEFAULT_CONCURRENCY = 16
+INITIAL_CONCURRENCY = 4
+
+# Every page fetched is kept in pages.pack / pages.idx
+DEFAULT_ARCHIVE = 'pages'
+
+# Seconds between updates of the live summary in the progress bar
+SUMMARY_INTERVAL = 0.5
+
+# Retry policy for timeouts, connection errors, 429 and 5xx responses
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10)
+
+
+class AdaptiveLimiter:
+    # Additive-increase / multiplicative-decrease concurrency control. Every fast,
+    # successful response grows the limit by about one request per round trip;
+    # a 429, 5xx or failed request halves it, and responses much slower than the
+    # fastest seen so far shrink it a little. Decreases are spaced out so one burst
+    # of errors from the same window only counts once.
+
+    def __init__(self, initial=INITIAL_CONCURRENCY, minimum=1, maximum=DEFAULT_CONCURRENCY,
+                 backoff=0.5, slow_backoff=0.9, latency_tolerance=3.0, cooldown=1.0):
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.slow_backoff = slow_backoff
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.base_latency = None
+        self.successes = 0
+        self.throttled = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            while self.in_flight >= int(self.limit):
+                await self._condition.wait()
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+
+    def on_success(self, latency):
+        self.successes += 1
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+
+        if latency > self.base_latency * self.latency_tolerance:
+            self._decrease(self.slow_backoff)
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_congestion(self):
+        self.throttled += 1
+        self._decrease(self.backoff)
+
+
+def _retry_delay(attempt, retry_after):
+    # Honour Retry-After when the server sends one, otherwise exponential backoff with full jitter
+    if retry_after is not None:
+        try:
+            return min(BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+async def _download(session, limiter, url, stage):
+    # Returns (status, text). status is None if every attempt failed to get a response.
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        async with limiter:
+            start = time.monotonic()
+            try:
+                async with session.get(url) as response:
+                    status = response.status
+                    retry_after = response.headers.get('Retry-After')
+                    # What response.text() does, keeping the size of the body
+                    body = await response.read()
+                    text = body.decode(response.get_encoding())
+                error = None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, text, error = None, None, e
+            latency = time.monotonic() - start
+
+        if status is not None:
+            METRICS.inc('pages_fetched_total', stage=stage, status=status)
+            METRICS.inc('bytes_fetched_total', len(body), stage=stage)
+            METRICS.observe('http_request_seconds', latency, stage=stage)
+
+        if status is not None and status != 429 and status < 500:
+            limiter.on_success(latency)
+            if status != 200:
+                METRICS.inc('fetch_failures_total', stage=stage, reason=f'http_{status}')
+            return status, text
+
+        reason = type(error).__name__ if error is not None else f'http_{status}'
+        METRICS.inc('fetch_failures_total', stage=stage, reason=reason)
+        limiter.on_congestion()
+        if attempt == MAX_RETRIES:
+            detail = f"{type(error).__name__}: {error}" if error is not None else f"status code {status}"
+            print(f" Giving up on {url} after {attempt + 1} attempts ({detail})")
+            return status, text
+
+        METRICS.inc('retries_total', stage=stage)
+        await asyncio.sleep(_retry_delay(attempt, retry_after))
+
+
+class _Progress:
+    # tqdm bar with the stage's live summary, refreshed every SUMMARY_INTERVAL seconds
+    def __init__(self, total, stage):
+        self.bar = tqdm(total=total, desc=stage)
+        self.stage = stage
+        self.started = time.monotonic()
+        self._last_summary = 0.0
+
+    def update(self):
+        self.bar.update(1)
+        now = time.monotonic()
+        if now - self._last_summary >= SUMMARY_INTERVAL:
+            self._last_summary = now
+            self.bar.set_postfix_str(METRICS.summary(self.stage, now - self.started), refresh=False)
+
+    def close(self):
+        self.bar.set_postfix_str(METRICS.summary(self.stage, time.monotonic() - self.started), refresh=False)
+        self.bar.close()
+
+
+async def _fetch_one(session, limiter, url, parse, progress, archive, refresh, stage):
+    # Serve the page from the archive when it is there, so nothing is downloaded twice
+    text = archive.get(url) if archive is not None and not refresh else None
+    if text is not None:
+        status = 200
+        METRICS.inc('archive_hits_total', stage=stage)
+    else:
+        status, text = await _download(session, limiter, url, stage)
+        if status == 200 and archive is not None:
+            archive.put(url, text)
+
+    # Parse as soon as the page arrives so only the parsed result is kept in memory
+    start = time.perf_counter()
+    try:
+        result = parse(url, status, text)
+    except Exception as e:
+        METRICS.inc('parse_failures_total', stage=stage, error=type(e).__name__)
+        raise
+    METRICS.observe('parse_seconds', time.perf_counter() - start, PARSE_BUCKETS, stage=stage)
+    progress.update()
+    return result
+
+
+async def _fetch_all(urls, parse, concurrency, stage, archive, refresh):
+    # One pooled session for the whole stage, so connections are kept alive and reused
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency)
+    limiter = AdaptiveLimiter(maximum=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT) as session:
+        progress = _Progress(len(urls), stage)
+        try:
+            tasks = [
+                _fetch_one(session, limiter, url, parse, progress, archive, refresh, stage)
+                for url in urls
+            ]
+            # gather keeps the results in the same order as the input urls
+            results = await asyncio.gather(*tasks)
+        finally:
+            progress.close()
+
+    retries = METRICS.total('retries_total', stage=stage)
+    if retries or limiter.throttled:
+        print(f" {retries} retries, {limiter.throttled} throttled or failed responses, "
+              f"concurrency ended at {int(limiter.limit)}")
+    return results
+
+
+def fetch_pages(urls, parse, concurrency=DEFAULT_CONCURRENCY, desc=None, archive_path=DEFAULT_ARCHIVE, refresh=False):
+    # Fetch every url concurrently and return parse(url, status, text) for each one,
+    # in the same order as urls. Failed requests are retried with backoff; status is
+    # None if no attempt got a response. Pages are served from the archive at
+    # archive_path when possible and every page downloaded is added to it;
+    # refresh=True always downloads (and re-archives) the page. Pass
+    # archive_path=None to bypass the archive. desc names the stage in the
+    # progress bar and in the metrics.
+    urls = list(urls)
+    if not urls:
+        return []
+    stage = desc or 'fetch'
+
+    if archive_path is None:
+        return asyncio.run(_fetch_all(urls, parse, concurrency, stage, None, refresh))
+
+    with PageArchive(archive_path) as archive:
+        return asyncio.run(_fetch_all(urls, parse, concurrency, stage, archive, refresh))
@@ -0,0 +1,71 @@
+import os
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+
+# HTML parser used for every page. lxml builds the same tree several times
+# faster than the pure-Python html.parser, so it is used whenever it is
+# installed. Set UFC_HTML_PARSER=html.parser to force the old parser.
+try:
+    import lxml  # noqa: F401
+    DEFAULT_PARSER = 'lxml'
+except ImportError:
+    DEFAULT_PARSER = 'html.parser'
+
+PARSER_BACKEND = os.environ.get('UFC_HTML_PARSER', DEFAULT_PARSER)
+
+
+def set_parser_backend(name):
+    global PARSER_BACKEND
+    PARSER_BACKEND = name
+
+
+class ClassMatch:
+    # While the page is being parsed the class attribute is still the raw
+    # string ("b-link b-fight-details__person-link"), so split it here. The
+    # repr names the classes, so a strainer's repr only changes with what it
+    # keeps (the pipeline fingerprints the strainers by it).
+    def __init__(self, class_names):
+        self.class_names = frozenset(class_names)
+
+    def __call__(self, value):
+        return value is not None and not self.class_names.isdisjoint(value.split())
+
+    def __repr__(self):
+        return f"has_class({', '.join(sorted(self.class_names))})"
+
+
+def has_class(*class_names):
+    return ClassMatch(class_names)
+
+
+# Each extractor only reads a few classes, so only those elements (and what is
+# inside them) are built into the tree. Everything else on the page is skipped
+# while parsing.
+EVENTS_LISTING_ONLY = SoupStrainer('a', class_=has_class('b-link_style_black'))
+
+EVENT_PAGE_ONLY = SoupStrainer('tr', class_=has_class('b-fight-details__table-row__hover'))
+
+EVENT_DETAILS_ONLY = SoupStrainer('li', class_=has_class('b-list__box-list-item'))
+
+FIGHTER_LINKS_ONLY = SoupStrainer('a', class_=has_class('b-fight-details__person-link'))
+
+FIGHT_PAGE_ONLY = SoupStrainer(['h2', 'h3', 'i', 'p'], class_=has_class(
+    'b-content__title',
+    'b-fight-details__person-name',
+    'b-fight-details__person-status',
+    'b-fight-details__fight-title',
+    'b-fight-details__text-item_first',
+    'b-fight-details__text-item',
+    'b-fight-details__table-text',
+))
+
+FIGHTER_PAGE_ONLY = SoupStrainer(['span', 'li'], class_=has_class(
+    'b-content__title-highlight',
+    'b-content__title-record',
+    'b-list__box-list-item_type_block',
+))
+
+
+def make_soup(html, parse_only=None):
+    return BeautifulSoup(html, PARSER_BACKEND, parse_only=parse_only)
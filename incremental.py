@@ -0,0 +1,141 @@
+import math
+import os
+
+import numpy as np
+import xgboost as xgb
+from sklearn.metrics import accuracy_score, log_loss
+
+from dataset_schema import DATASET_FILE, dataset_columns, read_dataset
+from model_registry import (
+    LEGACY_MODEL_FILE, MODELS_DIR, file_fingerprint, latest_version, load_fights, load_manifest, resolve_model,
+    save_model
+)
+from preprocessing import DROP_COLUMNS, REFERENCE_COLUMNS, FightPreprocessor, encode_winner, fight_keys
+
+
+# Extend the latest registered model with the fights it has not been trained
+# on, instead of refitting every tree. The new fights are encoded with the
+# preprocessor saved with that model, boosting rounds fitted on them alone are
+# appended, and the result is checked on the model's holdout fights. The work
+# grows with the number of new fights, not with the size of the dataset.
+#
+# train_incremental() returns None whenever a full refit is needed instead.
+#
+# Only registered versions are extended. fight_model.pkl, from before the
+# registry, does not record the fights it was trained on or held out, so the
+# new fights and a fair holdout cannot be told apart; it is refused, and the
+# full refit registers a version that the next incremental run can extend.
+
+# Rounds added are proportional to the new fights, at the fights-per-round rate
+# of the full refit, with at least this many
+MIN_ROUNDS = 5
+
+# A model that has grown past this many times the rounds of its full refit is refitted
+MAX_GROWTH = 2.0
+
+# Holdout log loss the update may lose before it is rejected
+LOSS_TOLERANCE = 0.005
+
+# The configuration train.py fits, as XGBClassifier arguments. backtest.py and
+# the benchmarks train the same model.
+TRAIN_PARAMS = {
+    'n_estimators': 200,
+    'learning_rate': 0.2,
+    'max_depth': 5,
+    'eval_metric': 'logloss',
+    'random_state': 42
+}
+
+# Parameters saved in the manifest that are not booster parameters
+NON_BOOSTER_PARAMS = ('n_estimators', 'num_boost_round', 'nthread', 'incremental_from', 'full_refit_rounds')
+
+
+def booster_params(params, nthread=None):
+    # Saved model parameters -> xgboost.train parameters. train.py saves
+    # XGBClassifier arguments, tune.py booster parameters. nthread replaces
+    # any thread count in params.
+    params = {name: value for name, value in params.items() if name not in NON_BOOSTER_PARAMS}
+    if 'random_state' in params:
+        params['seed'] = params.pop('random_state')
+    params.setdefault('objective', 'binary:logistic')
+    if nthread is not None:
+        params['nthread'] = nthread
+    return params
+
+
+def load_labelled_fights(dataset_path=DATASET_FILE):
+    # Dataset rows with a known winner, in the order prepare_ufc_data.py uses
+    used_cols = [col for col in dataset_columns(dataset_path) if col not in DROP_COLUMNS or col in REFERENCE_COLUMNS]
+    used_cols.append('event_name')
+    df = read_dataset(dataset_path, columns=used_cols)
+    return df[encode_winner(df['winner']).notna()].reset_index(drop=True)
+
+
+def train_incremental(registry=MODELS_DIR, dataset_path=DATASET_FILE, tolerance=LOSS_TOLERANCE):
+    version = latest_version(registry)
+    if version is None:
+        if os.path.exists(LEGACY_MODEL_FILE):
+            print(f" Only {LEGACY_MODEL_FILE} was found; it does not record the fights it was trained on, "
+                  f"so it cannot be extended")
+        else:
+            print(" No registered model to extend")
+        return None
+    fights = load_fights(version, registry)
+    if fights is None:
+        print(f" Model version {version} does not record the fights it was trained on")
+        return None
+
+    manifest = load_manifest(version, registry)
+    model_path, preprocessor_path = resolve_model(version, registry)
+    preprocessor = FightPreprocessor.load(preprocessor_path)
+    if manifest['features'] and preprocessor.columns != manifest['features']:
+        print(f" The preprocessor of model version {version} does not match its features")
+        return None
+
+    df = load_labelled_fights(dataset_path)
+    keys = np.array(fight_keys(df), dtype=object)
+    is_new = ~np.isin(keys, list(fights['train'] | fights['holdout']))
+    is_holdout = np.isin(keys, list(fights['holdout']))
+    new_count = int(is_new.sum())
+    if new_count == 0:
+        print(f" No new fights since model version {version}")
+        return version
+    if not is_holdout.any():
+        print(f" None of the holdout fights of model version {version} are in {dataset_path}")
+        return None
+
+    full_refit_rounds = manifest['params'].get('full_refit_rounds', manifest['num_trees'])
+    rounds = max(MIN_ROUNDS, math.ceil(new_count * full_refit_rounds / max(len(fights['train']), 1)))
+    booster = xgb.Booster(model_file=model_path)
+    if booster.num_boosted_rounds() + rounds > MAX_GROWTH * full_refit_rounds:
+        print(f" Model version {version} has grown to {booster.num_boosted_rounds()} rounds")
+        return None
+
+    # Only the new and the holdout fights are encoded
+    target = encode_winner(df['winner']).to_numpy(dtype=float)
+    x_new = preprocessor.transform_array(df[is_new])
+    x_holdout = preprocessor.transform_array(df[is_holdout])
+    y_holdout = target[is_holdout]
+    previous_loss = log_loss(y_holdout, booster.inplace_predict(x_holdout), labels=[0, 1])
+
+    dtrain = xgb.DMatrix(x_new, label=target[is_new], feature_names=preprocessor.columns)
+    updated = xgb.train(booster_params(manifest['params']), dtrain, num_boost_round=rounds, xgb_model=booster)
+
+    probabilities = updated.inplace_predict(x_holdout)
+    loss = log_loss(y_holdout, probabilities, labels=[0, 1])
+    print(f" Added {rounds} rounds for {new_count} new fights; holdout log loss {previous_loss:.4f} -> {loss:.4f}")
+    if loss > previous_loss + tolerance:
+        print(" The update made the holdout log loss worse")
+        return None
+
+    metrics = {
+        'accuracy': float(accuracy_score(y_holdout, probabilities >= 0.5)),
+        'log_loss': float(loss),
+        'train_rows': len(fights['train']) + new_count,
+        'test_rows': int(is_holdout.sum()),
+        'new_rows': new_count,
+    }
+    params = dict(manifest['params'], incremental_from=version, full_refit_rounds=full_refit_rounds)
+    trained = {'train': fights['train'] | set(keys[is_new]), 'holdout': fights['holdout']}
+    return save_model(updated, file_fingerprint(dataset_path), metrics, params, preprocessor_path, registry,
+                      fights=trained)
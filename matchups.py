@@ -0,0 +1,107 @@
+import argparse
+import re
+import time
+
+import numpy as np
+
+from data_scraping import FIGHT_DATA_FILE, read_url_file
+from predictor import FightPredictor
+from record_store import iter_records_by_key
+
+
+# Rank every hypothetical pairing inside each weight class. The rows of all
+# divisions are built as one matrix and scored with a single model call.
+#
+#   python matchups.py --top 5
+#   python matchups.py --division Lightweight --top 20
+
+
+def division_name(weight_class):
+    # "UFC Interim Lightweight Title" -> "Lightweight"
+    name = re.sub(r'^(UFC )?(Interim )?', '', weight_class or '')
+    return re.sub(r' Title$', '', name).strip()
+
+
+def load_divisions(fight_urls_path='fight_urls.txt'):
+    # Division -> fighter names, each fighter in the division of their latest fight.
+    # fight_urls.txt lists the newest fights first.
+    fight_urls = read_url_file(fight_urls_path)
+    fighter_divisions = {}
+    for fight in iter_records_by_key(FIGHT_DATA_FILE, fight_urls, key='fight_url'):
+        division = division_name(fight.get('weight_class'))
+        if not division:
+            continue
+        for name in (fight.get('red_fighter_name'), fight.get('blue_fighter_name')):
+            if name and name not in fighter_divisions:
+                fighter_divisions[name] = division
+
+    divisions = {}
+    for name, division in fighter_divisions.items():
+        divisions.setdefault(division, []).append(name)
+    return divisions
+
+
+def score_divisions(predictor, divisions):
+    # Division -> (fighter names, matrix of P(row fighter beats column fighter)).
+    # Fighters without a saved profile are left out.
+    fighters = {}
+    for division, names in divisions.items():
+        known = [name for name in names if _has_profile(predictor, name)]
+        if len(known) >= 2:
+            fighters[division] = known
+
+    blocks = [predictor.matchup_rows(names, weight_class=division) for division, names in fighters.items()]
+    if not blocks:
+        return {}
+    probabilities = predictor.predict_rows(np.vstack(blocks))
+
+    results = {}
+    start = 0
+    for division, names in fighters.items():
+        count = len(names)
+        matrix = probabilities[start:start + count * count].reshape(count, count).astype(float)
+        np.fill_diagonal(matrix, np.nan)
+        results[division] = (names, matrix)
+        start += count * count
+    return results
+
+
+def _has_profile(predictor, name):
+    try:
+        predictor.profile(name)
+    except KeyError:
+        return False
+    return True
+
+
+def closest_matchups(names, matrix, top):
+    # The most even pairings, each pair once, as (red, blue, P(red wins))
+    upper = np.triu_indices(len(names), k=1)
+    evenness = np.abs(matrix[upper] - 0.5)
+    order = np.argsort(evenness)[:top]
+    return [(names[upper[0][i]], names[upper[1][i]], matrix[upper][i]) for i in order]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Score every pairing within each weight class')
+    parser.add_argument('--division', default=None, help='only this division')
+    parser.add_argument('--top', type=int, default=5, help='closest matchups to list per division')
+    parser.add_argument('--model', default=None,
+                        help='model file or .npz tree export (default: latest registered model)')
+    args = parser.parse_args()
+
+    predictor = FightPredictor(args.model)
+    divisions = load_divisions()
+    if args.division:
+        divisions = {args.division: divisions.get(args.division, [])}
+
+    start = time.monotonic()
+    results = score_divisions(predictor, divisions)
+    elapsed = time.monotonic() - start
+    pairings = sum(len(names) ** 2 for names, _ in results.values())
+    print(f" Scored {pairings} pairings in {len(results)} divisions in {elapsed * 1000:.0f}ms")
+
+    for division, (names, matrix) in results.items():
+        print(f"\n{division} ({len(names)} fighters)")
+        for red, blue, probability in closest_matchups(names, matrix, args.top):
+            print(f"  {red} vs {blue}: {probability:.1%}")
@@ -0,0 +1,213 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+# Counters and histograms for the crawl, labelled by stage, instead of a print
+# per page. A short live summary goes in the progress bar, and everything can
+# be exported at the end of a run as JSON or as a Prometheus textfile (for the
+# node_exporter textfile collector).
+#
+# Per-record logging is off unless UFC_VERBOSE=1 is set or --verbose is given.
+
+VERBOSE = os.environ.get('UFC_VERBOSE', '') not in ('', '0')
+
+PREFIX = 'ufc_scraper_'
+
+# Upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+DESCRIPTIONS = {
+    'pages_fetched_total': 'Pages downloaded with a response',
+    'archive_hits_total': 'Pages served from the page archive instead of downloaded',
+    'bytes_fetched_total': 'Response body bytes downloaded',
+    'fetch_failures_total': 'Failed download attempts, by reason',
+    'retries_total': 'Download attempts retried',
+    'parse_failures_total': 'Pages that could not be parsed, by error type',
+    'records_written_total': 'Records appended to record files',
+    'http_request_seconds': 'Time from request to full response body',
+    'parse_seconds': 'Time to parse one page',
+}
+
+
+def set_verbose(verbose):
+    global VERBOSE
+    VERBOSE = verbose
+
+
+def log(*args):
+    # Per-record detail, only printed in verbose mode
+    if VERBOSE:
+        print(*args)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-quantile; inf past the last bucket
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        # Pages are parsed on the event loop thread, but records can be written from any thread
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, buckets=LATENCY_BUCKETS, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, buckets, **labels)
+
+    def total(self, name, **labels):
+        # Sum of a counter over every label set that includes labels
+        wanted = set(_label_key(labels))
+        return sum(value for (counter, key), value in self.counters.items()
+                   if counter == name and wanted <= set(key))
+
+    def histogram(self, name, **labels):
+        return self.histograms.get((name, _label_key(labels)))
+
+    def summary(self, stage, elapsed=None):
+        # One line for the progress bar of a fetch stage that has run for elapsed seconds
+        elapsed = max(elapsed if elapsed is not None else time.time() - self.started, 1e-9)
+        pages = self.total('pages_fetched_total', stage=stage) + self.total('archive_hits_total', stage=stage)
+        parts = [
+            f"{pages / elapsed:.1f} pages/s",
+            f"{self.total('bytes_fetched_total', stage=stage) / 2 ** 20:.1f} MB",
+        ]
+        archived = self.total('archive_hits_total', stage=stage)
+        if archived:
+            parts.append(f"{archived} archived")
+        latency = self.histogram('http_request_seconds', stage=stage)
+        if latency is not None and latency.count:
+            parts.append(f"p50 {latency.quantile(0.5) * 1000:.0f}ms")
+        failures = self.total('fetch_failures_total', stage=stage) + self.total('parse_failures_total', stage=stage)
+        if failures:
+            parts.append(f"{failures} failed")
+        return ', '.join(parts)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'seconds': time.time() - self.started,
+                'counters': [
+                    {'name': name, 'labels': dict(key), 'value': value}
+                    for (name, key), value in sorted(self.counters.items())
+                ],
+                'histograms': [
+                    {'name': name, 'labels': dict(key), **histogram.to_dict()}
+                    for (name, key), histogram in sorted(self.histograms.items())
+                ],
+            }
+
+    def to_prometheus(self):
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in DESCRIPTIONS:
+                    lines.append(f'# HELP {PREFIX}{name} {DESCRIPTIONS[name]}')
+                lines.append(f'# TYPE {PREFIX}{name} {kind}')
+
+        def labels_text(key, extra=()):
+            pairs = list(key) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                       for _, value in pairs)
+            return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+        with self._lock:
+            for (name, key), value in sorted(self.counters.items()):
+                describe(name, 'counter')
+                lines.append(f'{PREFIX}{name}{labels_text(key)} {value}')
+
+            for (name, key), histogram in sorted(self.histograms.items()):
+                describe(name, 'histogram')
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{PREFIX}{name}_bucket{labels_text(key, [("le", le)])} {cumulative}')
+                lines.append(f'{PREFIX}{name}_sum{labels_text(key)} {histogram.sum}')
+                lines.append(f'{PREFIX}{name}_count{labels_text(key)} {histogram.count}')
+
+        lines.append(f'# TYPE {PREFIX}run_started_seconds gauge')
+        lines.append(f'{PREFIX}run_started_seconds {self.started}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, json_path=None, prometheus_path=None):
+        # Written next to the target and renamed, so a collector never reads half a file
+        for path, text in ((json_path, lambda: json.dumps(self.to_dict(), indent=1)),
+                           (prometheus_path, self.to_prometheus)):
+            if path:
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(text())
+                os.replace(tmp_path, path)
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.histograms.clear()
+
+
+# Shared by every module of a run
+METRICS = Metrics()
@@ -0,0 +1,179 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from preprocessing import PREPROCESSOR_FILE
+
+
+# Trained models, several versions side by side:
+#
+#   models/<version>/model.ubj          booster in xgboost's native binary format
+#   models/<version>/preprocessor.json  the fitted preprocessing it was trained with
+#   models/<version>/manifest.json      features, hashes, data fingerprint, metrics
+#                                       (the data fingerprint is of completed_events_large.parquet)
+#   models/<version>/fights.json        keys of the fights it was trained and tested on
+#   models/LATEST                       name of the version served by default
+#
+# Nothing in here is unpickled, so a version loads with any Python and any
+# recent xgboost.
+
+MODELS_DIR = 'models'
+MODEL_NAME = 'model.ubj'
+PREPROCESSOR_NAME = 'preprocessor.json'
+MANIFEST_NAME = 'manifest.json'
+FIGHTS_NAME = 'fights.json'
+LATEST_NAME = 'LATEST'
+
+# Model saved by train.py before the registry existed
+LEGACY_MODEL_FILE = 'fight_model.pkl'
+
+
+def file_fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, text):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def version_dir(version, registry=MODELS_DIR):
+    return os.path.join(registry, version)
+
+
+def version_paths(version, registry=MODELS_DIR):
+    # (model path, preprocessor path) of a version
+    directory = version_dir(version, registry)
+    return os.path.join(directory, MODEL_NAME), os.path.join(directory, PREPROCESSOR_NAME)
+
+
+def save_model(booster, data_fingerprint, metrics, params=None, preprocessor_path=PREPROCESSOR_FILE,
+               registry=MODELS_DIR, make_latest=True, fights=None):
+    # Add a new version and return its name. booster is an xgboost Booster or an XGBClassifier.
+    # fights maps 'train' and 'holdout' to the fight keys used, so the version can be
+    # extended with new fights later.
+    booster = booster.get_booster() if hasattr(booster, 'get_booster') else booster
+    preprocessor_hash = file_fingerprint(preprocessor_path)
+
+    base_version = time.strftime('%Y%m%d-%H%M%S') + '-' + data_fingerprint[:8]
+    version = base_version
+    suffix = 1
+    while os.path.exists(version_dir(version, registry)):
+        suffix += 1
+        version = f'{base_version}-{suffix}'
+
+    # Written next to the registry first and renamed into place, so a version is either complete or absent
+    tmp_dir = version_dir(version, registry) + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    booster.save_model(os.path.join(tmp_dir, MODEL_NAME))
+    shutil.copyfile(preprocessor_path, os.path.join(tmp_dir, PREPROCESSOR_NAME))
+    if fights is not None:
+        with open(os.path.join(tmp_dir, FIGHTS_NAME), 'w') as f:
+            json.dump({name: list(keys) for name, keys in fights.items()}, f)
+
+    # Imported here so that serving from the registry does not need xgboost
+    import xgboost as xgb
+
+    manifest = {
+        'version': version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'xgboost_version': xgb.__version__,
+        'features': list(booster.feature_names or []),
+        'num_trees': booster.num_boosted_rounds(),
+        'params': params or {},
+        'preprocessor_sha256': preprocessor_hash,
+        'model_sha256': file_fingerprint(os.path.join(tmp_dir, MODEL_NAME)),
+        'data_fingerprint': data_fingerprint,
+        'metrics': metrics,
+    }
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_dir, version_dir(version, registry))
+
+    if make_latest:
+        set_latest(version, registry)
+    return version
+
+
+def set_latest(version, registry=MODELS_DIR):
+    # Promote a version, or roll back to an older one
+    if not os.path.exists(os.path.join(version_dir(version, registry), MANIFEST_NAME)):
+        raise ValueError(f"Model version {version} is not in {registry}")
+    _write_atomic(os.path.join(registry, LATEST_NAME), version + '\n')
+
+
+def latest_version(registry=MODELS_DIR):
+    path = os.path.join(registry, LATEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+
+def load_manifest(version, registry=MODELS_DIR):
+    with open(os.path.join(version_dir(version, registry), MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def load_fights(version, registry=MODELS_DIR):
+    # {'train': keys, 'holdout': keys} of a version, None for versions saved without them
+    path = os.path.join(version_dir(version, registry), FIGHTS_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return {name: set(keys) for name, keys in json.load(f).items()}
+
+
+def list_versions(registry=MODELS_DIR):
+    # Manifests of every complete version, oldest first
+    if not os.path.isdir(registry):
+        return []
+    versions = [
+        name for name in os.listdir(registry)
+        if os.path.exists(os.path.join(registry, name, MANIFEST_NAME))
+    ]
+    return [load_manifest(version, registry) for version in sorted(versions)]
+
+
+def resolve_model(version=None, registry=MODELS_DIR):
+    # (model path, preprocessor path) to serve: the given version, else the latest
+    # one, else the pickled model and preprocessor from before the registry
+    version = version or latest_version(registry)
+    if version is None:
+        return LEGACY_MODEL_FILE, PREPROCESSOR_FILE
+
+    model_path, preprocessor_path = version_paths(version, registry)
+    manifest = load_manifest(version, registry)
+    if file_fingerprint(preprocessor_path) != manifest['preprocessor_sha256']:
+        raise ValueError(f"The preprocessor of model version {version} does not match its manifest")
+    return model_path, preprocessor_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='List and promote registered models')
+    parser.add_argument('command', choices=['list', 'promote'])
+    parser.add_argument('version', nargs='?')
+    parser.add_argument('--registry', default=MODELS_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        latest = latest_version(args.registry)
+        for manifest in list_versions(args.registry):
+            marker = '*' if manifest['version'] == latest else ' '
+            metrics = ', '.join(f'{name} {value:.4f}' for name, value in manifest['metrics'].items()
+                                if isinstance(value, float))
+            print(f"{marker} {manifest['version']}  {len(manifest['features'])} features  {metrics}")
+    else:
+        set_latest(args.version, args.registry)
+        print(f" {args.version} is now the latest model.")
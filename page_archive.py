@@ -0,0 +1,251 @@
+import hashlib
+import mmap
+import os
+import struct
+
+import zstandard
+
+
+# Raw HTML of every fetched page, kept so the parsers can be re-run offline.
+#
+# <path>.pack is append-only. Each record is a header (url length, compressed
+# page length), the url and the zstd-compressed page.
+#
+# <path>.idx is an open-addressing hash table of fixed-size slots (url hash,
+# record offset, record length) behind a small header, memory-mapped so a
+# lookup touches one or two slots and never loads the whole archive. When a url
+# is stored again the slot is pointed at the newer record.
+
+RECORD_HEADER = struct.Struct('<II')
+INDEX_HEADER = struct.Struct('<8sQQQ')  # magic, capacity, count, indexed pack size
+SLOT = struct.Struct('<QQQ')  # url hash, record offset, record length
+INDEX_MAGIC = b'UFCIDX01'
+
+INITIAL_CAPACITY = 1 << 12
+MAX_LOAD = 0.6
+
+
+def _url_hash(url):
+    value = int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+    # 0 marks an empty slot
+    return value or 1
+
+
+class PageArchive:
+    def __init__(self, path, readonly=False, level=3):
+        self.pack_path = path + '.pack'
+        self.index_path = path + '.idx'
+        self.readonly = readonly
+
+        if not readonly:
+            if not os.path.exists(self.pack_path):
+                open(self.pack_path, 'wb').close()
+            if not os.path.exists(self.index_path):
+                self._write_empty_index(self.index_path, INITIAL_CAPACITY)
+
+        self._pack = open(self.pack_path, 'rb' if readonly else 'rb+')
+        self._pack_size = os.fstat(self._pack.fileno()).st_size
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._map_index()
+
+        if not readonly:
+            self._recover()
+
+    # --- index file ---
+
+    @staticmethod
+    def _write_empty_index(path, capacity):
+        with open(path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, capacity, 0, 0))
+            f.truncate(INDEX_HEADER.size + capacity * SLOT.size)
+
+    def _map_index(self):
+        self._index_file = open(self.index_path, 'rb' if self.readonly else 'rb+')
+        access = mmap.ACCESS_READ if self.readonly else mmap.ACCESS_WRITE
+        self._index = mmap.mmap(self._index_file.fileno(), 0, access=access)
+
+        magic, self.capacity, self.count, _ = INDEX_HEADER.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{self.index_path} is not a page archive index")
+
+    def _unmap_index(self):
+        self._index.close()
+        self._index_file.close()
+
+    def _indexed_pack_size(self):
+        return INDEX_HEADER.unpack_from(self._index, 0)[3]
+
+    def _write_header(self, indexed_pack_size):
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, self.capacity, self.count, indexed_pack_size)
+
+    def _slot_offset(self, slot):
+        return INDEX_HEADER.size + slot * SLOT.size
+
+    def _find_slot(self, url, url_hash):
+        # Linear probing. Returns (slot, record offset, record length); the offset
+        # is None when the url is not stored and slot is where it would go.
+        mask = self.capacity - 1
+        slot = url_hash & mask
+        while True:
+            stored_hash, offset, length = SLOT.unpack_from(self._index, self._slot_offset(slot))
+            if stored_hash == 0:
+                return slot, None, None
+            if stored_hash == url_hash and self._read_url(offset) == url:
+                return slot, offset, length
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        # Rehash every slot into a table twice the size. Hashes are stored in the
+        # slots, so the pack file is not read.
+        new_capacity = self.capacity * 2
+        new_slots = bytearray(new_capacity * SLOT.size)
+        mask = new_capacity - 1
+
+        for slot in range(self.capacity):
+            entry = SLOT.unpack_from(self._index, self._slot_offset(slot))
+            if entry[0] == 0:
+                continue
+            new_slot = entry[0] & mask
+            while SLOT.unpack_from(new_slots, new_slot * SLOT.size)[0] != 0:
+                new_slot = (new_slot + 1) & mask
+            SLOT.pack_into(new_slots, new_slot * SLOT.size, *entry)
+
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, new_capacity, self.count, self._indexed_pack_size()))
+            f.write(new_slots)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._unmap_index()
+        os.replace(tmp_path, self.index_path)
+        self._map_index()
+
+    def _recover(self):
+        # Records appended after the index was last flushed (for example because
+        # of a crash) are still in the pack file, so index them again
+        indexed_pack_size = self._indexed_pack_size()
+        if indexed_pack_size > self._pack_size:
+            self.rebuild_index()
+        elif indexed_pack_size < self._pack_size:
+            self._index_records(indexed_pack_size)
+
+    def _index_records(self, start):
+        offset = start
+        while offset + RECORD_HEADER.size <= self._pack_size:
+            url_length, page_length = RECORD_HEADER.unpack(os.pread(self._pack.fileno(), RECORD_HEADER.size, offset))
+            length = RECORD_HEADER.size + url_length + page_length
+            if offset + length > self._pack_size:
+                # Torn record at the end of the pack, cut it off
+                os.ftruncate(self._pack.fileno(), offset)
+                break
+            self._insert(self._read_url(offset), offset, length)
+            offset += length
+
+        self._pack_size = offset
+        self._write_header(offset)
+
+    def rebuild_index(self):
+        self._unmap_index()
+        self._write_empty_index(self.index_path, INITIAL_CAPACITY)
+        self._map_index()
+        self._pack_size = os.fstat(self._pack.fileno()).st_size
+        self._index_records(0)
+
+    # --- pack file ---
+
+    def _read_url(self, offset):
+        url_length, _ = RECORD_HEADER.unpack(os.pread(self._pack.fileno(), RECORD_HEADER.size, offset))
+        return os.pread(self._pack.fileno(), url_length, offset + RECORD_HEADER.size).decode('utf-8')
+
+    def _insert(self, url, offset, length):
+        url_hash = _url_hash(url)
+        slot, old_offset, _ = self._find_slot(url, url_hash)
+        SLOT.pack_into(self._index, self._slot_offset(slot), url_hash, offset, length)
+
+        if old_offset is None:
+            self.count += 1
+            if self.count > self.capacity * MAX_LOAD:
+                self._grow()
+
+    # --- public api ---
+
+    def put(self, url, html):
+        if self.readonly:
+            raise ValueError("archive is opened read-only")
+
+        url_bytes = url.encode('utf-8')
+        page = self._compressor.compress(html.encode('utf-8'))
+        record = RECORD_HEADER.pack(len(url_bytes), len(page)) + url_bytes + page
+
+        offset = self._pack_size
+        os.pwrite(self._pack.fileno(), record, offset)
+        self._pack_size = offset + len(record)
+        self._insert(url, offset, len(record))
+        self._write_header(self._pack_size)
+
+    def get(self, url):
+        _, offset, length = self._find_slot(url, _url_hash(url))
+        if offset is None:
+            return None
+
+        record = os.pread(self._pack.fileno(), length, offset)
+        url_length, _ = RECORD_HEADER.unpack_from(record, 0)
+        page = record[RECORD_HEADER.size + url_length:]
+        return self._decompressor.decompress(page).decode('utf-8')
+
+    def __contains__(self, url):
+        return self._find_slot(url, _url_hash(url))[1] is not None
+
+    def __len__(self):
+        return self.count
+
+    def urls(self):
+        # Every stored url, in index order
+        for slot in range(self.capacity):
+            stored_hash, offset, _ = SLOT.unpack_from(self._index, self._slot_offset(slot))
+            if stored_hash != 0:
+                yield self._read_url(offset)
+
+    def merge(self, source):
+        # Copy every page of another archive into this one as stored, without
+        # decompressing it. Pages of urls this archive has are replaced.
+        if self.readonly:
+            raise ValueError("archive is opened read-only")
+
+        copied = 0
+        for slot in range(source.capacity):
+            stored_hash, offset, length = SLOT.unpack_from(source._index, source._slot_offset(slot))
+            if stored_hash == 0:
+                continue
+            record = os.pread(source._pack.fileno(), length, offset)
+            url_length, _ = RECORD_HEADER.unpack_from(record, 0)
+            url = record[RECORD_HEADER.size:RECORD_HEADER.size + url_length].decode('utf-8')
+
+            new_offset = self._pack_size
+            os.pwrite(self._pack.fileno(), record, new_offset)
+            self._pack_size = new_offset + length
+            self._insert(url, new_offset, length)
+            copied += 1
+
+        self._write_header(self._pack_size)
+        return copied
+
+    def flush(self):
+        if not self.readonly:
+            os.fsync(self._pack.fileno())
+            self._index.flush()
+
+    def close(self):
+        if self._pack.closed:
+            return
+        self.flush()
+        self._unmap_index()
+        self._pack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import subprocess
+import sys
+import time
+
+import data_scraping
+import dataset_schema
+import feature_cache
+import feature_store
+import html_backend
+import incremental
+import model_registry
+import prepare_ufc_data
+import preprocessing
+import record_store
+from data_scraping import (
+    CRAWL_MANIFEST_FILE, FIGHT_DATA_FILE, FIGHTERS_STATS_FILE, calculate_diff, combine_large_dataset,
+    get_completed_event_urls, get_fight_data, get_fighter_urls, get_fight_urls, get_fighters_stats, read_url_file
+)
+from dataset_schema import DATASET_FILE, DIFF_FIELDS, read_dataset, write_dataset
+from feature_store import FEATURE_STORE_FILE
+from model_registry import file_fingerprint, latest_version, version_paths
+from prepare_ufc_data import REFERENCE_FILE
+from preprocessing import PREPROCESSOR_FILE, TRAIN_DATA_FILE
+from record_store import load_records_by_key
+
+
+# The steps from ufcstats.com to a trained model as a chain of stages:
+#
+#   scrape      event urls -> fight_urls.txt, fighter_urls.txt, event dates in crawl_manifest.json
+#   extract     url lists -> fight_data.jsonl, fighters_stats.jsonl
+#   combine     records -> fights joined with profiles, fighter_features.json
+#   diff        combined fights -> completed_events_large.parquet
+#   preprocess  dataset -> training rows and fight_preprocessor.json
+#   train       training rows -> a new model version in the registry
+#
+# A stage's key is a hash of the contents of its input files, its parameters
+# and the source of the code it runs. A stage is skipped when its key matches
+# the one it last ran with and its outputs are unchanged since; otherwise it
+# runs again, which changes its outputs and so the keys of the stages after it.
+#
+#   python pipeline.py                   run every stale stage
+#   python pipeline.py --until diff      stop after the dataset is written
+#   python pipeline.py --force extract   run a stage even if it is up to date
+#   python pipeline.py --status
+
+PIPELINE_STATE_FILE = 'pipeline_state.json'
+
+# Fights joined with the profiles, before the difference columns
+COMBINED_FILE = 'completed_events_combined.parquet'
+
+FIGHT_URLS_FILE = 'fight_urls.txt'
+FIGHTER_URLS_FILE = 'fighter_urls.txt'
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train.py')
+
+
+class Stage:
+    # code: functions, classes, modules and files whose source makes up the
+    # stage, and other objects such as the SoupStrainers by their repr.
+    # Changing any of them, or version, invalidates the stage. The scrape and
+    # extract stages only list the parsers and strainers their outputs depend
+    # on, so editing the fetching around them does not rebuild the record
+    # files. With rebuild_outputs the outputs are
+    # deleted before the stage runs for code that differs from the code they
+    # were built with, for stages that only add to their outputs.
+    #
+    # outputs is a list of paths, or a function of the stage's saved state for
+    # outputs whose path is only known once it ran. record returns what to keep
+    # in that state after a run, such as the model version it saved.
+    def __init__(self, name, run, inputs, outputs, code, params=None, version=1, rebuild_outputs=False,
+                 record=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = outputs if callable(outputs) else list(outputs)
+        self.code = list(code)
+        self.params = params or (lambda: {})
+        self.version = version
+        self.rebuild_outputs = rebuild_outputs
+        self.record = record or (lambda: {})
+
+    def output_paths(self, saved):
+        return self.outputs(saved) if callable(self.outputs) else self.outputs
+
+    def code_fingerprint(self):
+        digest = hashlib.sha256(f'{self.name} {self.version}\n'.encode())
+        for obj in self.code:
+            if isinstance(obj, str):
+                source = open(obj).read()
+            elif inspect.ismodule(obj) or inspect.isclass(obj) or inspect.isroutine(obj):
+                source = inspect.getsource(obj)
+            else:
+                source = repr(obj)
+            digest.update(source.encode())
+        return digest.hexdigest()
+
+    def key(self, params):
+        digest = hashlib.sha256(self.code_fingerprint().encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        for path in self.inputs:
+            digest.update(f'{path} {file_fingerprint(path) if os.path.exists(path) else None}\n'.encode())
+        return digest.hexdigest()
+
+
+def output_fingerprints(stage, saved):
+    return {path: file_fingerprint(path) if os.path.exists(path) else None for path in stage.output_paths(saved)}
+
+
+def load_state(path=PIPELINE_STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=PIPELINE_STATE_FILE):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _scrape(event_urls):
+    # The fight pages are fetched again instead of reusing the crawl queue's
+    # results from an earlier run, which the parser may have changed since
+    fight_urls = get_fight_urls(event_urls)
+    if get_fighter_urls(fight_urls, refresh=True) is None:
+        raise Exception("Some fight pages failed to load; run the pipeline again to retry them")
+
+
+def _extract():
+    # Pages come from the page archive when they are there, so rebuilding the
+    # record files after a parser change does not download them again
+    fight_urls = read_url_file(FIGHT_URLS_FILE)
+    get_fighters_stats(read_url_file(FIGHTER_URLS_FILE))
+    get_fight_data(fight_urls)
+
+
+def _combine():
+    fighters_stats = load_records_by_key(FIGHTERS_STATS_FILE, 'url')
+    combined, store = combine_large_dataset(read_url_file(FIGHT_URLS_FILE), fighters_stats,
+                                            read_url_file(FIGHTER_URLS_FILE))
+    store.save(FEATURE_STORE_FILE)
+    write_dataset(combined, COMBINED_FILE)
+
+
+def _diff():
+    write_dataset(calculate_diff(read_dataset(COMBINED_FILE)), DATASET_FILE)
+    print(f'Large dataset has been saved to "{DATASET_FILE}".')
+
+
+def _train():
+    # train.py is a script; it runs as its own process, like from the command line
+    subprocess.run([sys.executable, TRAIN_SCRIPT], check=True)
+
+
+def _trained_model(saved):
+    # The model file of the version the train stage saved. tune.py and
+    # train.py --incremental move LATEST on without making this stage stale.
+    version = saved.get('version')
+    return [version_paths(version)[0]] if version else []
+
+
+def build_stages(event_urls=None, chunked=False):
+    # Without event_urls the events listing is only fetched once the scrape stage needs it
+    events = {'urls': event_urls}
+
+    def completed_events():
+        if events['urls'] is None:
+            events['urls'] = get_completed_event_urls()
+        return events['urls']
+
+    return [
+        Stage('scrape', lambda: _scrape(completed_events()), [], [FIGHT_URLS_FILE, FIGHTER_URLS_FILE],
+              [data_scraping.parse_event_page, data_scraping.parse_event_date, data_scraping.parse_fighter_links,
+               html_backend.make_soup, html_backend.EVENT_PAGE_ONLY, html_backend.EVENT_DETAILS_ONLY,
+               html_backend.FIGHTER_LINKS_ONLY],
+              params=lambda: {'event_urls': completed_events()}),
+        Stage('extract', _extract, [FIGHT_URLS_FILE, FIGHTER_URLS_FILE], [FIGHT_DATA_FILE, FIGHTERS_STATS_FILE],
+              [data_scraping.parse_fight_page, data_scraping.create_common_dict, data_scraping.create_stats_dict,
+               data_scraping.parse_fighter_page, html_backend.make_soup,
+               html_backend.FIGHT_PAGE_ONLY, html_backend.FIGHTER_PAGE_ONLY],
+              rebuild_outputs=True),
+        # The crawl manifest holds the event dates the ages are computed at
+        Stage('combine', _combine,
+              [FIGHT_URLS_FILE, FIGHTER_URLS_FILE, FIGHT_DATA_FILE, FIGHTERS_STATS_FILE, CRAWL_MANIFEST_FILE],
+              [COMBINED_FILE, FEATURE_STORE_FILE],
+              [_combine, data_scraping, feature_store, dataset_schema, record_store]),
+        Stage('diff', _diff, [COMBINED_FILE], [DATASET_FILE], [_diff, data_scraping, dataset_schema],
+              params=lambda: {'diff_fields': DIFF_FIELDS}),
+        Stage('preprocess', lambda: (prepare_ufc_data.prepare_chunked() if chunked else prepare_ufc_data.prepare()),
+              [DATASET_FILE], [TRAIN_DATA_FILE, PREPROCESSOR_FILE, REFERENCE_FILE],
+              [prepare_ufc_data, preprocessing, dataset_schema], params=lambda: {'chunked': chunked}),
+        Stage('train', _train, [TRAIN_DATA_FILE, PREPROCESSOR_FILE, DATASET_FILE], _trained_model,
+              [TRAIN_SCRIPT, preprocessing, feature_cache, model_registry, incremental, dataset_schema],
+              record=lambda: {'version': latest_version()}),
+    ]
+
+
+def stage_status(stage, state):
+    # (key, reason the stage has to run or None)
+    params = stage.params()
+    key = stage.key(params)
+    saved = state.get(stage.name)
+    if saved is None:
+        return key, 'never run'
+    if saved['key'] != key:
+        return key, 'inputs, parameters or code changed'
+    if saved['outputs'] != output_fingerprints(stage, saved):
+        return key, 'outputs changed since it ran'
+    return key, None
+
+
+def run_pipeline(event_urls=None, until=None, force=(), chunked=False, state_path=PIPELINE_STATE_FILE):
+    stages = build_stages(event_urls, chunked)
+    names = [stage.name for stage in stages]
+    if until is not None:
+        stages = stages[:names.index(until) + 1]
+
+    state = load_state(state_path)
+    for stage in stages:
+        key, reason = stage_status(stage, state)
+        if reason is None and stage.name not in force:
+            print(f" [{stage.name}] up to date")
+            continue
+
+        saved = state.get(stage.name)
+        code = stage.code_fingerprint()
+        if stage.rebuild_outputs and saved is not None and saved['code'] != code:
+            # Records of an earlier parser are not mixed with new ones. Without
+            # saved state nothing is known about the outputs, so they are kept.
+            outputs = stage.output_paths(saved)
+            print(f" [{stage.name}] code changed, rebuilding {', '.join(outputs)}")
+            for path in outputs:
+                if os.path.exists(path):
+                    os.remove(path)
+            # An interrupted rebuild picks up where it stopped instead of starting over
+            state[stage.name] = {'key': None, 'code': code, 'outputs': {}}
+            save_state(state, state_path)
+
+        print(f" [{stage.name}] running ({reason or 'forced'})")
+        start = time.monotonic()
+        stage.run()
+        state[stage.name] = _finished_state(stage, key, code, time.monotonic() - start)
+        save_state(state, state_path)
+
+
+def _finished_state(stage, key, code, seconds):
+    saved = {'key': key, 'code': code, **stage.record()}
+    saved['outputs'] = output_fingerprints(stage, saved)
+    saved['finished_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    saved['seconds'] = round(seconds, 3)
+    return saved
+
+
+def mark_done(stage_names, event_urls=None, state_path=PIPELINE_STATE_FILE):
+    # Record stages whose outputs were written outside the pipeline, by an
+    # incremental update, a re-parse or a crawl queue export, as up to date,
+    # so the next run does not redo them and does run the stages after them
+    state = load_state(state_path)
+    for stage in build_stages(event_urls):
+        if stage.name not in stage_names:
+            continue
+        saved = state.get(stage.name)
+        code = stage.code_fingerprint()
+        if stage.rebuild_outputs and saved is not None and saved['code'] != code:
+            # Records of the older parser are still in the outputs; the next run rebuilds them
+            continue
+        state[stage.name] = _finished_state(stage, stage.key(stage.params()), code, 0.0)
+    save_state(state, state_path)
+
+
+def print_status(state_path=PIPELINE_STATE_FILE):
+    state = load_state(state_path)
+    for stage in build_stages():
+        if stage.name == 'scrape':
+            # Its key depends on the event urls of the next run
+            saved = state.get(stage.name)
+            print(f" {stage.name:<11} {'ran ' + saved['finished_at'] if saved else 'never run'}")
+            continue
+        _, reason = stage_status(stage, state)
+        print(f" {stage.name:<11} {reason or 'up to date'}")
+
+
+if __name__ == "__main__":
+    stage_names = [stage.name for stage in build_stages()]
+    parser = argparse.ArgumentParser(description='Run the stale stages from scraping to training')
+    parser.add_argument('--until', choices=stage_names, default=None, help='last stage to run')
+    parser.add_argument('--force', nargs='+', choices=stage_names, default=[], help='stages to run even if up to date')
+    parser.add_argument('--chunked', action='store_true', help='preprocess with prepare_ufc_data.py --chunked')
+    parser.add_argument('--status', action='store_true', help='show which stages would run')
+    args = parser.parse_args()
+
+    if args.status:
+        print_status()
+    else:
+        run_pipeline(until=args.until, force=args.force, chunked=args.chunked)
@@ -0,0 +1,289 @@
+import os
+from datetime import date
+
+import numpy as np
+
+from data_scraping import FIGHTERS_STATS_FILE
+from dataset_schema import DIFF_FIELDS, PROFILE_COLUMNS
+from feature_store import FEATURE_STORE_FILE, FeatureStore, ages_at
+from model_registry import MODELS_DIR, resolve_model
+from preprocessing import PREPROCESSOR_FILE, FightPreprocessor
+from record_store import iter_records
+from tree_export import TreeEnsemble
+
+
+# Answers "red fighter vs blue fighter" from the trained model. The model, the
+# fitted preprocessing and the latest profile of every fighter are loaded once.
+# The profiles are also kept as one numeric table, so the rows for a whole card
+# or every pairing in a division are gathered from it as one matrix and scored
+# with a single model call.
+
+def load_model(model_path):
+    # Returns (feature names, function from rows to P(red wins)). An exported
+    # .npz tree file is scored with NumPy alone; anything else needs xgboost,
+    # and only the legacy fight_model.pkl needs unpickling.
+    if model_path.endswith('.npz'):
+        ensemble = TreeEnsemble.load(model_path)
+        return ensemble.feature_names, ensemble.predict
+
+    import xgboost as xgb
+
+    if model_path.endswith('.pkl'):
+        import joblib
+        model = joblib.load(model_path)
+        booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    else:
+        try:
+            booster = xgb.Booster(model_file=model_path)
+        except xgb.core.XGBoostError as e:
+            # Callers handle a corrupt model file like any other unreadable one
+            raise ValueError(f"Cannot load the model in {model_path}: {e}") from e
+    # Single rows are scored fastest without handing them to a thread pool
+    booster.set_param({'nthread': 1})
+    # The layout is checked against the model once at load time, not on every call
+    return booster.feature_names, lambda rows: booster.inplace_predict(rows, validate_features=False)
+
+
+def normalize_name(name):
+    return ' '.join(name.split()).lower()
+
+
+def load_profiles(path=FIGHTERS_STATS_FILE, features_path=FEATURE_STORE_FILE):
+    # Latest profile per fighter name and per profile url, and the names shared
+    # by several profile urls. Later records win, so a refreshed profile replaces
+    # the one saved before it. A name shared by different fighters is left out
+    # of the names, so those fighters can only be looked up by url. The record
+    # and averages come from the feature store when there is one, computed the
+    # same way as for the fights the model was trained on; a fighter without
+    # fights in the store gets the debutant's (no wins, no losses, no rates),
+    # as in training. The age is the one today, from the date of birth.
+    store = FeatureStore.load(features_path) if features_path and os.path.exists(features_path) else None
+    today = date.today().isoformat()
+    by_name = {}
+    by_url = {}
+    name_urls = {}
+    for record in iter_records(path):
+        if store is not None and record.get('url'):
+            record.update(store.features(record['url']))
+        if record.get('dob'):
+            age = ages_at([record['dob']], [today])[0]
+            record['age'] = None if np.isnan(age) else int(age)
+        name = normalize_name(record['name'])
+        by_name[name] = record
+        if record.get('url'):
+            by_url[record['url']] = record
+            name_urls.setdefault(name, set()).add(record['url'])
+
+    ambiguous = {name for name, urls in name_urls.items() if len(urls) > 1}
+    for name in ambiguous:
+        del by_name[name]
+    return by_name, by_url, ambiguous
+
+
+def _difference(red, blue):
+    if red is None or blue is None:
+        return None
+    return red - blue
+
+
+class FightPredictor:
+    def __init__(self, model_path=None, preprocessor_path=None, fighters_path=FIGHTERS_STATS_FILE,
+                 features_path=FEATURE_STORE_FILE):
+        # Without a model path, the latest version in the model registry is served
+        if model_path is None:
+            model_path, registry_preprocessor_path = resolve_model()
+            preprocessor_path = preprocessor_path or registry_preprocessor_path
+        preprocessor_path = preprocessor_path or PREPROCESSOR_FILE
+        self.model_path = model_path
+
+        feature_names, self._score = load_model(model_path)
+        self.preprocessor = FightPreprocessor.load(preprocessor_path)
+
+        if feature_names is not None and list(feature_names) != self.preprocessor.columns:
+            raise ValueError(
+                f"{model_path} was trained on a different feature layout than {preprocessor_path}. "
+                "Run prepare_ufc_data.py and train.py again."
+            )
+
+        self.profiles, self.profiles_by_url, self.ambiguous_names = load_profiles(fighters_path, features_path)
+
+        # Difference columns the preprocessor uses that can be computed from two profiles
+        profile_columns = set(PROFILE_COLUMNS.values())
+        used_columns = set(self.preprocessor.numeric_columns)
+        self._diff_columns = [
+            column for column in DIFF_FIELDS
+            if column in profile_columns and f'{column}_difference' in used_columns
+        ]
+        self._build_profile_table()
+
+    @classmethod
+    def from_registry(cls, version=None, registry=MODELS_DIR, fighters_path=FIGHTERS_STATS_FILE):
+        model_path, preprocessor_path = resolve_model(version, registry)
+        return cls(model_path, preprocessor_path, fighters_path)
+
+    def _build_profile_table(self):
+        # One row per profile record. Numeric profile fields go in a float table
+        # (None becomes NaN); text fields become the output position of their
+        # red and blue dummy, or -1 when the value was never seen in training.
+        preprocessor = self.preprocessor
+        positions = preprocessor.positions
+        records = list({id(r): r for r in [*self.profiles.values(), *self.profiles_by_url.values()]}.values())
+        self._table_rows = {id(record): i for i, record in enumerate(records)}
+
+        numeric_fields = []
+        self._red_source, self._red_target = [], []
+        self._blue_source, self._blue_target = [], []
+        self._diff_source, self._diff_target = [], []
+        self._text_positions = []
+        for field, column in PROFILE_COLUMNS.items():
+            red_column, blue_column = f'red_{column}', f'blue_{column}'
+            if red_column in preprocessor.categories or blue_column in preprocessor.categories:
+                for side_column in (red_column, blue_column):
+                    side_positions = [preprocessor.category_position(side_column, r.get(field)) for r in records]
+                    self._text_positions.append(
+                        (side_column.startswith('red_'),
+                         np.array([-1 if p is None else p for p in side_positions], dtype=np.int64))
+                    )
+                continue
+
+            k = len(numeric_fields)
+            numeric_fields.append(field)
+            if red_column in positions:
+                self._red_source.append(k)
+                self._red_target.append(positions[red_column])
+            if blue_column in positions:
+                self._blue_source.append(k)
+                self._blue_target.append(positions[blue_column])
+            if column in self._diff_columns:
+                self._diff_source.append(k)
+                self._diff_target.append(positions[f'{column}_difference'])
+
+        self._table = np.array(
+            [[record.get(field) for field in numeric_fields] for record in records], dtype=float
+        ).reshape(len(records), len(numeric_fields))
+
+    def _table_row(self, fighter):
+        return self._table_rows[id(self.profile(fighter))]
+
+    def profile(self, fighter):
+        # fighter is a name (any case) or a ufcstats.com profile url
+        profile = self.profiles_by_url.get(fighter) or self.profiles.get(normalize_name(fighter))
+        if profile is None and normalize_name(fighter) in self.ambiguous_names:
+            raise KeyError(f"Several fighters are called {fighter!r}; use their profile url")
+        if profile is None:
+            raise KeyError(f"No profile for fighter {fighter!r}")
+        return profile
+
+    def matchup_record(self, red, blue, **fight):
+        # A dataset row for the matchup. Anything only known after the fight is
+        # left out and imputed; fight can set known fields such as weight_class,
+        # gender, is_title_bout or total_rounds.
+        return self._matchup_record(self.profile(red), self.profile(blue), fight)
+
+    def _matchup_record(self, red_profile, blue_profile, fight):
+        record = dict(fight)
+        for field, column in PROFILE_COLUMNS.items():
+            record[f'red_{column}'] = red_profile.get(field)
+            record[f'blue_{column}'] = blue_profile.get(field)
+        for column in self._diff_columns:
+            record[f'{column}_difference'] = _difference(record[f'red_{column}'], record[f'blue_{column}'])
+        return record
+
+    def predict_rows(self, rows):
+        # Probability that red wins, for rows already in the training layout
+        return self._score(np.asarray(rows, dtype=float))
+
+    def predict_records(self, records):
+        return self.predict_rows(self.preprocessor.transform_records(records))
+
+    def _set_fight_fields(self, out, fight, rows=slice(None)):
+        # Fight level fields such as weight_class, gender, is_title_bout or total_rounds
+        for name, value in fight.items():
+            if name in self.preprocessor.categories:
+                position = self.preprocessor.category_position(name, value)
+                if position is not None:
+                    out[rows, position] = 1.0
+            elif name in self.preprocessor.positions:
+                out[rows, self.preprocessor.positions[name]] = value
+
+    def _pair_rows(self, red_rows, blue_rows):
+        # Raw model rows for fighter table rows red_rows[i] vs blue_rows[i]: both
+        # profiles, their differences (as calculate_diff computes them) and the
+        # stance dummies. Everything only known after the fight stays missing.
+        red_rows = np.asarray(red_rows, dtype=np.int64)
+        blue_rows = np.asarray(blue_rows, dtype=np.int64)
+        out = self.preprocessor.empty_rows(len(red_rows))
+
+        red = self._table[red_rows]
+        blue = self._table[blue_rows]
+        out[:, self._red_target] = red[:, self._red_source]
+        out[:, self._blue_target] = blue[:, self._blue_source]
+        out[:, self._diff_target] = red[:, self._diff_source] - blue[:, self._diff_source]
+
+        all_rows = np.arange(len(red_rows))
+        for is_red, positions in self._text_positions:
+            side_positions = positions[red_rows if is_red else blue_rows]
+            known = side_positions >= 0
+            out[all_rows[known], side_positions[known]] = 1.0
+        return out
+
+    def pair_matrix(self, pairs, **fight):
+        # Model input rows for a list of (red, blue) fighters
+        out = self._pair_rows([self._table_row(red) for red, _ in pairs], [self._table_row(blue) for _, blue in pairs])
+        self._set_fight_fields(out, fight)
+        return self.preprocessor.finish(out)
+
+    def predict_pairs(self, pairs, **fight):
+        # Probability that red wins each of the (red, blue) fights, all scored in one call
+        if not pairs:
+            return np.zeros(0)
+        return self.predict_rows(self.pair_matrix(pairs, **fight))
+
+    def score_card(self, fights):
+        # fights: dicts with red, blue and optionally the fight fields of that bout
+        if not fights:
+            return []
+        out = self._pair_rows([self._table_row(fight['red']) for fight in fights],
+                              [self._table_row(fight['blue']) for fight in fights])
+        for i, fight in enumerate(fights):
+            self._set_fight_fields(out, {k: v for k, v in fight.items() if k not in ('red', 'blue')}, i)
+        probabilities = self.predict_rows(self.preprocessor.finish(out))
+        return [
+            self._result(self.profile(fight['red']), self.profile(fight['blue']), float(p))
+            for fight, p in zip(fights, probabilities)
+        ]
+
+    def matchup_rows(self, fighters, **fight):
+        # Model rows for every ordered pairing of fighters, row i * len(fighters) + j being i vs j
+        table_rows = np.array([self._table_row(fighter) for fighter in fighters], dtype=np.int64)
+        count = len(table_rows)
+        out = self._pair_rows(np.repeat(table_rows, count), np.tile(table_rows, count))
+        self._set_fight_fields(out, fight)
+        return self.preprocessor.finish(out)
+
+    def matchup_matrix(self, fighters, **fight):
+        # Dense matrix of the probability that fighters[i] (red) beats fighters[j] (blue).
+        # The diagonal is NaN.
+        count = len(fighters)
+        if count == 0:
+            return np.zeros((0, 0))
+        matrix = self.predict_rows(self.matchup_rows(fighters, **fight)).reshape(count, count)
+        np.fill_diagonal(matrix, np.nan)
+        return matrix
+
+    def _result(self, red_profile, blue_profile, red_probability):
+        return {
+            'red': red_profile['name'],
+            'blue': blue_profile['name'],
+            'red_win_probability': red_probability,
+            'blue_win_probability': 1.0 - red_probability,
+            'predicted_winner': red_profile['name'] if red_probability >= 0.5 else blue_profile['name'],
+        }
+
+    def predict(self, red, blue, **fight):
+        red_profile = self.profile(red)
+        blue_profile = self.profile(blue)
+        out = self._pair_rows([self._table_rows[id(red_profile)]], [self._table_rows[id(blue_profile)]])
+        self._set_fight_fields(out, fight)
+        red_probability = float(self.predict_rows(self.preprocessor.finish(out))[0])
+        return self._result(red_profile, blue_profile, red_probability)
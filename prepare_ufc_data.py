@@ -1,60 +1,97 @@
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
-from sklearn.impute import SimpleImputer
-
-# Load your dataset
-df = pd.read_csv('completed_events_large.csv')
-
-# Make a copy to work on
-df_cleaned = df.copy()
-
-# Encode the winner column
-df_cleaned['winner_encoded'] = df_cleaned['winner'].map({'Red': 1, 'Blue': 0})
-
-# Drop unnecessary and post-fight columns
-columns_to_drop = [
-    'event_name', 'referee_name', 'method',
-    'red_fighter_name', 'blue_fighter_name',  # Keep in reference set only
-    'winner',
-    'fight_total_strikes_landed', 'fight_total_strikes_attempted',
-    'fight_significant_strikes_landed', 'fight_significant_strikes_attempted',
-    'fight_takedowns_landed', 'fight_takedowns_attempted',
-    'fight_control_time_seconds', 'fight_knockdowns',
-    'fight_submission_attempts', 'fight_reversals',
-    'red_fight_total_strikes_landed', 'blue_fight_total_strikes_landed',
-    'red_fight_significant_strikes_landed', 'blue_fight_significant_strikes_landed',
-    'red_fight_takedowns_landed', 'blue_fight_takedowns_landed',
-    'red_fight_control_time_seconds', 'blue_fight_control_time_seconds'
-]
-df_cleaned.drop(columns=columns_to_drop, inplace=True, errors='ignore')
-
-# Fill missing categorical values with 'Unknown'
-df_cleaned['red_stance'].fillna('Unknown', inplace=True)
-df_cleaned['blue_stance'].fillna('Unknown', inplace=True)
-
-# Get numeric columns (excluding target)
-numeric_cols = df_cleaned.select_dtypes(include=['float64', 'int64']).columns.tolist()
-numeric_cols.remove('winner_encoded')
-
-# Impute missing values in numeric columns with median
-imputer = SimpleImputer(strategy='median')
-df_cleaned[numeric_cols] = imputer.fit_transform(df_cleaned[numeric_cols])
-
-# Normalize numeric features
-scaler = StandardScaler()
-df_cleaned[numeric_cols] = scaler.fit_transform(df_cleaned[numeric_cols])
-
-# One-hot encode categorical stance columns
-df_cleaned = pd.get_dummies(df_cleaned, columns=['red_stance', 'blue_stance'], prefix=['red_stance', 'blue_stance'])
-
-# Save final training dataset (only rows with known winner)
-train_data = df_cleaned.dropna(subset=['winner_encoded'])
-train_data.to_csv('ufc_preprocessed_train_data.csv', index=False)
-
-# Save reference file with fighter names and labels
-reference_data = df[['red_fighter_name', 'blue_fighter_name', 'winner']].copy()
-reference_data['winner_encoded'] = train_data['winner_encoded'].values
-reference_data.to_csv('ufc_reference_data.csv', index=False)
-
-print("✅ Preprocessing complete.")
-print("Saved: ufc_preprocessed_train_data.csv and ufc_reference_data.csv")
+import argparse
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dataset_schema import COMPRESSION, DATASET_FILE, dataset_columns, iter_dataset, read_dataset
+from preprocessing import (
+    DROP_COLUMNS, REFERENCE_COLUMNS, PREPROCESSOR_FILE, TARGET_COLUMN, TRAIN_DATA_FILE, FightPreprocessor, encode_winner
+)
+
+REFERENCE_FILE = 'ufc_reference_data.csv'
+
+# Rows encoded at a time by --chunked
+CHUNK_ROWS = 20000
+
+
+def prepare():
+    # Load only the columns that are used, with the types stored in the dataset
+    used_cols = [col for col in dataset_columns(DATASET_FILE) if col not in DROP_COLUMNS or col in REFERENCE_COLUMNS]
+    df = read_dataset(DATASET_FILE, columns=used_cols)
+
+    # Encode the winner column
+    df[TARGET_COLUMN] = encode_winner(df['winner'])
+
+    # Fit the median imputation, scaling, one-hot categories and engineered features,
+    # and keep them next to the model so new matchups are encoded the same way
+    preprocessor = FightPreprocessor.fit(df)
+    preprocessor.save(PREPROCESSOR_FILE)
+
+    # Save final training dataset (only rows with known winner)
+    known_winner = df[TARGET_COLUMN].notna()
+    train_data = preprocessor.transform(df[known_winner])
+    train_data[TARGET_COLUMN] = df.loc[known_winner, TARGET_COLUMN].values
+    train_data.to_parquet(TRAIN_DATA_FILE, index=False, compression='zstd')
+
+    # Save reference file with fighter names and labels, row for row with the training data
+    reference_data = df.loc[known_winner, REFERENCE_COLUMNS].copy()
+    reference_data[TARGET_COLUMN] = train_data[TARGET_COLUMN].values
+    reference_data.to_csv(REFERENCE_FILE, index=False)
+
+
+def prepare_chunked(chunk_rows=CHUNK_ROWS):
+    # Same output as prepare(), without ever loading the whole dataset: the
+    # statistics are fitted from chunk_rows rows at a time, then the rows are
+    # encoded chunk_rows at a time and appended to the training file. Text
+    # columns are read as categoricals.
+    preprocessor = FightPreprocessor.fit_dataset(DATASET_FILE, chunk_rows)
+    preprocessor.save(PREPROCESSOR_FILE)
+
+    used_cols = preprocessor.numeric_columns + list(preprocessor.categories) + REFERENCE_COLUMNS
+
+    # prepare() keeps the pandas types: float64 features, and a label that is
+    # only float64 when some winner in the dataset is unknown
+    unknown_winner = any(encode_winner(chunk['winner']).isna().any()
+                         for chunk in iter_dataset(DATASET_FILE, ['winner'], chunk_rows))
+    target_type = pa.float64() if unknown_winner else pa.int64()
+    schema = pa.schema([(column, pa.float64()) for column in preprocessor.columns] + [(TARGET_COLUMN, target_type)])
+
+    tmp_path = TRAIN_DATA_FILE + '.tmp'
+    rows = 0
+    with pq.ParquetWriter(tmp_path, schema, compression=COMPRESSION) as writer, \
+            open(REFERENCE_FILE, 'w', newline='') as reference_file:
+        for i, chunk in enumerate(iter_dataset(DATASET_FILE, used_cols, chunk_rows, list(preprocessor.categories))):
+            target = encode_winner(chunk['winner'])
+            known_winner = target.notna().to_numpy()
+            chunk = chunk[known_winner]
+            target = target[known_winner].to_numpy(dtype=target_type.to_pandas_dtype())
+
+            x = preprocessor.transform_array(chunk)
+            arrays = [pa.array(x[:, j]) for j in range(x.shape[1])] + [pa.array(target)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+            reference_data = chunk[REFERENCE_COLUMNS].copy()
+            reference_data[TARGET_COLUMN] = target
+            reference_data.to_csv(reference_file, index=False, header=i == 0)
+            rows += len(chunk)
+
+    os.replace(tmp_path, TRAIN_DATA_FILE)
+    print(f" Encoded {rows} rows in chunks of {chunk_rows}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Encode the dataset into training rows')
+    parser.add_argument('--chunked', action='store_true',
+                        help='stream the dataset in chunks instead of loading it whole, for datasets too big for memory')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    if args.chunked:
+        prepare_chunked(args.chunk_rows)
+    else:
+        prepare()
+
+    print("✅ Preprocessing complete.")
+    print(f"Saved: {TRAIN_DATA_FILE}, {REFERENCE_FILE} and {PREPROCESSOR_FILE}")
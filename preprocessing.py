@@ -0,0 +1,373 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset_schema import DATASET_FILE, dataset_columns, iter_dataset, numeric_columns, read_dataset
+
+
+# The fitted preprocessing is kept next to fight_model.pkl, so a new matchup can
+# be turned into a model input row without reading the dataset again
+PREPROCESSOR_FILE = 'fight_preprocessor.json'
+
+# Encoded training rows written by prepare_ufc_data.py
+TRAIN_DATA_FILE = 'ufc_preprocessed_train_data.parquet'
+
+TARGET_COLUMN = 'winner_encoded'
+
+# Dataset rows read at a time by FightPreprocessor.fit_dataset
+FIT_BATCH_ROWS = 65536
+
+# A median is narrowed down to one of MEDIAN_BINS bins per pass over the
+# dataset, until at most MEDIAN_COLLECT values of the column are left to sort
+MEDIAN_BINS = 1024
+MEDIAN_COLLECT = 1 << 16
+
+# Columns that identify a fight
+FIGHT_KEY_COLUMNS = ['event_name', 'red_fighter_name', 'blue_fighter_name']
+
+# Unnecessary and post-fight columns
+DROP_COLUMNS = [
+    'event_name', 'referee_name', 'method',
+    'red_fighter_name', 'blue_fighter_name',  # Keep in reference set only
+    'winner',
+    'fight_total_strikes_landed', 'fight_total_strikes_attempted',
+    'fight_significant_strikes_landed', 'fight_significant_strikes_attempted',
+    'fight_takedowns_landed', 'fight_takedowns_attempted',
+    'fight_control_time_seconds', 'fight_knockdowns',
+    'fight_submission_attempts', 'fight_reversals',
+    'red_fight_total_strikes_landed', 'blue_fight_total_strikes_landed',
+    'red_fight_significant_strikes_landed', 'blue_fight_significant_strikes_landed',
+    'red_fight_takedowns_landed', 'blue_fight_takedowns_landed',
+    'red_fight_control_time_seconds', 'blue_fight_control_time_seconds'
+]
+REFERENCE_COLUMNS = ['red_fighter_name', 'blue_fighter_name', 'winner']
+
+# Missing values of these columns get a category of their own. They are also
+# encoded first, ahead of the other text columns.
+FILL_VALUES = {'red_stance': 'Unknown', 'blue_stance': 'Unknown'}
+
+# Matchup features added after scaling: (name, red column, blue column)
+ENGINEERED_FEATURES = [
+    ('reach_advantage', 'red_reach_cm', 'blue_reach_cm'),
+    ('strike_accuracy_diff', 'red_significant_strike_accuracy', 'blue_significant_strike_accuracy'),
+    ('takedown_accuracy_diff', 'red_takedown_accuracy', 'blue_takedown_accuracy'),
+    ('defense_diff', 'red_significant_strike_defense', 'blue_significant_strike_defense'),
+]
+
+
+def encode_winner(winner):
+    return winner.map({'Red': 1, 'Blue': 0})
+
+
+def fight_keys(df):
+    # "event|red fighter|blue fighter" of every row
+    key_columns = [df[column].fillna('').astype(str) for column in FIGHT_KEY_COLUMNS]
+    return (key_columns[0] + '|' + key_columns[1] + '|' + key_columns[2]).tolist()
+
+
+def load_fight_keys(dataset_path=DATASET_FILE):
+    # Key of every training row, in the order prepare_ufc_data.py writes the rows
+    df = read_dataset(dataset_path, columns=FIGHT_KEY_COLUMNS + ['winner'])
+    return fight_keys(df[encode_winner(df['winner']).notna()])
+
+
+def load_training_data(path=TRAIN_DATA_FILE, preprocessor_path=PREPROCESSOR_FILE):
+    # (features, target) of the encoded training rows. The rows already hold the
+    # one-hot text columns and the engineered matchup features, in the layout of
+    # the saved preprocessor.
+    preprocessor = FightPreprocessor.load(preprocessor_path)
+    df = pd.read_parquet(path, columns=preprocessor.columns + [TARGET_COLUMN])
+    return df[preprocessor.columns], df[TARGET_COLUMN]
+
+
+def _merge_moments(count, mean, m2, other_count, other_mean, other_m2):
+    # Count, mean and sum of squared deviations of two groups of values together,
+    # per column (Chan et al.). Columns where the other group is empty are kept.
+    total = count + other_count
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = other_mean - mean
+        merged_mean = mean + delta * (other_count / total)
+        merged_m2 = m2 + other_m2 + delta ** 2 * (count * other_count / total)
+    has_other = other_count > 0
+    return total, np.where(has_other, merged_mean, mean), np.where(has_other, merged_m2, m2)
+
+
+def _medians(path, columns, count, low, high, batch_rows):
+    # Exact median of every column without holding a whole column. The middle
+    # value(s) of a column are looked for in a range (lo, hi], at first its
+    # whole range. Every pass over the dataset counts the values in MEDIAN_BINS
+    # bins of that range and narrows it to the bin the value is in, until the
+    # range holds at most MEDIAN_COLLECT values, which the next pass collects
+    # and sorts. A column whose range holds a single repeated value is done.
+    medians = np.zeros(len(columns))
+    targets = []
+    for j in range(len(columns)):
+        if count[j]:
+            for rank in sorted({int(count[j] - 1) // 2, int(count[j]) // 2}):
+                targets.append({'key': (j, rank), 'column': j, 'rank': rank,
+                                'lo': np.nextafter(low[j], -np.inf), 'hi': high[j], 'size': int(count[j])})
+    found = {}
+
+    while targets:
+        for target in targets:
+            target['edges'] = np.linspace(target['lo'], target['hi'], MEDIAN_BINS + 1)
+            target['counts'] = np.zeros(MEDIAN_BINS, dtype=np.int64)
+            target['parts'] = []
+            target['min'], target['max'] = np.inf, -np.inf
+
+        pass_columns = sorted({target['column'] for target in targets})
+        names = [columns[j] for j in pass_columns]
+        for batch in iter_dataset(path, names, batch_rows):
+            values = {j: batch[columns[j]].to_numpy(dtype=float) for j in pass_columns}
+            for target in targets:
+                column_values = values[target['column']]
+                selected = column_values[(column_values > target['lo']) & (column_values <= target['hi'])]
+                if not len(selected):
+                    continue
+                if target['size'] <= MEDIAN_COLLECT:
+                    target['parts'].append(selected)
+                else:
+                    bins = np.searchsorted(target['edges'], selected, side='left') - 1
+                    target['counts'] += np.bincount(bins, minlength=MEDIAN_BINS)
+                    target['min'] = min(target['min'], selected.min())
+                    target['max'] = max(target['max'], selected.max())
+
+        remaining = []
+        for target in targets:
+            if target['size'] <= MEDIAN_COLLECT:
+                found[target['key']] = np.sort(np.concatenate(target['parts']))[target['rank']]
+            elif target['min'] == target['max']:
+                found[target['key']] = target['min']
+            else:
+                cumulative = np.cumsum(target['counts'])
+                b = int(np.searchsorted(cumulative, target['rank'], side='right'))
+                below = int(cumulative[b - 1]) if b else 0
+                remaining.append({'key': target['key'], 'column': target['column'], 'rank': target['rank'] - below,
+                                  'lo': target['edges'][b], 'hi': target['edges'][b + 1],
+                                  'size': int(target['counts'][b])})
+        targets = remaining
+
+    for j in range(len(columns)):
+        if count[j]:
+            middle = [found[(j, rank)] for rank in sorted({int(count[j] - 1) // 2, int(count[j]) // 2})]
+            medians[j] = middle[0] if len(middle) == 1 else (middle[0] + middle[1]) / 2
+    return medians
+
+
+class FightPreprocessor:
+    # Median imputation and standard scaling of the numeric columns, one-hot
+    # encoding of the text columns and the engineered matchup features. The
+    # output columns are: numeric columns in dataset order, then the dummies of
+    # every text column (categories sorted, as pd.get_dummies does), then the
+    # engineered features.
+
+    def __init__(self, numeric_columns, medians, means, scales, categories, fill_values=None,
+                 engineered=ENGINEERED_FEATURES):
+        self.numeric_columns = list(numeric_columns)
+        self.medians = np.asarray(medians, dtype=float)
+        self.means = np.asarray(means, dtype=float)
+        self.scales = np.asarray(scales, dtype=float)
+        self.categories = {column: list(values) for column, values in categories.items()}
+        self.fill_values = dict(FILL_VALUES if fill_values is None else fill_values)
+        self.engineered = [tuple(feature) for feature in engineered]
+
+        # Output position of every category value and of both sides of every engineered feature
+        self.columns = list(self.numeric_columns)
+        self._category_positions = {}
+        for column, values in self.categories.items():
+            self._category_positions[column] = {value: len(self.columns) + i for i, value in enumerate(values)}
+            self.columns += [f'{column}_{value}' for value in values]
+
+        positions = {column: i for i, column in enumerate(self.columns)}
+        self._engineered_positions = [
+            (len(self.columns) + i, positions[red], positions[blue])
+            for i, (_, red, blue) in enumerate(self.engineered)
+        ]
+        self.columns += [name for name, _, _ in self.engineered]
+        self.positions = {column: i for i, column in enumerate(self.columns)}
+
+    @classmethod
+    def fit(cls, df):
+        features = df.drop(columns=DROP_COLUMNS + [TARGET_COLUMN], errors='ignore')
+        numeric_columns = features.select_dtypes(include='number').columns.tolist()
+        text_columns = [column for column in features.columns if column not in numeric_columns]
+        text_columns = (
+            [column for column in FILL_VALUES if column in text_columns]
+            + [column for column in text_columns if column not in FILL_VALUES]
+        )
+
+        values = features[numeric_columns].to_numpy(dtype=float)
+        medians = np.nanmedian(values, axis=0) if len(values) else np.zeros(len(numeric_columns))
+        medians = np.where(np.isnan(medians), 0.0, medians)
+        imputed = np.where(np.isnan(values), medians, values)
+        means = imputed.mean(axis=0)
+        scales = imputed.std(axis=0)
+        # Constant columns are only centred, like StandardScaler does
+        scales[scales < 10 * np.finfo(float).eps] = 1.0
+
+        categories = {}
+        for column in text_columns:
+            series = features[column]
+            if column in FILL_VALUES:
+                series = series.fillna(FILL_VALUES[column])
+            categories[column] = sorted(series.dropna().unique().tolist())
+
+        return cls(numeric_columns, medians, means, scales, categories)
+
+    @classmethod
+    def fit_dataset(cls, path=DATASET_FILE, batch_rows=FIT_BATCH_ROWS):
+        # The same fit as fit(read_dataset(path)), from batches of batch_rows
+        # rows. The first pass keeps running counts, means and squared deviations
+        # of every numeric column and the categories seen in each batch; the
+        # medians take a few more passes (see _medians). Means and scales can
+        # differ from fit() in the last bits, from the order of the sums.
+        numeric = set(numeric_columns(path))
+        features = [column for column in dataset_columns(path) if column not in DROP_COLUMNS + [TARGET_COLUMN]]
+        numeric_features = [column for column in features if column in numeric]
+        text_columns = [column for column in features if column not in numeric]
+        text_columns = (
+            [column for column in FILL_VALUES if column in text_columns]
+            + [column for column in text_columns if column not in FILL_VALUES]
+        )
+
+        rows = 0
+        count, mean, m2 = (np.zeros(len(numeric_features)) for _ in range(3))
+        low, high = np.full(len(numeric_features), np.inf), np.full(len(numeric_features), -np.inf)
+        categories = {column: set() for column in text_columns}
+        for batch in iter_dataset(path, features, batch_rows):
+            rows += len(batch)
+            values = batch[numeric_features].to_numpy(dtype=float)
+            present = ~np.isnan(values)
+            batch_count = present.sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                batch_mean = np.where(present, values, 0.0).sum(axis=0) / batch_count
+            batch_m2 = (np.where(present, values - batch_mean, 0.0) ** 2).sum(axis=0)
+            count, mean, m2 = _merge_moments(count, mean, m2, batch_count, batch_mean, batch_m2)
+            low = np.minimum(low, np.where(present, values, np.inf).min(axis=0, initial=np.inf))
+            high = np.maximum(high, np.where(present, values, -np.inf).max(axis=0, initial=-np.inf))
+
+            for column in text_columns:
+                series = batch[column]
+                if column in FILL_VALUES:
+                    series = series.fillna(FILL_VALUES[column])
+                categories[column].update(series.dropna().unique().tolist())
+
+        medians = _medians(path, numeric_features, count, low, high, batch_rows)
+
+        # Missing values are imputed with the median, so they join the moments
+        # as a group of values that all equal it
+        missing = rows - count
+        count, mean, m2 = _merge_moments(count, mean, m2, missing, medians, np.zeros(len(numeric_features)))
+        means = mean if rows else np.full(len(numeric_features), np.nan)
+        scales = np.sqrt(m2 / rows) if rows else np.full(len(numeric_features), np.nan)
+        scales[scales < 10 * np.finfo(float).eps] = 1.0
+
+        categories = {column: sorted(values) for column, values in categories.items()}
+        return cls(numeric_features, medians, means, scales, categories)
+
+    def empty_rows(self, count):
+        # Rows to fill with raw values and dummies before finish(): every numeric value missing, no dummy set
+        out = np.zeros((count, len(self.columns)))
+        out[:, :len(self.numeric_columns)] = np.nan
+        return out
+
+    def category_position(self, column, value):
+        # Output position of the dummy for column == value, None for an unseen value
+        positions = self._category_positions.get(column)
+        if positions is None:
+            return None
+        if value is None or value != value or value == '':
+            value = self.fill_values.get(column)
+        return positions.get(value)
+
+    def finish(self, out):
+        # Impute and scale the numeric block in place, then add the engineered features
+        numeric = out[:, :len(self.numeric_columns)]
+        np.copyto(numeric, self.medians, where=np.isnan(numeric))
+        numeric -= self.means
+        numeric /= self.scales
+        for position, red, blue in self._engineered_positions:
+            out[:, position] = out[:, red] - out[:, blue]
+        return out
+
+    def transform_array(self, df):
+        # A DataFrame of dataset rows -> float array in the training layout
+        out = np.zeros((len(df), len(self.columns)))
+        out[:, :len(self.numeric_columns)] = df.reindex(columns=self.numeric_columns).to_numpy(dtype=float)
+
+        for column, positions in self._category_positions.items():
+            if column not in df.columns:
+                continue
+            series = df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # Look every category up once; code -1 (missing) takes the last entry
+                missing = positions.get(self.fill_values.get(column), np.nan)
+                lookup = np.array([positions.get(value, np.nan) for value in series.cat.categories] + [missing],
+                                  dtype=float)
+                codes = lookup[series.cat.codes.to_numpy()]
+            else:
+                if column in self.fill_values:
+                    series = series.fillna(self.fill_values[column])
+                codes = series.map(positions).to_numpy(dtype=float)
+            rows = np.flatnonzero(~np.isnan(codes))
+            out[rows, codes[rows].astype(int)] = 1.0
+
+        return self.finish(out)
+
+    def transform(self, df):
+        return pd.DataFrame(self.transform_array(df), columns=self.columns, index=df.index)
+
+    def transform_records(self, records):
+        # dicts of dataset columns -> float array in the training layout. Missing
+        # numeric values are imputed and unseen categories get no dummy.
+        out = np.zeros((len(records), len(self.columns)))
+        numeric_columns = self.numeric_columns
+        category_positions = self._category_positions.items()
+        fill_values = self.fill_values
+
+        for i, record in enumerate(records):
+            get = record.get
+            # None becomes NaN in a float array
+            out[i, :len(numeric_columns)] = np.array([get(column) for column in numeric_columns], dtype=float)
+            for column, positions in category_positions:
+                value = get(column)
+                if value is None or value != value or value == '':
+                    value = fill_values.get(column)
+                position = positions.get(value)
+                if position is not None:
+                    out[i, position] = 1.0
+
+        return self.finish(out)
+
+    def transform_one(self, record):
+        return self.transform_records([record])[0]
+
+    def to_dict(self):
+        return {
+            'numeric_columns': self.numeric_columns,
+            'medians': self.medians.tolist(),
+            'means': self.means.tolist(),
+            'scales': self.scales.tolist(),
+            'categories': self.categories,
+            'fill_values': self.fill_values,
+            'engineered': [list(feature) for feature in self.engineered],
+            'columns': self.columns,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state['numeric_columns'], state['medians'], state['means'], state['scales'],
+                   state['categories'], state['fill_values'], state['engineered'])
+
+    def save(self, path=PREPROCESSOR_FILE):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=PREPROCESSOR_FILE):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
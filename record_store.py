@@ -0,0 +1,144 @@
+import json
+import os
+import time
+
+from metrics import METRICS
+
+
+# Records are stored one JSON object per line. Appending a line never touches
+# what is already on disk, so a crash can at worst leave one incomplete line at
+# the end of the file, which readers skip and writers cut off before appending.
+
+
+def _truncate_partial_line(path):
+    # Drop a trailing line that was cut off in the middle of a write
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+
+        # Walk back to the last newline and cut everything after it
+        position = size
+        while position > 0:
+            step = min(64 * 1024, position)
+            position -= step
+            f.seek(position)
+            chunk = f.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                f.truncate(position + newline + 1)
+                return
+        f.truncate(0)
+
+
+class RecordWriter:
+    def __init__(self, path, fsync_every=100, fsync_interval=5.0):
+        if os.path.exists(path):
+            _truncate_partial_line(path)
+
+        self.path = path
+        self.name = os.path.basename(path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.count = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self.count += 1
+        METRICS.inc('records_written_total', file=self.name)
+        self._unsynced += 1
+
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_records(path):
+    # Yield every complete record in the file, skipping a trailing partial line
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            yield json.loads(line)
+
+
+def index_records(path, key):
+    # Map record[key] -> byte offset of its line. Later records win, so a
+    # record can be refreshed by appending a new line with the same key.
+    offsets = {}
+    if not os.path.exists(path):
+        return offsets
+
+    with open(path, 'rb') as f:
+        offset = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offsets[json.loads(line)[key]] = offset
+            offset += len(line)
+
+    return offsets
+
+
+def iter_records_by_key(path, keys, offsets=None, key=None):
+    # Lazily yield the records for keys, in the order given, reading each one
+    # straight from its offset. Keys without a record are skipped.
+    if not os.path.exists(path):
+        return
+
+    if offsets is None:
+        offsets = index_records(path, key)
+
+    with open(path, 'rb') as f:
+        for k in keys:
+            offset = offsets.get(k)
+            if offset is None:
+                continue
+            f.seek(offset)
+            yield json.loads(f.readline())
+
+
+def load_records_by_key(path, key):
+    # Load the latest record for every key into a dict
+    return {record[key]: record for record in iter_records(path)}
+
+
+def rewrite_records(path, records):
+    # Replace the whole file with records. They are written next to it first and
+    # swapped in at the end, so readers never see a half-written file.
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    with RecordWriter(tmp_path, fsync_every=1000) as writer:
+        for record in records:
+            writer.write(record)
+
+    os.replace(tmp_path, path)
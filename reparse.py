@@ -0,0 +1,160 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from tqdm import tqdm
+
+import data_scraping
+from data_scraping import (
+    FIGHT_DATA_FILE, FIGHTERS_STATS_FILE,
+    load_crawl_manifest, save_crawl_manifest,
+    parse_events_listing, parse_event_page, parse_event_date, parse_fight_page, parse_fighter_links, parse_fighter_page,
+    finish_large_dataset, write_url_file
+)
+from fetcher import DEFAULT_ARCHIVE
+from metrics import METRICS, log
+from page_archive import PageArchive
+from record_store import rewrite_records
+
+
+# Rebuild every record file and the dataset from the page archive, without any
+# network access. Pages are parsed in a process pool, a chunk of urls at a time.
+
+EVENTS_LISTING_URL = "http://ufcstats.com/statistics/events/completed?page=all"
+DEFAULT_CHUNK_SIZE = 64
+
+# Opened once in every worker process
+_archive = None
+
+
+def _init_worker(archive_path):
+    global _archive
+    _archive = PageArchive(archive_path, readonly=True)
+
+
+class ParseFailure:
+    # Result of a page that is in the archive but could not be parsed
+    def __init__(self, error):
+        self.error = error
+
+
+def _parse_event(event_url, html):
+    return parse_event_page(html), parse_event_date(html)
+
+
+def _parse_fight(fight_url, html):
+    fight = parse_fight_page(html)
+    fight['fight_url'] = fight_url
+    return parse_fighter_links(html), fight
+
+
+def _parse_fighter(fighter_url, html):
+    fighter = parse_fighter_page(html)
+    fighter['url'] = fighter_url
+    return fighter
+
+
+def _parse_chunk(parse, urls):
+    # None for a page missing from the archive. A page that fails to parse is
+    # reported instead of ending the whole rebuild.
+    results = []
+    for url in urls:
+        html = _archive.get(url)
+        if html is None:
+            results.append(None)
+            continue
+        try:
+            results.append(parse(url, html))
+        except Exception as e:
+            results.append(ParseFailure(e))
+    return results
+
+
+def _parse_all(executor, parse, urls, chunk_size, desc):
+    # Results come back in the same order as urls, None for every page that is
+    # missing or failed to parse. Also returns whether every page was parsed.
+    chunks = [urls[i:i + chunk_size] for i in range(0, len(urls), chunk_size)]
+    results = []
+    with tqdm(total=len(urls), desc=desc) as progress:
+        for chunk_results in executor.map(partial(_parse_chunk, parse), chunks):
+            results.extend(chunk_results)
+            progress.update(len(chunk_results))
+
+    missing = sum(result is None for result in results)
+    if missing:
+        print(f" {missing} of {len(urls)} pages are not in the archive and were skipped.")
+
+    failed = 0
+    for i, (url, result) in enumerate(zip(urls, results)):
+        if isinstance(result, ParseFailure):
+            # Counted like a parse failure in fetch_pages
+            METRICS.inc('parse_failures_total', stage=desc, error=type(result.error).__name__)
+            log(f" Failed to parse {url}: {result.error!r}")
+            results[i] = None
+            failed += 1
+    if failed:
+        print(f" {failed} of {len(urls)} pages failed to parse and were skipped.")
+    return results, missing + failed == 0
+
+
+def _read_event_urls(archive_path):
+    with PageArchive(archive_path, readonly=True) as archive:
+        html = archive.get(EVENTS_LISTING_URL)
+    if html is not None:
+        return parse_events_listing(html)
+
+    # Fall back to the events saved by the last crawl
+    return data_scraping.read_url_file('event_urls.txt')
+
+
+def reparse(archive_path=DEFAULT_ARCHIVE, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    event_urls = _read_event_urls(archive_path)
+    print(f" Re-parsing {len(event_urls)} events from {archive_path}.pack")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(archive_path,)) as executor:
+        # === FIGHT URLS ===
+        events, events_complete = _parse_all(executor, _parse_event, event_urls, chunk_size, "Parsing Events")
+        fight_urls = [url for event in events if event for url in event[0]]
+
+        # === FIGHT DATA AND FIGHTER URLS ===
+        fight_pages, fights_complete = _parse_all(executor, _parse_fight, fight_urls, chunk_size, "Parsing Fights")
+
+        # fighter_urls.txt holds the red and blue fighter of every fight in
+        # fight_urls.txt, so fights without a parsed page leave both lists
+        fight_urls = [url for url, page in zip(fight_urls, fight_pages) if page is not None]
+        fight_pages = [page for page in fight_pages if page is not None]
+        fighter_urls = [url for page in fight_pages for url in page[0]]
+
+        # === FIGHTER STATS ===
+        unique_fighter_urls = list(dict.fromkeys(fighter_urls))
+        fighter_pages, _ = _parse_all(executor, _parse_fighter, unique_fighter_urls, chunk_size, "Parsing Fighters")
+
+    write_url_file('fight_urls.txt', fight_urls)
+    write_url_file('fighter_urls.txt', fighter_urls)
+
+    # The combine stage takes the event dates from the manifest
+    manifest = load_crawl_manifest()
+    for event_url, event in zip(event_urls, events):
+        if event is not None:
+            manifest['events'][event_url], manifest['event_dates'][event_url] = event
+    save_crawl_manifest(manifest)
+
+    # The record files are rebuilt from scratch
+    rewrite_records(FIGHT_DATA_FILE, (page[1] for page in fight_pages))
+    rewrite_records(FIGHTERS_STATS_FILE, (fighter for fighter in fighter_pages if fighter is not None))
+
+    # The combine and diff stages of the pipeline build the dataset from them.
+    # With pages missing, the scrape stage is left to run again and fetch them.
+    complete = events_complete and fights_complete
+    return finish_large_dataset(event_urls, done_stages=('scrape', 'extract') if complete else ('extract',))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rebuild the dataset from archived pages without crawling')
+    parser.add_argument('--archive', default=DEFAULT_ARCHIVE, help='page archive path, without extension')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='urls per work unit')
+    args = parser.parse_args()
+
+    dataset = reparse(args.archive, args.workers, args.chunk_size)
+    print(" Dataset re-parse complete!")
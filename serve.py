@@ -0,0 +1,177 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from model_registry import list_versions
+from predictor import FightPredictor
+
+
+# Local prediction service. The predictor is loaded once at startup and shared
+# by every request thread. POST /reload loads another registered model version
+# (or the latest one) next to the running one and swaps it in, so requests
+# never wait for a load.
+#
+#   python serve.py --port 8000
+#   curl 'http://127.0.0.1:8000/predict?red=Fighter+A&blue=Fighter+B&weight_class=Lightweight'
+#   curl -X POST -d '{"version": "20250101-120000-abcdef12"}' http://127.0.0.1:8000/reload
+#   python serve.py --benchmark 5000
+
+# Fight fields a request may set, with their types
+FIGHT_FIELDS = {'weight_class': str, 'gender': str, 'is_title_bout': int, 'total_rounds': int}
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, Nagle's algorithm
+    # holds the body back for a delayed ACK on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            predictor = self.server.predictor
+            self._reply(200, {'status': 'ok', 'model': predictor.model_path, 'fighters': len(predictor.profiles)})
+        elif url.path == '/predict':
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            self._predict(query)
+        else:
+            self._reply(404, {'error': f'unknown path {url.path}'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._reply(400, {'error': 'body is not valid JSON'})
+            return
+
+        if url.path == '/predict':
+            self._predict(body)
+        elif url.path == '/reload':
+            self._reload(body.get('version'))
+        else:
+            self._reply(404, {'error': f'unknown path {url.path}'})
+
+    def _reload(self, version):
+        # One reload at a time. The new predictor is built completely before the
+        # reference is swapped, so in-flight requests finish on the old one.
+        # The version names a directory of the registry, so only registered ones are accepted
+        if version is not None and version not in {manifest['version'] for manifest in list_versions()}:
+            self._reply(400, {'error': f'unknown model version {version!r}'})
+            return
+
+        with self.server.reload_lock:
+            try:
+                predictor = FightPredictor.from_registry(version)
+            except (OSError, ValueError) as e:
+                # A missing or corrupt model keeps the current one in service
+                self._reply(400, {'error': str(e)})
+                return
+            self.server.predictor = predictor
+        self._reply(200, {'status': 'ok', 'model': predictor.model_path})
+
+    def _predict(self, params):
+        if 'red' not in params or 'blue' not in params:
+            self._reply(400, {'error': 'red and blue are required'})
+            return
+
+        try:
+            fight = {name: cast(params[name]) for name, cast in FIGHT_FIELDS.items() if name in params}
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+            return
+
+        try:
+            self._reply(200, self.server.predictor.predict(params['red'], params['blue'], **fight))
+        except KeyError as e:
+            self._reply(404, {'error': e.args[0]})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(predictor, host='127.0.0.1', port=8000):
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.daemon_threads = True
+    server.predictor = predictor
+    server.reload_lock = threading.Lock()
+    return server
+
+
+def start_server(predictor, host='127.0.0.1', port=8000):
+    # Serve from a background thread, for benchmarks and tests
+    server = make_server(predictor, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _percentiles(latencies):
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e6
+    return f"p50 {pick(0.50):.0f}us, p99 {pick(0.99):.0f}us, max {latencies[-1] * 1e6:.0f}us"
+
+
+def benchmark(predictor, requests=5000):
+    # Latency of predict() in process and of /predict over one keep-alive connection
+    names = [profile['name'] for profile in predictor.profiles.values()]
+    pairs = [random.sample(names, 2) for _ in range(requests)]
+
+    for red, blue in pairs[:100]:
+        predictor.predict(red, blue)
+
+    latencies = []
+    for red, blue in pairs:
+        start = time.perf_counter()
+        predictor.predict(red, blue)
+        latencies.append(time.perf_counter() - start)
+    print(f" In process, {requests} predictions: {_percentiles(latencies)}")
+
+    server = start_server(predictor, port=0)
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+    latencies = []
+    for red, blue in pairs:
+        start = time.perf_counter()
+        connection.request('GET', '/predict?' + urlencode({'red': red, 'blue': blue}))
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+    server.shutdown()
+    print(f" Over HTTP, {requests} requests: {_percentiles(latencies)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve fight predictions over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--benchmark', type=int, metavar='REQUESTS', default=None,
+                        help='measure prediction latency instead of serving')
+    parser.add_argument('--model', default=None,
+                        help='model file or .npz tree export (default: latest registered model)')
+    parser.add_argument('--version', default=None, help='registered model version to serve')
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    predictor = FightPredictor(args.model) if args.model else FightPredictor.from_registry(args.version)
+    print(f" Loaded the model and {len(predictor.profiles)} fighter profiles in {time.monotonic() - start:.2f}s")
+
+    if args.benchmark:
+        benchmark(predictor, args.benchmark)
+    else:
+        server = make_server(predictor, args.host, args.port)
+        print(f" Serving predictions on http://{args.host}:{args.port}/predict")
+        server.serve_forever()
@@ -1,45 +1,50 @@
+import argparse
+
 import pandas as pd
 import xgboost as xgb
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
-import joblib
+from sklearn.metrics import accuracy_score, classification_report, confusion_matrix, log_loss
 import matplotlib.pyplot as plt
 
-
-
-#load data
-df = pd.read_csv('ufc_preprocessed_train_data.csv')
-
-
-# Fix: One-hot encode remaining object-type columns
-categorical_cols = df.select_dtypes(include='object').columns.tolist()
-df = pd.get_dummies(df, columns=categorical_cols)
-
-
-# Add engineered matchup features
-df['reach_advantage'] = df['red_reach_cm'] - df['blue_reach_cm']
-df['strike_accuracy_diff'] = df['red_significant_strike_accuracy'] - df['blue_significant_strike_accuracy']
-df['takedown_accuracy_diff'] = df['red_takedown_accuracy'] - df['blue_takedown_accuracy']
-df['defense_diff'] = df['red_significant_strike_defense'] - df['blue_significant_strike_defense']
-
-
-#split features and target
-x = df.drop(columns=['winner_encoded'])
-y = df['winner_encoded']
-
-#Split into training and test sets
-x_train, x_test, y_train, y_test = train_test_split(x,y, test_size=0.2, random_state=42 , stratify= y)
+from model_registry import file_fingerprint, save_model
+from dataset_schema import DATASET_FILE
+from feature_cache import load_features
+from incremental import TRAIN_PARAMS, train_incremental
+from preprocessing import PREPROCESSOR_FILE, TRAIN_DATA_FILE, load_fight_keys
+
+
+parser = argparse.ArgumentParser(description='Train the fight model and save it in the model registry')
+parser.add_argument('--incremental', action='store_true',
+                    help='add rounds for new fights to the latest registered model, refitting only if that fails '
+                         '(fight_model.pkl is never extended, see incremental.py)')
+args = parser.parse_args()
+
+if args.incremental:
+    version = train_incremental()
+    if version is not None:
+        print(f"\nModel version {version} is up to date")
+        raise SystemExit
+    print("\nRefitting the model on all fights")
+
+
+#load data, split into features and target. The matrix is memory-mapped from
+#the feature cache, and only decoded from the parquet file when that changed.
+x, y, columns = load_features(TRAIN_DATA_FILE, PREPROCESSOR_FILE)
+x = pd.DataFrame(x, columns=columns, copy=False)
+keys = load_fight_keys(DATASET_FILE)
+if len(keys) != len(x):
+    raise ValueError(f"{TRAIN_DATA_FILE} does not match {DATASET_FILE}; run prepare_ufc_data.py again")
+
+#Split into training and test sets, keeping which fights went where
+x_train, x_test, y_train, y_test, keys_train, keys_test = train_test_split(
+    x, y, keys, test_size=0.2, random_state=42, stratify=y
+)
 
 
 
 #train XGBoost Classifier
-model = xgb.XGBClassifier(
-    n_estimators=200,
-    learning_rate=0.2,
-    max_depth=5,
-    eval_metric='logloss',
-    random_state=42
-)
+params = dict(TRAIN_PARAMS)
+model = xgb.XGBClassifier(**params)
 
 model.fit(x_train, y_train)
 
@@ -57,9 +62,16 @@ print(confusion_matrix(y_test, y_pred))
 
 
 
-# Save the model
-joblib.dump(model, 'fight_model.pkl')
-print("\nSaved trained model as fight_model.pkl")
+# Save the model as a new version in the model registry, in xgboost's native format
+metrics = {
+    'accuracy': float(accuracy_score(y_test, y_pred)),
+    'log_loss': float(log_loss(y_test, model.predict_proba(x_test)[:, 1], labels=[0, 1])),
+    'train_rows': len(x_train),
+    'test_rows': len(x_test),
+}
+version = save_model(model, file_fingerprint(DATASET_FILE), metrics, params, PREPROCESSOR_FILE,
+                     fights={'train': keys_train, 'holdout': keys_test})
+print(f"\nSaved trained model as version {version} in the model registry")
 
 
 # # Feature Importance Plot
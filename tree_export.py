@@ -0,0 +1,238 @@
+import argparse
+import json
+import math
+import time
+
+import numpy as np
+
+from model_registry import resolve_model
+
+
+# Array-backed copy of the trained booster and a NumPy evaluator for it, so
+# scoring needs neither xgboost nor joblib nor unpickling fight_model.pkl.
+#
+#   python tree_export.py                      latest registered model -> fight_model_trees.npz
+#   python tree_export.py --benchmark 10000    compare against the native predictor
+#
+# Every tree is stored as a perfect binary tree of the ensemble's depth: node i
+# has children 2i+1 and 2i+2, so walking down needs no child pointers. A leaf
+# above the bottom level is copied into every bottom slot below it. Each step
+# of the walk is then a handful of NumPy gathers over all rows and trees at once.
+
+TREES_FILE = 'fight_model_trees.npz'
+
+# Objectives whose margin maps to a prediction with these functions
+OBJECTIVES = {
+    'binary:logistic': 'sigmoid',
+    'reg:logistic': 'sigmoid',
+    'binary:logitraw': 'identity',
+    'reg:squarederror': 'identity',
+}
+
+# Rows are evaluated in chunks, so the (rows x trees) node index array stays small
+CHUNK_ROWS = 256
+
+# A perfect tree has 2 ** depth leaves, which bounds the depth that can be exported
+MAX_DEPTH = 16
+
+
+def _load_booster(model_path):
+    # Only exporting and benchmarking need xgboost, so it is not imported at the top.
+    # fight_model.pkl holds a pickled XGBClassifier; anything else is a native xgboost model file.
+    import xgboost as xgb
+
+    if model_path.endswith('.pkl'):
+        import joblib
+        model = joblib.load(model_path)
+        return model.get_booster() if hasattr(model, 'get_booster') else model
+    return xgb.Booster(model_file=model_path)
+
+
+def _load_booster_json(model_path):
+    return json.loads(_load_booster(model_path).save_raw('json'))
+
+
+def _parse_float(value):
+    # base_score is saved as "5E-1" by older versions and "[5E-1]" by newer ones
+    return float(str(value).strip('[]'))
+
+
+def export_trees(model_json):
+    learner = model_json['learner']
+    objective = learner['objective']['name']
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Objective {objective} is not supported by the tree evaluator")
+    if int(learner['learner_model_param'].get('num_class', '0')) > 1:
+        raise ValueError("Multi-class models are not supported by the tree evaluator")
+
+    base_score = _parse_float(learner['learner_model_param']['base_score'])
+    link = OBJECTIVES[objective]
+    base_margin = math.log(base_score / (1.0 - base_score)) if link == 'sigmoid' else base_score
+
+    trees = learner['gradient_booster']['model']['trees']
+    for tree in trees:
+        # Dumps from xgboost versions without categorical support have no split_type; every split is numeric
+        if any(tree.get('split_type', ())):
+            raise ValueError("Categorical splits are not supported by the tree evaluator")
+
+    depth = max((_tree_depth(tree) for tree in trees), default=0)
+    if depth > MAX_DEPTH:
+        raise ValueError(f"Trees deeper than {MAX_DEPTH} levels are not supported by the tree evaluator")
+
+    internal = 2 ** depth - 1
+    feature = np.zeros((len(trees), internal), dtype=np.int32)
+    # xgboost compares float32 feature values with float32 thresholds
+    threshold = np.zeros((len(trees), internal), dtype=np.float32)
+    default_left = np.zeros((len(trees), internal), dtype=bool)
+    leaf_value = np.zeros((len(trees), 2 ** depth), dtype=np.float32)
+
+    for t, tree in enumerate(trees):
+        # (node in the xgboost tree, slot in the perfect tree, level)
+        stack = [(0, 0, 0)]
+        while stack:
+            node, slot, level = stack.pop()
+            left = tree['left_children'][node]
+            if level == depth:
+                leaf_value[t, slot - internal] = tree['split_conditions'][node]
+            elif left == -1:
+                # Leaf above the bottom: both children repeat it, whichever way the row goes
+                stack.append((node, 2 * slot + 1, level + 1))
+                stack.append((node, 2 * slot + 2, level + 1))
+            else:
+                feature[t, slot] = tree['split_indices'][node]
+                threshold[t, slot] = tree['split_conditions'][node]
+                default_left[t, slot] = bool(tree['default_left'][node])
+                stack.append((left, 2 * slot + 1, level + 1))
+                stack.append((tree['right_children'][node], 2 * slot + 2, level + 1))
+
+    return {
+        'feature': feature,
+        'threshold': threshold,
+        'default_left': default_left,
+        'leaf_value': leaf_value,
+        'base_margin': np.array(base_margin),
+        'link': np.array(link),
+        'feature_names': np.array(learner.get('feature_names') or [], dtype=str),
+    }
+
+
+def _tree_depth(tree):
+    depth = 0
+    stack = [(0, 0)]
+    while stack:
+        node, level = stack.pop()
+        left = tree['left_children'][node]
+        if left == -1:
+            depth = max(depth, level)
+        else:
+            stack.append((left, level + 1))
+            stack.append((tree['right_children'][node], level + 1))
+    return depth
+
+
+def export_model(model_path, out_path=TREES_FILE):
+    arrays = export_trees(_load_booster_json(model_path))
+    np.savez(out_path, **arrays)
+    return out_path
+
+
+class TreeEnsemble:
+    def __init__(self, arrays):
+        self.tree_count, internal = arrays['feature'].shape
+        self.depth = arrays['leaf_value'].shape[1].bit_length() - 1
+        # Flat tables; row t of a table starts at t * internal (or t * leaves)
+        self.feature = arrays['feature'].ravel()
+        self.threshold = arrays['threshold'].ravel()
+        self.default_left = arrays['default_left'].ravel()
+        self.leaf_value = arrays['leaf_value'].ravel()
+        self._node_base = np.arange(self.tree_count) * internal
+        self._leaf_base = np.arange(self.tree_count) * 2 ** self.depth - internal
+        self.base_margin = float(arrays['base_margin'])
+        self.link = str(arrays['link'])
+        self.feature_names = [str(name) for name in arrays['feature_names']] or None
+
+    @classmethod
+    def load(cls, path=TREES_FILE):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    def _leaves(self, x):
+        # Flat leaf index reached in every tree by every row
+        nodes = np.zeros((len(x), self.tree_count), dtype=np.intp)
+        # Rows are read through one flat view of x
+        row_offsets = np.arange(len(x))[:, None] * x.shape[1]
+        flat_x = np.ascontiguousarray(x).ravel()
+        for _ in range(self.depth):
+            flat = nodes + self._node_base
+            values = flat_x[row_offsets + self.feature[flat]]
+            # Missing values follow the default direction of the split
+            go_left = (values < self.threshold[flat]) | (np.isnan(values) & self.default_left[flat])
+            nodes = 2 * nodes + 2 - go_left
+        return nodes + self._leaf_base
+
+    def predict_margin(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        margins = np.empty(len(x))
+        for start in range(0, len(x), CHUNK_ROWS):
+            chunk = x[start:start + CHUNK_ROWS]
+            margins[start:start + len(chunk)] = self.leaf_value[self._leaves(chunk)].sum(axis=1, dtype=np.float64)
+        return margins + self.base_margin
+
+    def predict(self, x):
+        margins = self.predict_margin(x)
+        if self.link == 'sigmoid':
+            return 1.0 / (1.0 + np.exp(-margins))
+        return margins
+
+
+def benchmark(model_path, rows=10000, single=2000):
+    booster = _load_booster(model_path)
+    model_json = json.loads(booster.save_raw('json'))
+    ensemble = TreeEnsemble(export_trees(model_json))
+
+    # Random rows on the scale of the standardised training data, with some missing values
+    rng = np.random.default_rng(0)
+    n_features = int(model_json['learner']['learner_model_param']['num_feature'])
+    x = rng.normal(size=(rows, n_features))
+    x[rng.random(x.shape) < 0.05] = np.nan
+
+    native = booster.inplace_predict(x, validate_features=False)
+    ours = ensemble.predict(x)
+    print(f" {ensemble.tree_count} trees of depth {ensemble.depth}")
+    print(f" Largest probability difference over {rows} rows: {np.abs(native - ours).max():.2e}")
+
+    for name, predict in (('xgboost', lambda rows: booster.inplace_predict(rows, validate_features=False)),
+                          ('numpy', ensemble.predict)):
+        start = time.perf_counter()
+        predict(x)
+        batch = time.perf_counter() - start
+
+        latencies = []
+        for i in range(single):
+            row = x[i:i + 1]
+            start = time.perf_counter()
+            predict(row)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print(f" {name}: batch of {rows} in {batch * 1000:.1f}ms, single row p50 "
+              f"{latencies[len(latencies) // 2] * 1e6:.0f}us, p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export the booster to arrays for the NumPy tree evaluator')
+    parser.add_argument('--model', default=None, help='model file (default: latest registered model)')
+    parser.add_argument('--out', default=TREES_FILE)
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', default=None,
+                        help='compare the evaluator with the native predictor')
+    args = parser.parse_args()
+
+    if args.model is None:
+        args.model = resolve_model()[0]
+
+    if args.benchmark:
+        benchmark(args.model, args.benchmark)
+    else:
+        export_model(args.model, args.out)
+        print(f" Exported {args.model} to {args.out}")
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xgboost as xgb
+from hyperopt import JOB_STATE_DONE, STATUS_OK, Trials, hp, space_eval, tpe
+from hyperopt.base import Domain
+from sklearn.metrics import accuracy_score, log_loss
+from sklearn.model_selection import train_test_split
+
+from model_registry import file_fingerprint, save_model
+from dataset_schema import DATASET_FILE
+from feature_cache import entry_path, load_entry
+from incremental import booster_params
+from preprocessing import PREPROCESSOR_FILE, TRAIN_DATA_FILE, load_fight_keys
+from record_store import RecordWriter
+
+
+# Hyperparameter search for the fight model with hyperopt's TPE.
+#
+#   python tune.py --trials 60 --workers 4
+#
+# Trials are evaluated in batches, one per worker process. Every worker maps
+# the cached feature matrix (see feature_cache.py), builds its training and
+# validation DMatrix once and reuses them for all its trials.
+# Each trial trains with early stopping on the validation split, and is cut
+# short when its validation loss is worse than the median of the finished
+# trials at the same round. Every trial is appended to tuning_trials.jsonl; the
+# best configuration goes to best_params.json and its model into the registry.
+
+TRIALS_LOG_FILE = 'tuning_trials.jsonl'
+BEST_PARAMS_FILE = 'best_params.json'
+
+MAX_ROUNDS = 1000
+EARLY_STOPPING_ROUNDS = 50
+
+# Rounds at which a trial is compared with the finished ones
+PRUNE_ROUNDS = (25, 50, 100, 200, 400)
+
+# The same held-out test split as train.py, and a validation split for early stopping
+TEST_SIZE = 0.2
+VALID_SIZE = 0.2
+RANDOM_STATE = 42
+
+SPACE = {
+    'max_depth': hp.quniform('max_depth', 2, 8, 1),
+    'learning_rate': hp.loguniform('learning_rate', np.log(0.01), np.log(0.3)),
+    'min_child_weight': hp.loguniform('min_child_weight', np.log(1), np.log(32)),
+    'subsample': hp.uniform('subsample', 0.5, 1.0),
+    'colsample_bytree': hp.uniform('colsample_bytree', 0.3, 1.0),
+    'gamma': hp.uniform('gamma', 0.0, 5.0),
+    'reg_lambda': hp.loguniform('reg_lambda', np.log(0.1), np.log(20)),
+    'reg_alpha': hp.loguniform('reg_alpha', np.log(1e-3), np.log(10)),
+}
+
+BASE_PARAMS = {
+    'objective': 'binary:logistic',
+    'eval_metric': 'logloss',
+    'tree_method': 'hist',
+    'seed': RANDOM_STATE,
+}
+
+
+class MedianPruning(xgb.callback.TrainingCallback):
+    # Stop a trial whose validation loss at a checkpoint round is worse than the
+    # median loss of the finished trials at that round
+    def __init__(self, medians):
+        super().__init__()
+        self.medians = medians
+        self.pruned_at = None
+
+    def after_iteration(self, model, epoch, evals_log):
+        round_number = epoch + 1
+        median = self.medians.get(round_number)
+        if median is None:
+            return False
+        loss = evals_log['valid']['logloss'][-1]
+        if loss > median:
+            self.pruned_at = round_number
+            return True
+        return False
+
+
+# Built once in every worker process
+_dtrain = None
+_dvalid = None
+_nthread = 1
+
+
+def _init_worker(entry, fit_rows, valid_rows, nthread):
+    global _dtrain, _dvalid, _nthread
+    x, y, feature_names = load_entry(entry)
+    _dtrain = xgb.DMatrix(x[fit_rows], label=y[fit_rows], feature_names=feature_names, nthread=nthread)
+    _dvalid = xgb.DMatrix(x[valid_rows], label=y[valid_rows], feature_names=feature_names, nthread=nthread)
+    _nthread = nthread
+
+
+def _run_trial(tid, params, medians):
+    start = time.monotonic()
+    pruning = MedianPruning(medians)
+    evals_log = {}
+    booster = xgb.train(
+        booster_params({**BASE_PARAMS, **params}, _nthread), _dtrain, num_boost_round=MAX_ROUNDS,
+        evals=[(_dvalid, 'valid')], evals_result=evals_log,
+        early_stopping_rounds=EARLY_STOPPING_ROUNDS, callbacks=[pruning], verbose_eval=False,
+    )
+    curve = evals_log['valid']['logloss']
+    best_iteration = booster.best_iteration if pruning.pruned_at is None else len(curve) - 1
+    return {
+        'trial': tid,
+        'params': params,
+        'loss': float(min(curve)),
+        'best_iteration': int(best_iteration),
+        'rounds': len(curve),
+        'pruned_at': pruning.pruned_at,
+        'seconds': round(time.monotonic() - start, 3),
+        'curve': {r: curve[r - 1] for r in PRUNE_ROUNDS if r <= len(curve)},
+    }
+
+
+def _checkpoint_medians(results):
+    # Median validation loss at every checkpoint, over the trials that got there
+    medians = {}
+    for round_number in PRUNE_ROUNDS:
+        losses = [result['curve'][round_number] for result in results if round_number in result['curve']]
+        if len(losses) >= 3:
+            medians[round_number] = float(np.median(losses))
+    return medians
+
+
+def _suggest(domain, trials, count, rng):
+    # Ask TPE for count new configurations, given every finished trial
+    new_ids = trials.new_trial_ids(count)
+    docs = tpe.suggest(new_ids, domain, trials, int(rng.integers(2 ** 31 - 1)))
+    trials.insert_trial_docs(docs)
+    trials.refresh()
+
+    suggestions = []
+    for doc in docs:
+        vals = {name: values[0] for name, values in doc['misc']['vals'].items() if values}
+        params = space_eval(SPACE, vals)
+        params['max_depth'] = int(params['max_depth'])
+        suggestions.append((doc, params))
+    return suggestions
+
+
+def tune(max_trials=50, workers=None, log_path=TRIALS_LOG_FILE):
+    workers = workers or os.cpu_count() or 1
+    nthread = max(1, (os.cpu_count() or 1) // workers)
+
+    entry = entry_path(TRAIN_DATA_FILE, PREPROCESSOR_FILE)
+    x, y, feature_names = load_entry(entry)
+    keys = load_fight_keys(DATASET_FILE)
+    if len(keys) != len(x):
+        raise ValueError(f"{TRAIN_DATA_FILE} does not match {DATASET_FILE}; run prepare_ufc_data.py again")
+
+    # Splits of row numbers, so workers take their rows from the shared mapping
+    rows_train, rows_test, y_train, y_test, keys_train, keys_test = train_test_split(
+        np.arange(len(y)), y, keys, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y
+    )
+    rows_fit, rows_valid = train_test_split(
+        rows_train, test_size=VALID_SIZE, random_state=RANDOM_STATE, stratify=y_train
+    )
+
+    domain = Domain(lambda params: None, SPACE)
+    trials = Trials()
+    rng = np.random.default_rng(RANDOM_STATE)
+    results = []
+    start = time.monotonic()
+
+    print(f" Tuning on {len(rows_fit)} rows ({len(rows_valid)} for validation), "
+          f"{workers} workers with {nthread} threads each")
+    with RecordWriter(log_path) as log, ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker,
+        initargs=(entry, rows_fit, rows_valid, nthread)
+    ) as executor:
+        while len(results) < max_trials:
+            batch = _suggest(domain, trials, min(workers, max_trials - len(results)), rng)
+            medians = _checkpoint_medians(results)
+            futures = [executor.submit(_run_trial, doc['tid'], params, medians) for doc, params in batch]
+
+            for (doc, _), future in zip(batch, futures):
+                result = future.result()
+                doc['state'] = JOB_STATE_DONE
+                doc['result'] = {'loss': result['loss'], 'status': STATUS_OK}
+                results.append(result)
+                log.write(result)
+
+                best = min(results, key=lambda r: r['loss'])
+                pruned = f", pruned at round {result['pruned_at']}" if result['pruned_at'] else ''
+                print(f" Trial {len(results)}/{max_trials}: log loss {result['loss']:.4f} "
+                      f"in {result['rounds']} rounds{pruned} (best {best['loss']:.4f})")
+            trials.refresh()
+
+    best = min(results, key=lambda r: r['loss'])
+    pruned_count = sum(result['pruned_at'] is not None for result in results)
+    print(f" {len(results)} trials in {time.monotonic() - start:.0f}s, {pruned_count} stopped early")
+
+    # Refit the best configuration on the whole training split, for the rounds early stopping chose
+    rounds = best['best_iteration'] + 1
+    params = booster_params({**BASE_PARAMS, **best['params']}, os.cpu_count() or 1)
+    dtrain = xgb.DMatrix(x[rows_train], label=y_train, feature_names=feature_names)
+    booster = xgb.train(params, dtrain, num_boost_round=rounds)
+
+    probabilities = booster.inplace_predict(x[rows_test])
+    metrics = {
+        'accuracy': float(accuracy_score(y_test, probabilities >= 0.5)),
+        'log_loss': float(log_loss(y_test, probabilities, labels=[0, 1])),
+        'validation_log_loss': best['loss'],
+        'train_rows': len(rows_train),
+        'test_rows': len(rows_test),
+    }
+    best_config = {**params, 'num_boost_round': rounds}
+    with open(BEST_PARAMS_FILE, 'w') as f:
+        json.dump({'params': best_config, 'metrics': metrics, 'trial': best['trial']}, f, indent=1)
+
+    version = save_model(booster, file_fingerprint(DATASET_FILE), metrics, best_config, PREPROCESSOR_FILE,
+                         fights={'train': keys_train, 'holdout': keys_test})
+    print(f" Best trial: log loss {best['loss']:.4f} on validation, accuracy {metrics['accuracy']:.4f} "
+          f"and log loss {metrics['log_loss']:.4f} on the test split")
+    print(f" Saved {BEST_PARAMS_FILE} and model version {version}")
+    return best_config, metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Search XGBoost hyperparameters with hyperopt')
+    parser.add_argument('--trials', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=None, help='parallel trials (default: one per core)')
+    parser.add_argument('--log', default=TRIALS_LOG_FILE, help='trial log, one JSON record per trial')
+    args = parser.parse_args()
+
+    tune(args.trials, args.workers, args.log)